@@ -1,6 +1,10 @@
 // Uncomment this to allow LCD (e.g. LCD1602) for visual checking of command status
 #define USE_LCD
 
+// Uncomment this to number answers and add checksums to them, e.g. `OK 10.5 200 ~17:3A`,
+// along with setting `checksum = True` in board_config.ini
+//#define USE_CHECKSUM
+
 #include "protocol.h"
 
 // Currently runnng command
@@ -14,6 +18,8 @@ union {
 struct {
   float center = 0;
   float step = 0;
+  float distance = SCAN_POINT_DISTANCE;
+  int count = SCAN_POINT_COUNT;
   bool back = false;
   int sent = 0;
 } cmdScanArgs;
@@ -24,6 +30,9 @@ struct {
   float value = 0;
 } cmdParamArgs;
 
+// Number of the next answer, wraps around after 255
+uint8_t answerSeq = 0;
+
 // Stage position
 bool homed = false;
 float position = 0;
@@ -51,6 +60,9 @@ void setup()
   randomSeed(analogRead(A0));
 
   showHello();
+
+  // Let the app know it can stop waiting for reset and start sending commands
+  Serial.println(ANS_READY);
 }
 
 void loop()
@@ -76,6 +88,15 @@ void loop()
       return;
     }
 
+    // SYNC can be sent while another command is running, and it continues.
+    // Answers are sent at once so there is no unsent output to drop,
+    // only the answer tells the app where the sequence continues from.
+    if (newCmd == CMD_SYNC)
+    {
+      sendAnswer(String(ANS_OK) + ' ' + ANS_SYNC);
+      return;
+    }
+
     // STOP command can interrupt other commands
     if (newCmd == CMD_STOP)
     {
@@ -114,15 +135,15 @@ void loop()
       cmdDuration = CMD_JOG_DURATION;
       cmdArg.jogDistance = newCmd.substring(strlen(CMD_JOG)+1).toFloat();
     }
-    else if (newCmd == CMD_SCAN)
+    else if (newCmd.startsWith(CMD_SCAN))
     {
       if (!checkHome()) return;
-      startScan(false);
+      startScan(false, newCmd.substring(strlen(CMD_SCAN)));
     }
-    else if (newCmd == CMD_SCANS)
+    else if (newCmd.startsWith(CMD_SCANS))
     {
       if (!checkHome()) return;
-      startScan(true);
+      startScan(true, newCmd.substring(strlen(CMD_SCANS)));
     }
     else if (newCmd == CMD_PARAM)
     {
@@ -174,11 +195,26 @@ void loop()
   }
 }
 
+void sendAnswer(const String& ans)
+{
+#ifdef USE_CHECKSUM
+  // XOR of all bytes of the answer, and its number
+  uint8_t checksum = 0;
+  for (unsigned int i = 0; i < ans.length(); i++)
+    checksum ^= ans[i];
+  char suffix[12];
+  sprintf(suffix, " ~%u:%02X", answerSeq, checksum);
+  answerSeq++;
+  Serial.print(ans);
+  Serial.println(suffix);
+#else
+  Serial.println(ans);
+#endif
+}
+
 void sendError(int code)
 {
-  Serial.print(ANS_ERR);
-  Serial.print(' ');
-  Serial.println(code);
+  sendAnswer(String(ANS_ERR) + ' ' + code);
 }
 
 bool checkHome()
@@ -196,34 +232,26 @@ void endCommand(bool stopped)
   {
     homed = true;
     position = 0;
-    Serial.print(ANS_OK);
-    Serial.print(' ');
-    Serial.println(position);
+    sendAnswer(String(ANS_OK) + ' ' + String(position));
   }
   else if (cmd == CMD_MOVE)
   {
     position = cmdArg.targetPosition;
-    Serial.print(ANS_OK);
-    Serial.print(' ');
-    Serial.println(position);
+    sendAnswer(String(ANS_OK) + ' ' + String(position));
   }
   else if (cmd == CMD_JOG)
   {
     position += cmdArg.jogDistance;
     if (homed)
-    {
-      Serial.print(ANS_OK);
-      Serial.print(' ');
-      Serial.println(position);
-    }
+      sendAnswer(String(ANS_OK) + ' ' + String(position));
     else
-      Serial.println(ANS_OK);
+      sendAnswer(ANS_OK);
   }
   else if (cmd == CMD_SCAN || cmd == CMD_SCANS)
   {
     if (stopped)
     {
-      Serial.println(ANS_OK);
+      sendAnswer(ANS_OK);
     }
     else
     {
@@ -239,7 +267,7 @@ void endCommand(bool stopped)
       if (cmdParamArgs.index < PARAM_COUNT) {
         if (cmdParamArgs.set) {
           params[cmdParamArgs.index].value = cmdParamArgs.value;
-          Serial.println(ANS_OK);
+          sendAnswer(ANS_OK);
         } else {
           sendParam(cmdParamArgs.index);
         }
@@ -257,7 +285,7 @@ void endCommand(bool stopped)
         return; 
       }
       // Finish sending
-      Serial.println(ANS_OK); 
+      sendAnswer(ANS_OK);
     }
   }
   cmd = CMD_NONE;
@@ -267,13 +295,37 @@ void endCommand(bool stopped)
   showPosition();
 }
 
-void startScan(bool inf)
+void startScan(bool inf, String args)
 {
+  args.trim();
+  if (args.length() > 0)
+  {
+    // Range is given as `start stop step`
+    int split1 = args.indexOf(' ');
+    int split2 = args.indexOf(' ', split1 + 1);
+    float start = args.substring(0, split1).toFloat();
+    float stop = args.substring(split1 + 1, split2).toFloat();
+    float step = args.substring(split2 + 1).toFloat();
+    if (split1 < 0 || split2 < 0 || step <= 0 || stop <= start)
+    {
+      sendError(ERR_CMD_BAD_ARG);
+      return;
+    }
+    // The peak stays where the last full-range scan has found it
+    position = start;
+    cmdScanArgs.distance = step;
+    cmdScanArgs.count = round((stop - start) / step) + 1;
+  }
+  else
+  {
+    cmdScanArgs.center = position + SCAN_HALF_RANGE;
+    cmdScanArgs.distance = SCAN_POINT_DISTANCE;
+    cmdScanArgs.count = SCAN_POINT_COUNT;
+  }
   cmd = inf ? CMD_SCANS : CMD_SCAN;
   cmdDuration = SCAN_POINT_DURATION;
-  cmdScanArgs.center = position + SCAN_HALF_RANGE;
   cmdScanArgs.sent = 0;
-  cmdScanArgs.step = SCAN_POINT_DISTANCE;
+  cmdScanArgs.step = cmdScanArgs.distance;
   cmdScanArgs.back = false;
   // Start scanning from the current position
   sendScanPoint();
@@ -284,18 +336,14 @@ bool sendScanPoint()
   float x = cmdScanArgs.center - position;
   float level = SCAN_PROFILE_AMPLITUDE * exp(-sq(x) / (2.0 * sq(SCAN_PROFILE_WIDTH)));
   float noise = random(-1000, 1000) / 1000.0 * SCAN_PROFILE_AMPLITUDE * SCAN_PROFILE_NOISE;
-  Serial.print(ANS_OK);
-  Serial.print(' ');
-  Serial.print(position);
-  Serial.print(' ');
-  Serial.println(max(0, level + noise));
+  sendAnswer(String(ANS_OK) + ' ' + String(position) + ' ' + String(max(0, level + noise)));
   cmdScanArgs.sent++;
   if (cmdScanArgs.step == 0)
-    cmdScanArgs.step = cmdScanArgs.back ? -SCAN_POINT_DISTANCE : SCAN_POINT_DISTANCE;
-  if (cmdScanArgs.sent == SCAN_POINT_COUNT)
+    cmdScanArgs.step = cmdScanArgs.back ? -cmdScanArgs.distance : cmdScanArgs.distance;
+  if (cmdScanArgs.sent == cmdScanArgs.count)
   {
     // Send addition OK to show the scan is finished
-    Serial.println(ANS_OK);
+    sendAnswer(ANS_OK);
     if (cmd == CMD_SCAN)
     {
       // Finish the command
@@ -322,22 +370,20 @@ bool sendScanPoint()
 
 void sendParam(int i)
 {
-  Serial.print(ANS_OK);
-  Serial.print(' ');
-  Serial.print(params[i].name);
-  Serial.print(' ');
+  String ans = String(ANS_OK) + ' ' + params[i].name + ' ';
   if (i == 0) {
     // This parameter is integer
-    Serial.println((int)params[i].value);
+    ans += (int)params[i].value;
   } else if (i == 1) {
-    // By default, Serial formats floats with 2 decimal digits
+    // By default, floats are formatted with 2 decimal digits
     // So if we know a parameter has a higher resolution,
     // we should configure both - the sending here 
     // and the parameter spec in board_config.ini
-    Serial.println(params[i].value, 3);
+    ans += String(params[i].value, 3);
   } else {
-    Serial.println(params[i].value);
+    ans += String(params[i].value);
   }
+  sendAnswer(ans);
 }
 
 void simulateError()
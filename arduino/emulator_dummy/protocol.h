@@ -13,6 +13,7 @@
 #define CMD_PARAM "$P"
 #define CMD_PARAM_DURATION 100
 #define CMD_ERROR "$DE"
+#define CMD_SYNC "$Y"
 
 #define SCAN_POINT_HALF_COUNT 100
 #define SCAN_POINT_COUNT (2*SCAN_POINT_HALF_COUNT + 1)
@@ -25,6 +26,8 @@
 
 #define ANS_OK "OK"
 #define ANS_ERR "ERR"
+#define ANS_READY "READY"
+#define ANS_SYNC "SYNC"
 #define ERR_OK 0
 #define ERR_UNKNOWN 100 // Unknown error
 #define ERR_CMD_UNKNOWN 101 // Unknown command
@@ -0,0 +1,417 @@
+"""
+Benchmarks of the acquisition, fitting and rendering pipeline.
+Runs headless with the offscreen Qt platform, results can be saved
+and compared with a baseline, the script fails when a metric has regressed.
+
+  python bench.py --output baseline.json
+  python bench.py --baseline baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+from PySide6.QtCore import Qt
+from PySide6.QtWidgets import QApplication
+
+from consts import APP_NAME, APP_VERSION, CMD
+
+GROUPS = ("parse", "fit", "replot", "e2e")
+
+# Scan range of end-to-end runs, 201 points
+E2E_RANGE = (10.0, 30.0, 0.1)
+
+def make_profile(points: int):
+  # Same shape as `utils.make_sample_profile` but reproducible
+  rng = np.random.default_rng(points)
+  xs = np.linspace(10, 30, points)
+  ys = 1000 * np.exp(-((20 - xs)**2) / 8) + rng.normal(0, 50, points)
+  return xs, ys
+
+def measure(func, min_time: float, min_repeats = 3) -> float:
+  """
+  Returns the shortest duration of `func` in seconds,
+  longer runs are slowed down by other processes rather than by the code.
+  """
+  times = []
+  start = time.perf_counter()
+  while len(times) < min_repeats or time.perf_counter() - start < min_time:
+    t = time.perf_counter()
+    func()
+    times.append(time.perf_counter() - t)
+  return min(times)
+
+def wait_until(app: QApplication, cond, timeout: float) -> bool:
+  end = time.perf_counter() + timeout
+  while not cond():
+    if time.perf_counter() > end:
+      return False
+    app.processEvents()
+    time.sleep(0.001)
+  return True
+
+class Results:
+  def __init__(self):
+    self.metrics = {}
+
+  def add(self, name: str, value: float, unit: str, better = "lower"):
+    self.metrics[name] = {"value": value, "unit": unit, "better": better}
+    print(f"  {name:<36} {format_value(value, unit)}", flush=True)
+
+  def to_json(self) -> dict:
+    return {
+      "app": f"{APP_NAME} {APP_VERSION}",
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+      "metrics": self.metrics,
+    }
+
+def format_value(value: float, unit: str) -> str:
+  if unit == "s":
+    if value < 1e-3:
+      return f"{value * 1e6:.1f} µs"
+    if value < 1:
+      return f"{value * 1e3:.2f} ms"
+    return f"{value:.2f} s"
+  return f"{value:,.0f} {unit}"
+
+#-----------------------------------------------------------------------------
+
+def bench_parse(results: Results, quick: bool):
+  """
+  Throughput of handling scan answers by `SerialBoard`, as its loop does it.
+  """
+  from serial_board import SerialBoard
+
+  class ParseBoard(SerialBoard):
+    # Answers are fed directly, the board loop is not needed
+    def loop(self):
+      pass
+
+  board = ParseBoard()
+  board._pipeline = deque()
+  board._apply_config()
+  ok = board._answer_ok
+
+  xs, ys = make_profile(201)
+  sweep = [f"{ok} {x:.2f} {y:.2f}" for x, y in zip(xs, ys)] + [ok]
+  # Signal, reference photodiode and one more channel
+  sweep3 = [f"{ok} {x:.2f} {y:.2f} {y * 0.5 + 100:.2f} {x * 3:.2f}" for x, y in zip(xs, ys)] + [ok]
+
+  def checksummed(line: str, seq: int) -> str:
+    checksum = 0
+    for b in line.encode():
+      checksum ^= b
+    return f"{line} ~{seq % 256}:{checksum:02X}"
+
+  sweeps = 5 if quick else 25
+  plain = [(line + "\r\n").encode() for line in sweep] * sweeps
+  numbered = [(checksummed(line, i) + "\r\n").encode() for i, line in enumerate(sweep * sweeps)]
+  channels = [(line + "\r\n").encode() for line in sweep3] * sweeps
+
+  def run(lines, checksum: bool):
+    board._cmd = CMD.scans
+    board._cmd_args = {}
+    board._start_profile(CMD.scans, 0)
+    board._checksum = checksum
+    board._answer_seq = None
+    for line in lines:
+      ans = line.decode('utf-8', errors='replace').strip()
+      if ans and checksum:
+        ans = board._verify_answer(ans)
+      if ans and ans.startswith(ok):
+        board._command_done(ans)
+
+  min_time = 0.3 if quick else 1.0
+  results.add("parse.lines_per_s", len(plain) / measure(lambda: run(plain, False), min_time), "lines/s", "higher")
+  results.add("parse.checksum_lines_per_s", len(numbered) / measure(lambda: run(numbered, True), min_time), "lines/s", "higher")
+  board.config.set_value(f"commands/{CMD.scans.value}/channels", ["signal", "reference", "aux"])
+  board.config.set_value(f"commands/{CMD.scans.value}/reference", "reference")
+  results.add("parse.channels3_lines_per_s", len(channels) / measure(lambda: run(channels, False), min_time), "lines/s", "higher")
+  board._cmd = None
+
+def bench_fit(results: Results, quick: bool):
+  """
+  Fitting latency of each model and of choosing the best one, by point count.
+  """
+  from fitting import FIT, FIT_FUNCS, fit_models, fit_profile
+
+  counts = (201, 2001, 20001) if quick else (201, 2001, 20001, 200001)
+  min_time = 0.2 if quick else 1.0
+  for points in counts:
+    xs, ys = make_profile(points)
+    for fit_type in FIT_FUNCS:
+      results.add(f"fit.{fit_type.name}.{points}", measure(lambda: fit_profile(xs, ys, fit_type, True), min_time), "s")
+    results.add(f"fit.{FIT.auto.name}.{points}", measure(lambda: fit_models(xs, ys, True), min_time), "s")
+
+def make_view(backend: str):
+  from config import Config
+  from pipeline import Pipeline
+  from roi import FitRoi
+  if backend == "fast":
+    from fast_plot import FastPlot as View
+  else:
+    from plot import Plot as View
+  config = Config("board_config.ini")
+  view = View()
+  view.pipeline = Pipeline(config)
+  view.fit_roi = FitRoi(config)
+  view.resize(1000, 700)
+  view.show()
+  return view
+
+def bench_replot(results: Results, quick: bool):
+  """
+  Time of redrawing the current profile, fits are cached and not repeated.
+  """
+  counts = (2001, 20001) if quick else (2001, 20001, 200001)
+  min_time = 0.3 if quick else 1.0
+  for backend in ("matplotlib", "fast"):
+    view = make_view(backend)
+    for points in counts:
+      view.draw_graph(*make_profile(points))
+      view.repaint()
+      def redraw():
+        view._replot()
+        view.repaint()
+      results.add(f"replot.{backend}.{points}", measure(redraw, min_time), "s")
+    view.close()
+
+class PtyFirmware:
+  """
+  Firmware emulator on a pseudo-terminal, it answers scan points as fast as the port takes them.
+  """
+  def __init__(self, config):
+    import pty
+    import tty
+    self.master, slave = pty.openpty()
+    tty.setraw(slave)
+    self.port = os.ttyname(slave)
+    os.set_blocking(self.master, False)
+    self._slave = slave
+    self._names = {config.cmd_spec(cmd).serial_name: cmd for cmd in (CMD.home, CMD.stop, CMD.scan, CMD.scans)}
+    self._ok = config.value("commands/answer_ok")
+    self._scanning = None
+    self._closed = False
+    self._rng = random.Random(0)
+    threading.Thread(target=self._read_loop, daemon=True).start()
+
+  def close(self):
+    self._closed = True
+    self._scanning = None
+    os.close(self.master)
+    os.close(self._slave)
+
+  def _send(self, line: str):
+    import select
+    data = (line + "\r\n").encode()
+    while data and not self._closed:
+      try:
+        data = data[os.write(self.master, data):]
+      except BlockingIOError:
+        select.select([], [self.master], [], 0.1)
+      except OSError:
+        return
+
+  def _read_loop(self):
+    import select
+    buf = b""
+    while not self._closed:
+      try:
+        if not select.select([self.master], [], [], 0.1)[0]:
+          continue
+        buf += os.read(self.master, 1024)
+      except (BlockingIOError, ValueError):
+        continue
+      except OSError:
+        return
+      *lines, buf = buf.split(b"\n")
+      for line in lines:
+        self._handle(line.decode().strip())
+
+  def _handle(self, line: str):
+    if not line:
+      return
+    name, *args = line.split()
+    cmd = self._names.get(name)
+    if cmd == CMD.stop:
+      scanning, self._scanning = self._scanning, None
+      if scanning:
+        scanning.join()
+      self._send(self._ok)
+    elif cmd == CMD.home:
+      self._send(f"{self._ok} 0")
+    elif cmd in (CMD.scan, CMD.scans):
+      start, stop, step = (float(a) for a in args) if args else E2E_RANGE
+      xs = np.arange(int(round((stop - start) / step)) + 1) * step + start
+      self._scanning = threading.Thread(target=self._scan, args=(xs, cmd == CMD.scans), daemon=True)
+      self._scanning.start()
+    else:
+      self._send(self._ok)
+
+  def _scan(self, xs, continuous: bool):
+    me = threading.current_thread()
+    while True:
+      for x in xs:
+        if self._scanning is not me:
+          return
+        y = 1000 * np.exp(-((20 - x)**2) / 8) + self._rng.uniform(-50, 50)
+        self._send(f"{self._ok} {x:.2f} {y:.2f}")
+      self._send(self._ok)
+      if not continuous:
+        return
+      xs = xs[::-1]
+
+class ScreenProbe:
+  """
+  Draws received profiles and measures time from their emission by the board to the drawn plot.
+  """
+  def __init__(self, board, view):
+    self.view = view
+    self.points = 0
+    self.latencies = []
+    self._emitted = deque()
+    # Connected first to be called before the GUI thread gets the profile
+    board.on_data_received.connect(self._stamp, Qt.DirectConnection)
+    board.on_data_received.connect(self._draw)
+
+  def _stamp(self, profile):
+    self._emitted.append(time.perf_counter())
+
+  def _draw(self, profile):
+    self.view.draw_graph(profile.xs, profile.ys)
+    self.view.repaint()
+    self.points += len(profile)
+    self.latencies.append(time.perf_counter() - self._emitted.popleft())
+
+def run_e2e(app: QApplication, results: Results, name: str, board, duration: float):
+  view = make_view("matplotlib")
+  probe = ScreenProbe(board, view)
+  board.toggle_connection()
+  if not wait_until(app, lambda: board.connected and board.can_home, 10):
+    raise Exception(f"{name}: board not connected")
+  board.home()
+  if not wait_until(app, lambda: board.homed and board.can_move, 10):
+    raise Exception(f"{name}: board not homed")
+  board.scans(*E2E_RANGE)
+  # The first sweep includes warming up of the plot
+  wait_until(app, lambda: probe.latencies, 10)
+  probe.points = 0
+  probe.latencies = []
+  start = time.perf_counter()
+  wait_until(app, lambda: False, duration)
+  elapsed = time.perf_counter() - start
+  points = probe.points
+  latencies = probe.latencies
+  board.toggle_connection()
+  wait_until(app, lambda: not board.connected and board.can_connect, 10)
+  view.close()
+  if not latencies:
+    raise Exception(f"{name}: no profiles received")
+  results.add(f"e2e.{name}.points_per_s", points / elapsed, "points/s", "higher")
+  results.add(f"e2e.{name}.latency_median", float(np.median(latencies)), "s")
+  results.add(f"e2e.{name}.latency_p95", float(np.percentile(latencies, 95)), "s")
+
+def bench_e2e(app: QApplication, results: Results, quick: bool):
+  """
+  Continuous scanning from the board to the screen.
+  """
+  duration = 3 if quick else 10
+  from virtual_board import VirtualBoard
+  run_e2e(app, results, "virtual", VirtualBoard(), duration)
+
+  if sys.platform == "win32":
+    print("  Serial benchmark needs a pseudo-terminal, skipped")
+    return
+  from serial_board import SerialBoard
+  board = SerialBoard()
+  board.config.set_value("connection/reset_on_connect", False)
+  board.config.set_value("commands/checksum", False)
+  board.config.set_value("commands/pipeline_depth", 1)
+  board.auto_window = False
+  firmware = PtyFirmware(board.config)
+  board.config.set_value("connection/port", firmware.port)
+  try:
+    run_e2e(app, results, "serial", board, duration)
+  finally:
+    firmware.close()
+
+#-----------------------------------------------------------------------------
+
+def compare(metrics: dict, baseline: dict, threshold: float) -> list:
+  """
+  Prints metrics against the baseline and returns names of regressed ones.
+  """
+  regressed = []
+  print(f"\n{'metric':<36} {'value':>16} {'baseline':>16} {'change':>8}")
+  for name, m in metrics.items():
+    base = baseline.get(name)
+    line = f"{name:<36} {format_value(m['value'], m['unit']):>16}"
+    if not base or not base["value"]:
+      print(line)
+      continue
+    change = m["value"] / base["value"] - 1
+    # Positive when the metric got worse
+    worse = change if m["better"] == "lower" else -change
+    status = ""
+    if worse > threshold:
+      status = "  REGRESSED"
+      regressed.append(name)
+    elif worse < -threshold:
+      status = "  improved"
+    print(f"{line} {format_value(base['value'], m['unit']):>16} {change * 100:+7.1f}%{status}")
+  return regressed
+
+def main():
+  parser = argparse.ArgumentParser(description=f"{APP_NAME} benchmarks")
+  parser.add_argument("--only", nargs="+", choices=GROUPS, default=GROUPS, help="Run only these benchmarks")
+  parser.add_argument("--quick", action="store_true", help="Fewer repeats and smaller profiles")
+  parser.add_argument("--output", help="Save results to a JSON file, it can be used as a baseline later")
+  parser.add_argument("--baseline", help="Compare results with the ones saved before")
+  parser.add_argument("--threshold", type=float, default=0.25,
+    help="Relative change of a metric considered as regression (default: 0.25)")
+  args = parser.parse_args()
+
+  baseline = None
+  if args.baseline:
+    with open(args.baseline, "r") as f:
+      baseline = json.load(f)
+    if baseline.get("python") != platform.python_version() or baseline.get("platform") != platform.platform():
+      print(f"Baseline is from another environment: Python {baseline.get('python')}, {baseline.get('platform')}")
+
+  app = QApplication(sys.argv)
+  results = Results()
+  benches = {
+    "parse": lambda: bench_parse(results, args.quick),
+    "fit": lambda: bench_fit(results, args.quick),
+    "replot": lambda: bench_replot(results, args.quick),
+    "e2e": lambda: bench_e2e(app, results, args.quick),
+  }
+  for group in GROUPS:
+    if group in args.only:
+      print(f"{group}:", flush=True)
+      benches[group]()
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(results.to_json(), f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+  if baseline:
+    regressed = compare(results.metrics, baseline["metrics"], args.threshold)
+    if regressed:
+      print(f"\n{len(regressed)} metrics regressed by more than {args.threshold * 100:.0f}%: {', '.join(regressed)}")
+      return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
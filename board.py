@@ -1,22 +1,26 @@
 import logging
 import threading
+import time
+from collections import deque
 from PySide6.QtCore import QObject, Signal
 
 from config import Config
 from consts import CMD
+from profiling import ThreadProfiler
+from scan_profile import ProfileBuffers, ScanProfile
+from scan_window import ScanWindow
+from utils import load_state, save_state
 
 board = None
 
 class Board(QObject):
   on_command_beg = Signal(CMD)
   on_command_end = Signal(CMD, str)
-  on_data_received = Signal(list, list)
+  on_data_received = Signal(ScanProfile)
   on_params_received = Signal()
-  on_param_stored = Signal(bool)
   on_stage_moved = Signal()
 
   _cmd: CMD = None
-  _next_cmd: CMD = None
   _cancel_cmd = False
   _cmd_start = 0
   _cmd_timeout = 0
@@ -25,6 +29,7 @@ class Board(QObject):
   connected = False
   homed = False
   params: dict = {}
+  _params_cache: dict = None
 
   can_connect = True
   can_home = False
@@ -41,14 +46,99 @@ class Board(QObject):
 
     self.log = log
     self.config = Config(config_file)
-
+    self.scan_window = ScanWindow(self.config)
+    # Narrow sweeps around the peak, continuous scanning is done by repeating single scans
+    self.auto_window = self.config.value("operations/scan_auto_window", False)
+
+    # Commands waiting to be started, with their arguments
+    self._queue = deque()
+    # Profiles are given to receivers by reference, see `ProfileBuffers`
+    self._profiles = ProfileBuffers()
+    self._profile_seq = 0
+    self._profile_params = None
     self._lock = threading.Lock()
+    # The loop calls `poll` of the profiler on every iteration
+    self.profiler = ThreadProfiler("board")
     self._thread = threading.Thread(target=self.loop, daemon=True)
     self._thread.start()
+    self.profiler.thread_id = self._thread.ident
 
     global board
     board = self
 
+  def _enqueue(self, cmd: CMD, args: dict = None, cancel = False):
+    # Should be called under the lock
+    if cancel:
+      # Cancelling commands replace everything that is waiting
+      self._queue.clear()
+      self._cancel_cmd = True
+    self._queue.append((cmd, args or {}))
+
+  def _take_next_command(self):
+    """
+    Returns the next command to start and its arguments, or (None, None).
+    """
+    self._lock.acquire()
+    try:
+      if not self._queue:
+        return (None, None)
+      self._cancel_cmd = False
+      cmd, args = self._queue.popleft()
+      if args.get("repeat"):
+        # The range is chosen as late as possible to use the latest fit
+        args = {**self.scan_window.next_range(), **args}
+      return (cmd, args)
+    finally:
+      self._lock.release()
+
+  def _peek_command(self):
+    """
+    Returns the next command and its arguments without taking it, or None.
+    Should be called under the lock.
+    """
+    if not self._queue:
+      return None
+    cmd, args = self._queue[0]
+    if args.get("repeat") and self.scan_window.fit_pending():
+      # The range of the next sweep depends on the fit of the previous one
+      return None
+    return (cmd, args)
+
+  def _has_pending(self) -> bool:
+    return len(self._queue) > 0
+
+  def _scan_points(self, args: dict) -> int:
+    """
+    Returns the number of points of a scan, or 0 if it's made in the firmware default range.
+    """
+    if "start" not in args:
+      return 0
+    return int(round((args["stop"] - args["start"]) / args["step"])) + 1
+
+  def _new_profile(self, cmd: CMD, capacity: int = 0) -> ScanProfile:
+    spec = self.config.cmd_spec(cmd)
+    profile = self._profiles.take()
+    profile.set_channels(spec.channels, spec.reference)
+    profile.reserve(capacity)
+    profile.cmd = cmd
+    profile.started = time.time()
+    return profile
+
+  def _publish_profile(self, profile: ScanProfile):
+    self._profile_seq += 1
+    profile.seq = self._profile_seq
+    profile.finished = time.time()
+    n = profile.count
+    profile.direction = -1 if n > 1 and profile.data[0, n - 1] < profile.data[0, 0] else 1
+    if profile.reference:
+      profile.normalize()
+    if self._profile_params != self.params:
+      self._profile_params = dict(self.params)
+    profile.params = self._profile_params
+    if self._cmd_args.get("repeat"):
+      self.scan_window.sweep_published()
+    self.on_data_received.emit(profile)
+
   def _disable_all(self):
     self.can_connect = False
     self.can_home = False
@@ -64,10 +154,9 @@ class Board(QObject):
         return
       self._disable_all()
       if self.connected:
-        self._next_cmd = CMD.disconnect
-        self._cancel_cmd = True
+        self._enqueue(CMD.disconnect, cancel=True)
       else:
-        self._next_cmd = CMD.connect
+        self._enqueue(CMD.connect)
     finally:
       self._lock.release()
 
@@ -94,7 +183,7 @@ class Board(QObject):
         self.log.warning("home:disabled")
         return
       self._disable_all()
-      self._next_cmd = CMD.home
+      self._enqueue(CMD.home)
       self.homed = False
       self.position = None
       self.can_connect = True
@@ -118,12 +207,28 @@ class Board(QObject):
       if not self.can_stop:
         self.log.warning("stop:disabled")
         return
-      self._disable_all()
-      self._next_cmd = CMD.stop
-      self._cancel_cmd = True
-      self.can_connect = True
+      stopped = not self._is_running() and len(self._queue) > 0
+      if stopped:
+        # Nothing has been sent to the board yet, e.g. the next sweep of auto-window scanning
+        # waits for the fit of the previous one, the board would refuse to stop
+        self.log.info("stop:queued")
+        self._queue.clear()
+        self._stop_done()
+      else:
+        self._disable_all()
+        # The answer to expect depends on what is stopped
+        self._enqueue(CMD.stop, {"cancelled": self._cmd}, cancel=True)
+        self.can_connect = True
     finally:
       self._lock.release()
+    if stopped:
+      self.on_command_end.emit(CMD.stop, "")
+
+  def _is_running(self) -> bool:
+    """
+    Checks if the board is busy with a command, should be called under the lock.
+    """
+    return self._cmd is not None
 
   def _stop_done(self):
     self._disable_all()
@@ -139,8 +244,7 @@ class Board(QObject):
         self.log.warning("move:disabled")
         return
       self._disable_all()
-      self._next_cmd = CMD.move
-      self._cmd_args = {"pos": pos}
+      self._enqueue(CMD.move, {"pos": pos})
       self.can_connect = True
       self.can_stop = True
     finally:
@@ -167,8 +271,7 @@ class Board(QObject):
         self.log.warning("jog:disabled")
         return
       self._disable_all()
-      self._next_cmd = CMD.jog
-      self._cmd_args = {"offset": offset}
+      self._enqueue(CMD.jog, {"offset": offset})
       self.can_connect = True
       self.can_stop = True
     finally:
@@ -186,43 +289,64 @@ class Board(QObject):
   def jog_back_long(self):
     self._jog(-self.config.value("operations/jog_distance_long", 1))
 
-  def scan(self):
+  def _scan_args(self, start, stop, step) -> dict:
+    if start is not None and stop is not None and step is not None:
+      return {"start": start, "stop": stop, "step": step}
+    if self.auto_window:
+      return self.scan_window.next_range()
+    return {}
+
+  def scan(self, start: float = None, stop: float = None, step: float = None):
+    """
+    Does a single scan in the given range, or in the firmware default range if not given.
+    """
     self._lock.acquire()
     try:
       if not self.can_move:
         self.log.warning("scan:disabled")
         return
       self._disable_all()
-      self._next_cmd = CMD.scan
+      self._enqueue(CMD.scan, self._scan_args(start, stop, step))
       self.can_connect = True
       self.can_stop = True
     finally:
       self._lock.release()
 
-  def scans(self):
+  def scans(self, start: float = None, stop: float = None, step: float = None):
+    """
+    Scans continuously in the given range, or in the firmware default range if not given.
+    In the auto-window mode, single scans are repeated,
+    each one in the range chosen after the previous sweep.
+    """
     self._lock.acquire()
     try:
       if not self.can_move:
         self.log.warning("scans:disabled")
         return
       self._disable_all()
-      self._next_cmd = CMD.scans
+      if self.auto_window and start is None:
+        self._enqueue(CMD.scan, {"repeat": True})
+      else:
+        self._enqueue(CMD.scans, self._scan_args(start, stop, step))
       self.can_connect = True
       self.can_stop = True
     finally:
       self._lock.release()
 
-  def query_params(self):
+  def query_params(self) -> bool:
+    """
+    Requests reading params from the board, returns False when it can't be done now.
+    """
     self._lock.acquire()
     try:
       if not self.can_home:
         self.log.warning("read_params:disabled")
-        return
+        return False
       self._disable_all()
-      self._next_cmd = CMD.param
+      self._enqueue(CMD.param)
       self.can_connect = True
       self.can_stop = True
-      self._cmd_args = {}
+      return True
     finally:
       self._lock.release()
 
@@ -233,28 +357,98 @@ class Board(QObject):
     self.can_move = self.homed
     self.can_jog = True
 
+  def port_cached_params(self) -> dict:
+    """
+    Returns params remembered for the connected board, or None.
+    They can be shown immediately, while actual values are being read from the board.
+    """
+    cache = self._load_params_cache()
+    board_id = cache["ports"].get(self.port())
+    params, _ = self.cached_params(board_id)
+    return params
+
+  def cached_params(self, board_id: str) -> tuple:
+    """
+    Returns parameters remembered for the board and their version, or (None, None).
+    """
+    cached = self._load_params_cache()["boards"].get(board_id)
+    if not cached:
+      return (None, None)
+    return (dict(cached["params"]), cached["version"])
+
+  def _load_params_cache(self) -> dict:
+    if self._params_cache is None:
+      try:
+        self._params_cache = load_state("params")
+      except Exception:
+        self.log.exception("load_params_cache")
+        self._params_cache = {}
+      self._params_cache.setdefault("boards", {})
+      self._params_cache.setdefault("ports", {})
+    return self._params_cache
+
+  def _cache_params(self, board_id: str = None, version: str = None):
+    """
+    Remembers current params for the next time.
+    Boards not telling their identity are identified by the port.
+    """
+    cache = self._load_params_cache()
+    port = self.port()
+    if not board_id:
+      board_id = f"port:{port}"
+    cache["ports"][port] = board_id
+    cache["boards"][board_id] = {"version": version, "params": dict(self.params)}
+    try:
+      save_state("params", cache)
+    except Exception:
+      self.log.exception("save_params_cache")
+
+  def _params_stored(self, params: dict):
+    for name, value in params.items():
+      self.params[name] = value
+    # Keep the cached version, values changed since then
+    # will be read from the board again, as any others changed outside
+    board_id = self._load_params_cache()["ports"].get(self.port())
+    if board_id:
+      _, version = self.cached_params(board_id)
+      self._cache_params(board_id, version)
+
   def store_params(self, params: dict):
     self.log.info(f"changes:{params}({len(params)})")
-    self._cmd_args = {"store": True, "params": params}
-    self.store_next_param()
-
-  def store_next_param(self):
     self._lock.acquire()
     try:
-      if not self.can_home:
-        self.log.warning("store_param:disabled")
+      # Parameters can be still being refreshed in background,
+      # then storing will be started after that
+      if not self.connected:
+        self.log.warning("store_params:disabled")
         return
       self._disable_all()
-      self._next_cmd = CMD.param
+      for batch in self._param_batches(params):
+        self._enqueue(CMD.param, {"store": True, "params": batch})
       self.can_connect = True
       self.can_stop = True
     finally:
       self._lock.release()
 
+  def _param_batches(self, params: dict) -> list:
+    """
+    Splits parameters into groups which are stored by a single command each.
+    """
+    if not self.config.value("commands/PARAM/batch_store", False):
+      return [{name: value} for name, value in params.items()]
+    # Values containing spaces can only be stored one by one,
+    # otherwise the firmware can't tell where a value ends
+    batches = [{name: value} for name, value in params.items() if " " in value]
+    batch = {name: value for name, value in params.items() if " " not in value}
+    if batch:
+      batches.insert(0, batch)
+    return batches
+
   def _end_command(self, err):
     ok = not err
+    cmd = self._cmd
     if ok:
-      self.log.info(f"end:{self._cmd}")
+      self.log.info(f"end:{cmd}")
     self._lock.acquire()
     try:
       if self._cmd == CMD.connect:
@@ -270,17 +464,24 @@ class Board(QObject):
         self._move_done(ok)
       elif self._cmd == CMD.param:
         self._query_params_done()
+      if err and not self._cancel_cmd:
+        # Remaining commands most probably depend on the failed one
+        self._queue.clear()
+      if ok and self._cmd == CMD.scan and self._cmd_args.get("repeat") \
+        and not self._queue and not self._cancel_cmd:
+        self._enqueue(CMD.scan, {"repeat": True})
+      if self._has_pending():
+        # Keep the UI locked until all waiting commands are done
+        self._disable_all()
+        self.can_connect = True
+        self.can_stop = True
+      # From now on, stopping doesn't need the board
+      self._cmd = None
     finally:
       self._lock.release()
-    self.on_command_end.emit(self._cmd, err)
-    self._cmd = None
+    self.on_command_end.emit(cmd, err)
     self._cmd_start = 0
     self._cmd_timeout = 0
-    # Don't clear args at any command end
-    # There can be sequential commands using the same args (e.g. params storing)
-    # Args should be initialized before a command whch is going to use them
-    # Remaining commands do not care about args
-    #self._cmd_args = {}
 
   def get_cmd_run_text(self, cmd: CMD) -> str:
     if cmd == CMD.connect:
@@ -19,10 +19,15 @@ class EDITOR(Enum):
 class BoardParamsDialog(QDialog):
   _editors = {}
 
-  def __init__(self, parent=None):
+  def __init__(self, parent=None, params: dict = None, updating=False):
     super().__init__(parent)
 
-    self.setWindowTitle("Firmware Parameters")
+    # Values shown in editors, to know which ones have been changed by user
+    self._shown = {}
+    # Remembered values are shown until the board answers
+    self._params = params if params is not None else board.params
+
+    self.setWindowTitle("Firmware Parameters" + (" (updating...)" if updating else ""))
 
     self.layout = QVBoxLayout(self)
     self.layout.setSpacing(2)
@@ -86,11 +91,28 @@ class BoardParamsDialog(QDialog):
     self.layout.addWidget(warn_label)
     self.layout.addSpacing(10)
 
-  def _populate(self):
-    warnings = {}
+  def refresh(self):
+    """
+    Shows values which have been read from the board,
+    but keeps values that the user has already changed.
+    """
+    self._params = board.params
+    names = []
     for name in self._editors:
+      (_, editor, warn_label) = self._editors[name]
+      if editor.isEnabled() and self._editor_value(name) != self._shown.get(name):
+        continue
+      editor.setEnabled(True)
+      warn_label.setVisible(False)
+      names.append(name)
+    self._populate(names)
+    self.setWindowTitle("Firmware Parameters")
+
+  def _populate(self, names = None):
+    warnings = {}
+    for name in (names if names is not None else self._editors):
       (kind, editor, _) = self._editors[name]
-      val = board.params.get(name)
+      val = self._params.get(name)
       if val is None:
         warnings[name] = "Protocol mismatch: there is no such value in the firmware"
         continue
@@ -130,35 +152,40 @@ class BoardParamsDialog(QDialog):
       except ValueError:
         warnings[name] = "Protocol mismatch: invalid value format"
         continue
+      self._shown[name] = self._editor_value(name)
     for name in warnings:
       (_, editor, warn_label) = self._editors[name]
       editor.setEnabled(False)
       warn_label.setText(warnings[name])
       warn_label.setVisible(True)
 
+  def _editor_value(self, name) -> str:
+    (kind, editor, _) = self._editors[name]
+    if kind == EDITOR.str:
+      return editor.text().strip()
+    if kind == EDITOR.int:
+      return str(editor.value())
+    if kind == EDITOR.float:
+      spec = board.config.param_spec(name)
+      return f"{editor.value():.{spec.precision}f}"
+    if kind == EDITOR.bool:
+      return "1" if editor.isChecked() else "0"
+    if kind == EDITOR.opts:
+      return editor.currentText()
+    return None
+
   def run(self) -> dict:
     if self.exec() != QDialog.DialogCode.Accepted:
       return None
     changes = {}
     for name in self._editors:
-      (kind, editor, _) = self._editors[name]
+      (_, editor, _) = self._editors[name]
       if not editor.isEnabled():
         continue
-      val = None
-      if kind == EDITOR.str:
-        val = editor.text().strip()
-      elif kind == EDITOR.int:
-        val = str(editor.value())
-      elif kind == EDITOR.float:
-        spec = board.config.param_spec(name)
-        val = f"{editor.value():.{spec.precision}f}"
-      elif kind == EDITOR.bool:
-        val = "1" if editor.isChecked() else "0"
-      elif kind == EDITOR.opts:
-        val = editor.currentText()
+      val = self._editor_value(name)
       if val is None:
         continue
-      if val == board.params[name]:
+      if val == self._params.get(name):
         continue
       changes[name] = val
     return changes
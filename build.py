@@ -27,6 +27,8 @@ def build():
     "--noconfirm",                  # Don't ask overwriting confirmation
     "--icon", "img/main.ico",       # Executable file icon
     "--add-data", "img;img",        # Include img directory in build
+    "--hidden-import", "fast_plot", # Plot backends are imported by name
+    "--hidden-import", "plot",
     #"--version-file", "TODO"
     "main.py"
   ]
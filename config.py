@@ -1,5 +1,13 @@
+import logging
+import os
+import threading
+import time
 from configobj import ConfigObj
 
+from consts import CMD
+
+log = logging.getLogger(__name__)
+
 def _is_int(v: str) -> bool:
   return v.isdigit() or (v.startswith('-') and v[1:].isdigit())
 
@@ -20,26 +28,59 @@ def _convert(val):
       pass
   return val
 
+class _Frozen:
+  """
+  Base for config objects which are shared between threads and never change after creation.
+  """
+  __slots__ = ()
+
+  def __setattr__(self, name, value):
+    raise AttributeError(f"{type(self).__name__} is read-only")
+
+  def _init(self, **kwargs):
+    for name, value in kwargs.items():
+      object.__setattr__(self, name, value)
 
-class Command:
+class Command(_Frozen):
+  __slots__ = ("name", "serial_name", "timeout", "log_answer", "pipelined", "channels", "reference")
   name: str
   serial_name: str
   timeout: float
   log_answer: bool
+  pipelined: bool
+  # Names of values in each point of scan answers
+  channels: tuple
+  reference: str
 
   def __init__(self, name, specs):
     spec = specs.get(name)
     if not spec:
       raise KeyError(f"Command not found: {name}")
 
-    self.name = name
-    self.serial_name = spec.get("serial_name")
-    self.log_answer = _convert(spec.get("log_answer", True))
-
     timeout = spec.get("timeout")
     if not timeout:
       timeout = specs.get("timeout", 1)
-    self.timeout = _convert(timeout)
+    timeout = _convert(timeout)
+    if not isinstance(timeout, (int, float)) or isinstance(timeout, bool) or timeout <= 0:
+      raise ValueError(f"Invalid timeout of command {name}: {timeout}")
+
+    channels = spec.get("channels") or "signal"
+    if isinstance(channels, str):
+      channels = channels.split(",")
+    channels = tuple(c.strip() for c in channels)
+    reference = spec.get("reference") or None
+    if reference and (reference not in channels or reference == channels[0]):
+      raise ValueError(f"Invalid reference channel of command {name}: {reference}")
+
+    self._init(
+      name = name,
+      serial_name = spec.get("serial_name"),
+      timeout = timeout,
+      log_answer = _convert(spec.get("log_answer", True)),
+      pipelined = _convert(spec.get("pipelined", False)),
+      channels = channels,
+      reference = reference,
+    )
 
 def _parse_range(s: str) -> list:
   r = [r.strip() for r in s.split("-")]
@@ -52,122 +93,212 @@ def _parse_range(s: str) -> list:
     try:
       min = float(r[0])
     except ValueError:
-      print(f"Invalid range: {s}")
+      log.warning(f"Invalid range: {s}")
       return None
     try:
       max = float(r[1])
     except ValueError:
-      print(f"Invalid range: {s}")
+      log.warning(f"Invalid range: {s}")
       return None
   if max < min:
     min, max = max, min
   return (min, max)
 
-class Parameter:
+class Parameter(_Frozen):
+  __slots__ = ("name", "title", "options", "range", "precision", "step")
   name: str
   title: str
-  options: list = []
-  range: tuple = None
-  precision = 2
-  step = None
+  options: tuple
+  range: tuple
+  precision: int
+  step: float
 
   def __init__(self, name, specs):
     spec = specs.get(name)
     if not spec:
       raise KeyError(f"Parameter not found: {name}")
 
-    self.name = name
+    opts = spec.get("options")
+    precision = spec.get("precision")
+    step = spec.get("step")
 
-    self.title = spec.get("title")
-    if not self.title:
-      self.title = name
+    self._init(
+      name = name,
+      title = spec.get("title") or name,
+      options = tuple(opts) if opts and isinstance(opts, list) else (),
+      range = _parse_range(spec.get("range", "")),
+      precision = _convert(precision) if precision is not None else 2,
+      step = _convert(step) if step else None,
+    )
 
-    opts = spec.get("options")
-    if opts and isinstance(opts, list):
-      self.options = opts
+# Position of each command in the command table
+_CMD_INDEX = {cmd: i for i, cmd in enumerate(CMD)}
+_CMD_INDEX.update({cmd.value: i for i, cmd in enumerate(CMD)})
 
-    self.range = _parse_range(spec.get("range", ""))
+def _flatten(section, prefix, values: dict):
+  for key, val in section.items():
+    path = f"{prefix}{key}"
+    if isinstance(val, dict):
+      _flatten(val, path + "/", values)
+    else:
+      values[path] = _convert(val)
 
-    precision = spec.get("precision")
-    if precision is not None:
-      self.precision = _convert(precision)
+class ConfigSnapshot(_Frozen):
+  """
+  Validated configuration prepared for fast lookups.
+  """
+  __slots__ = ("commands", "params", "param_codes", "errors", "values", "mtime")
+  # Command specs indexed by the position of CMD, None if the command is not configured
+  commands: tuple
+  params: dict
+  param_codes: tuple
+  errors: dict
+  # Converted values by their full paths, e.g. `connection/timeout`
+  values: dict
+  mtime: float
 
-    step = spec.get("step")
-    if step:
-      self.step = _convert(step)
+  def __init__(self, data, mtime = 0):
+    cmd_specs = data.get("commands") or {}
+    commands = [None] * len(CMD)
+    for cmd in CMD:
+      if cmd.value in cmd_specs:
+        commands[_CMD_INDEX[cmd]] = Command(cmd.value, cmd_specs)
+
+    param_specs = data.get("parameters") or {}
+    params = {name: Parameter(name, param_specs) for name in param_specs}
+
+    errors = {str(code): msg for code, msg in (data.get("errors") or {}).items()}
+
+    values = {}
+    _flatten(data, "", values)
+
+    self._init(
+      commands = tuple(commands),
+      params = params,
+      param_codes = tuple(params),
+      errors = errors,
+      values = values,
+      mtime = mtime,
+    )
 
 class Config:
   _data: ConfigObj
   _file_name = None
-  _cache = {}
+  _snapshot: ConfigSnapshot
+  _next_check = 0
+  reload_interval = 1
 
   def __init__(self, src):
+    # Values are changed by the GUI thread while the board thread reloads the file
+    self._lock = threading.Lock()
     if isinstance(src, dict):
       self._data = src
+      self._snapshot = ConfigSnapshot(src)
     else:
       self._file_name = src
       self._data = ConfigObj(src)
+      self._snapshot = ConfigSnapshot(self._data, self._mtime())
+
+  @property
+  def snapshot(self) -> ConfigSnapshot:
+    return self._snapshot
+
+  def _mtime(self) -> float:
+    try:
+      return os.stat(self._file_name).st_mtime
+    except OSError:
+      return 0
 
-  def cmd_spec(self, name: str) -> Command:
-    key = f"CMD:{name}"
-    if name in self._cache:
-      return self._cache[key]
-    specs = self._data.get("commands")
-    if not specs:
+  def reload_if_changed(self) -> bool:
+    """
+    Loads the config again if its file has been changed.
+    Returns True if the config has been reloaded.
+    """
+    if not self._file_name:
+      return False
+    now = time.perf_counter()
+    if now < self._next_check:
+      return False
+    self._next_check = now + self.reload_interval
+    self._lock.acquire()
+    try:
+      mtime = self._mtime()
+      if mtime == self._snapshot.mtime:
+        return False
+      try:
+        data = ConfigObj(self._file_name)
+        snapshot = ConfigSnapshot(data, mtime)
+      except Exception as e:
+        log.error(f"Config is not reloaded: {e}")
+        # Don't try to reload the same broken file again
+        self._snapshot = ConfigSnapshot(self._data, mtime)
+        return False
+      # Readers get either the old snapshot or the new one, never a partially updated
+      self._data = data
+      self._snapshot = snapshot
+    finally:
+      self._lock.release()
+    log.info(f"Config reloaded: {self._file_name}")
+    return True
+
+  def cmd_spec(self, name) -> Command:
+    """
+    Returns specification of a command given as CMD or its string value.
+    """
+    idx = _CMD_INDEX.get(name)
+    cmd = self._snapshot.commands[idx] if idx is not None else None
+    if not cmd:
       raise KeyError(f"Command not found: {name}")
-    cmd = Command(name, specs)
-    self._cache[key] = cmd
     return cmd
 
   def param_spec(self, name: str) -> Parameter:
-    key = f"PARAM:{name}"
-    if key in self._cache:
-      return self._cache[key]
-    specs = self._data.get("parameters")
-    if not specs:
+    param = self._snapshot.params.get(name)
+    if not param:
       raise KeyError(f"Parameter not found: {name}")
-    param = Parameter(name, specs)
-    self._cache[key] = param
     return param
 
   def param_codes(self):
-    specs = self._data.get("parameters")
-    if not specs:
+    codes = self._snapshot.param_codes
+    if not codes:
       raise KeyError(f"Parameters not found")
-    return [*specs]
+    return [*codes]
 
   def value(self, path: str, default = None):
-    if path in self._cache:
-      return self._cache[path]
-    val = self._data
-    for key in path.split("/"):
-      if key not in val:
-        if default is not None:
-          return default
-        raise KeyError(f"Configuration path not found: {path}")
-      val = val[key]
-    val = _convert(val)
-    self._cache[path] = val
+    val = self._snapshot.values.get(path)
+    if val is None:
+      if default is not None:
+        return default
+      raise KeyError(f"Configuration path not found: {path}")
     return val
 
   def set_value(self, path: str, value):
     keys = path.split("/")
-    val = self._data
-    for key in keys[:-1]:
-      if key not in val:
-        raise KeyError(f"Configuration path not found: {path}")
-      val = val[key]
-    val[keys[-1]] = value
-    self._cache[path] = value
+    self._lock.acquire()
+    try:
+      val = self._data
+      for key in keys[:-1]:
+        if key not in val:
+          raise KeyError(f"Configuration path not found: {path}")
+        val = val[key]
+      val[keys[-1]] = value
+      self._snapshot = ConfigSnapshot(self._data, self._snapshot.mtime)
+    finally:
+      self._lock.release()
 
   def save(self):
     if not self._file_name:
       raise Exception("File name is not specified")
-    self._data.write()
+    self._lock.acquire()
+    try:
+      self._data.write()
+      # Don't reload what has just been saved
+      self._snapshot = ConfigSnapshot(self._data, self._mtime())
+    finally:
+      self._lock.release()
 
   def error_text(self, err):
     code = err.split(" ")[-1]
-    msg = self._data.get("errors", {}).get(code)
+    msg = self._snapshot.errors.get(code)
     if not msg:
       msg = f"error={code}"
     return msg
@@ -15,3 +15,4 @@ class CMD(Enum):
   scans = "SCANS"
   param = "PARAM"
   error = "ERROR"
+  sync = "SYNC"
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+import numpy as np
+
+def minmax_decimate(xs, ys, x0: float, x1: float, columns: int):
+  """
+  Reduces a profile to at most four points per pixel column:
+  the first and the last points of the column and its min and max values.
+  A line drawn through them is rendered the same as through the whole data.
+  `xs` must be sorted ascending.
+  """
+  n = len(xs)
+  if n <= columns * 4 or x1 <= x0:
+    return xs, ys
+  col = ((xs - x0) * (columns / (x1 - x0))).astype(np.int64)
+  np.clip(col, 0, columns - 1, out=col)
+  starts = np.concatenate(([0], np.flatnonzero(np.diff(col)) + 1))
+  ends = np.append(starts[1:], n) - 1
+  out_x = np.empty(len(starts) * 4)
+  out_y = np.empty(len(starts) * 4)
+  out_x[0::4] = xs[starts]
+  out_y[0::4] = ys[starts]
+  out_x[1::4] = xs[starts]
+  out_y[1::4] = np.minimum.reduceat(ys, starts)
+  out_x[2::4] = xs[ends]
+  out_y[2::4] = np.maximum.reduceat(ys, starts)
+  out_x[3::4] = xs[ends]
+  out_y[3::4] = ys[ends]
+  return out_x, out_y
+
+class Decimator:
+  """
+  Keeps decimated versions of a profile for recently used view ranges and widths,
+  so repainting at the same zoom level doesn't touch the whole data again.
+  """
+  max_levels = 8
+
+  def __init__(self, xs = None, ys = None):
+    self._xs = None
+    self._ys = None
+    self._levels = OrderedDict()
+    if xs is not None:
+      self.set_data(xs, ys)
+
+  def set_data(self, xs, ys):
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    if len(xs) > 1 and xs[0] > xs[-1] and np.all(np.diff(xs) <= 0):
+      # Backward scan
+      xs = xs[::-1]
+      ys = ys[::-1]
+    elif len(xs) > 1 and not np.all(np.diff(xs) >= 0):
+      order = np.argsort(xs, kind='stable')
+      xs = xs[order]
+      ys = ys[order]
+    self._xs = xs
+    self._ys = ys
+    self._levels.clear()
+
+  def get(self, x0: float, x1: float, columns: int):
+    """
+    Returns points to draw the part of the profile between `x0` and `x1`
+    on the given number of pixel columns.
+    """
+    if self._xs is None:
+      return None, None
+    key = (x0, x1, columns)
+    level = self._levels.get(key)
+    if level:
+      self._levels.move_to_end(key)
+      return level
+    # One point beyond the view on each side keeps the line going to the edges
+    i0 = max(0, np.searchsorted(self._xs, x0, side='left') - 1)
+    i1 = min(len(self._xs), np.searchsorted(self._xs, x1, side='right') + 1)
+    level = minmax_decimate(self._xs[i0:i1], self._ys[i0:i1], x0, x1, columns)
+    self._levels[key] = level
+    if len(self._levels) > self.max_levels:
+      self._levels.popitem(last=False)
+    return level
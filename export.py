@@ -0,0 +1,178 @@
+"""
+Export of session sweeps with their fit results. Sweeps are read from the session in chunks
+and written as they are read, so a session is never loaded in memory as a whole.
+Positions on a uniform grid are written as `x_start` and `x_step` of a sweep instead of all of them.
+"""
+import csv
+import logging
+import os
+import zipfile
+import numpy as np
+
+from session import SWEEP_COLUMNS, Session, fit_names
+
+log = logging.getLogger(__name__)
+
+# Points read from the session at once
+CHUNK_POINTS = 1 << 20
+
+EXPORT_FILTERS = "NPZ archive (*.npz);;Parquet table (*.parquet);;Arrow file (*.arrow);;CSV table (*.csv)"
+
+def export_session(session: Session, file_name: str) -> int:
+  """
+  Writes sweeps recorded so far in the format given by the file extension.
+  Returns the number of written sweeps.
+  """
+  ext = os.path.splitext(file_name)[1].lower()
+  writer = EXPORTERS.get(ext)
+  if not writer:
+    raise ValueError(f"Unsupported export format: {ext or file_name}")
+  sweeps = session.sweeps()
+  writer(session, sweeps, file_name)
+  log.info(f"session_exported:{len(sweeps)}:{file_name}")
+  return len(sweeps)
+
+def sweep_positions(row, xs):
+  if xs is not None:
+    return xs
+  return row["x_start"] + row["x_step"] * np.arange(int(row["points"]))
+
+def _npy_member(zf: zipfile.ZipFile, name: str, dtype, count: int):
+  f = zf.open(name + ".npy", "w", force_zip64=True)
+  header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": (count,)}
+  np.lib.format.write_array_header_1_0(f, header)
+  return f
+
+def _write_npy(zf: zipfile.ZipFile, name: str, arr):
+  with _npy_member(zf, name, arr.dtype, len(arr)) as f:
+    f.write(np.ascontiguousarray(arr).tobytes())
+
+def export_npz(session: Session, sweeps, file_name: str):
+  """
+  Writes an array per sweep column and `signal` with values of all sweeps one after another,
+  sweep `i` takes `points[i]` of them. Positions of sweeps off the uniform grid (NaN `x_step`)
+  are in `positions` in the same way. Members are written as they are read, `np.load` reads them as usual.
+  """
+  explicit = np.isnan(sweeps["x_step"])
+  with zipfile.ZipFile(file_name, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+    for name in SWEEP_COLUMNS:
+      _write_npy(zf, name, np.array(fit_names(sweeps[name]), dtype=str) if name == "fit" else sweeps[name])
+    with _npy_member(zf, "signal", float, int(sweeps["points"].sum())) as f:
+      for rows, arrays in session.chunks(sweeps, CHUNK_POINTS):
+        f.write(np.concatenate([ys for _, ys in arrays]).tobytes())
+    with _npy_member(zf, "positions", float, int(sweeps["points"][explicit].sum())) as f:
+      if explicit.any():
+        for rows, arrays in session.chunks(sweeps, CHUNK_POINTS):
+          for xs, _ in arrays:
+            if xs is not None:
+              f.write(xs.tobytes())
+
+def export_csv(session: Session, sweeps, file_name: str):
+  """
+  Writes points as rows of the sweep number, position and value,
+  and sweep columns with fit results to `<name>-sweeps.csv` next to it.
+  """
+  with open(os.path.splitext(file_name)[0] + "-sweeps.csv", "w", newline="", encoding="utf-8") as f:
+    writer = csv.writer(f)
+    writer.writerow(SWEEP_COLUMNS)
+    fits = fit_names(sweeps["fit"])
+    for row, fit in zip(sweeps.tolist(), fits):
+      values = dict(zip(sweeps.dtype.names, row))
+      values["fit"] = fit
+      writer.writerow(["" if isinstance(values[name], float) and np.isnan(values[name]) else values[name]
+        for name in SWEEP_COLUMNS])
+  with open(file_name, "w", newline="", encoding="utf-8") as f:
+    f.write("seq,position,signal\n")
+    for rows, arrays in session.chunks(sweeps, CHUNK_POINTS):
+      seqs = np.repeat(rows["seq"], rows["points"])
+      xs = np.concatenate([sweep_positions(row, xs) for row, (xs, _) in zip(rows, arrays)])
+      ys = np.concatenate([ys for _, ys in arrays])
+      np.savetxt(f, np.column_stack((seqs, xs, ys)), fmt=("%d", "%.10g", "%.10g"), delimiter=",")
+
+def _import_pyarrow():
+  try:
+    import pyarrow
+  except ImportError:
+    raise RuntimeError("Parquet and Arrow export needs pyarrow, install it by: pip install pyarrow") from None
+  return pyarrow
+
+def _arrow_schema(pa):
+  time_type = pa.timestamp("us", tz="UTC")
+  return pa.schema([
+    ("seq", pa.int64()),
+    ("started", time_type),
+    ("finished", time_type),
+    ("direction", pa.int8()),
+    ("points", pa.int64()),
+    ("x_start", pa.float64()),
+    ("x_step", pa.float64()),
+    ("fit", pa.string()),
+    ("duration_fs", pa.float64()),
+    ("fwhm_fs", pa.float64()),
+    ("center_um", pa.float64()),
+    # Null for sweeps on a uniform grid
+    ("positions", pa.list_(pa.float64())),
+    ("signal", pa.list_(pa.float64())),
+  ])
+
+def _arrow_batches(pa, schema, session: Session, sweeps):
+  # A row per sweep, a batch per chunk
+  for rows, arrays in session.chunks(sweeps, CHUNK_POINTS):
+    explicit = np.isnan(rows["x_step"])
+    offsets = np.zeros(len(rows) + 1, dtype=np.int32)
+    np.cumsum(rows["points"], out=offsets[1:])
+    signal = pa.ListArray.from_arrays(pa.array(offsets), pa.array(np.concatenate([ys for _, ys in arrays])))
+    pos_offsets = np.zeros(len(rows) + 1, dtype=np.int32)
+    np.cumsum(np.where(explicit, rows["points"], 0), out=pos_offsets[1:])
+    pos_values = [xs for xs, _ in arrays if xs is not None]
+    positions = pa.ListArray.from_arrays(pa.array(pos_offsets),
+      pa.array(np.concatenate(pos_values) if pos_values else np.empty(0)), mask=pa.array(~explicit))
+    def times(name):
+      return pa.array((rows[name] * 1e6).astype(np.int64), schema.field(name).type)
+    def floats(name):
+      return pa.array(rows[name], mask=np.isnan(rows[name]))
+    columns = [
+      pa.array(rows["seq"]),
+      times("started"),
+      times("finished"),
+      pa.array(rows["direction"]),
+      pa.array(rows["points"]),
+      floats("x_start"),
+      floats("x_step"),
+      pa.array(fit_names(rows["fit"]), mask=rows["fit"] < 0),
+      floats("duration_fs"),
+      floats("fwhm_fs"),
+      floats("center_um"),
+      positions,
+      signal,
+    ]
+    yield pa.record_batch(columns, schema=schema)
+
+def export_parquet(session: Session, sweeps, file_name: str):
+  """
+  Writes a row per sweep with zstd compression, a row group per chunk.
+  """
+  pa = _import_pyarrow()
+  import pyarrow.parquet as pq
+  schema = _arrow_schema(pa)
+  with pq.ParquetWriter(file_name, schema, compression="zstd") as writer:
+    for batch in _arrow_batches(pa, schema, session, sweeps):
+      writer.write_batch(batch)
+
+def export_arrow(session: Session, sweeps, file_name: str):
+  """
+  Writes a row per sweep to an Arrow IPC file with zstd compression, a record batch per chunk.
+  """
+  pa = _import_pyarrow()
+  schema = _arrow_schema(pa)
+  options = pa.ipc.IpcWriteOptions(compression="zstd")
+  with pa.OSFile(file_name, "wb") as sink, pa.ipc.new_file(sink, schema, options=options) as writer:
+    for batch in _arrow_batches(pa, schema, session, sweeps):
+      writer.write_batch(batch)
+
+EXPORTERS = {
+  ".npz": export_npz,
+  ".parquet": export_parquet,
+  ".arrow": export_arrow,
+  ".csv": export_csv,
+}
@@ -0,0 +1,226 @@
+import math
+import numpy as np
+import shiboken6
+from PySide6.QtCore import Qt, QPointF, QRectF
+from PySide6.QtGui import QColor, QPainter, QPen, QPolygonF
+from PySide6.QtWidgets import QWidget
+
+from plot_view import ProfileView
+
+def make_polygon(xs, ys) -> QPolygonF:
+  """
+  Creates a polygon filling its memory directly from numpy arrays,
+  it's much faster than adding points one by one.
+  """
+  n = len(xs)
+  poly = QPolygonF()
+  poly.resize(n)
+  if n == 0:
+    return poly
+  buf = shiboken6.VoidPtr(poly.data(), n * 16, True)
+  pts = np.frombuffer(buf, dtype=np.float64).reshape((n, 2))
+  pts[:, 0] = xs
+  pts[:, 1] = ys
+  return poly
+
+def nice_ticks(lo: float, hi: float, count: int) -> list:
+  """
+  Returns round-valued ticks covering the range, about `count` of them.
+  """
+  if hi <= lo or count < 1:
+    return [lo]
+  raw = (hi - lo) / count
+  mag = 10 ** math.floor(math.log10(raw))
+  for m in (1, 2, 5, 10):
+    step = m * mag
+    if step >= raw:
+      break
+  first = math.ceil(lo / step) * step
+  return [first + i * step for i in range(int((hi - first) / step + 1e-9) + 1)]
+
+def _tick_text(v: float, step: float) -> str:
+  digits = max(0, -math.floor(math.log10(step))) if step > 0 else 0
+  return f"{v:.{digits}f}"
+
+class FastPlot(QWidget, ProfileView):
+  """
+  Lightweight plot painted directly with Qt, it's fast enough for live profiles.
+  Publication-quality images are still made by matplotlib, see `plot_image.export_image`.
+  """
+  margin_left = 70
+  margin_right = 20
+  margin_top = 20
+  margin_bottom = 50
+
+  def __init__(self, parent=None):
+    super().__init__(parent)
+    self.setAttribute(Qt.WA_OpaquePaintEvent)
+    self.setMinimumSize(200, 150)
+    # Wide or translucent pens make Qt stroke noisy polylines orders of magnitude slower,
+    # so the data line is 1px wide and its color is blended with the background in advance
+    self._pen_data = QPen(QColor(77, 77, 255), 0)
+    self._pen_fit = QPen(QColor(255, 0, 0), 2)
+    self._pen_grid = QPen(QColor(0, 0, 0, 40), 1)
+    self._pen_axes = QPen(QColor(0, 0, 0), 1)
+    self._brush_roi = QColor(255, 165, 0, 30)
+    # The fit region is selected by dragging over the plot, in pixels
+    self._drag = None
+    self._x_limits = (0.0, 1.0)
+    self._pen_extra = {
+      "envelope": QPen(QColor(0, 0, 0), 0),
+      "intensity": QPen(QColor(0, 128, 0), 0),
+    }
+
+  def _redraw(self):
+    self.update()
+
+  def plot_rect(self) -> QRectF:
+    return QRectF(self.margin_left, self.margin_top,
+      max(1, self.width() - self.margin_left - self.margin_right),
+      max(1, self.height() - self.margin_top - self.margin_bottom))
+
+  def data_limits(self, ys, y_fit):
+    # Decimated data keeps extremes of the original one
+    x0, x1 = self.x_range
+    y0, y1 = float(np.min(ys)), float(np.max(ys))
+    if y_fit is not None:
+      y0 = min(y0, float(np.min(y_fit)))
+      y1 = max(y1, float(np.max(y_fit)))
+    if x1 <= x0:
+      x0, x1 = x0 - 1, x1 + 1
+    if y1 <= y0:
+      y0, y1 = y0 - 1, y1 + 1
+    dy = (y1 - y0) * 0.05
+    return x0, x1, y0 - dy, y1 + dy
+
+  def paintEvent(self, event):
+    p = QPainter(self)
+    p.fillRect(self.rect(), Qt.white)
+    rect = self.plot_rect()
+    xs, ys, x_fit, y_fit = self.display_data(rect.width() * self.devicePixelRatioF())
+    if xs is None:
+      p.setPen(self._pen_axes)
+      p.drawRect(rect)
+      return
+    p.setRenderHint(QPainter.Antialiasing)
+
+    extra = self.display_extra(rect.width() * self.devicePixelRatioF())
+    x0, x1, y0, y1 = self.data_limits(ys, y_fit)
+    sx = rect.width() / (x1 - x0)
+    sy = rect.height() / (y1 - y0)
+    to_x = lambda v: rect.left() + (v - x0) * sx
+    to_y = lambda v: rect.bottom() - (v - y0) * sy
+
+    # Kept for converting mouse positions
+    self._x_limits = (x0, x1)
+    roi = self.display_roi()
+    if roi:
+      p.fillRect(QRectF(QPointF(to_x(roi[0]), rect.top()), QPointF(to_x(roi[1]), rect.bottom())).normalized()
+        .intersected(rect), self._brush_roi)
+    if self._drag:
+      p.fillRect(QRectF(QPointF(self._drag[0], rect.top()), QPointF(self._drag[1], rect.bottom())).normalized()
+        .intersected(rect), self._brush_roi)
+
+    self._draw_axes(p, rect, x0, x1, y0, y1, to_x, to_y)
+
+    p.save()
+    p.setClipRect(rect)
+    p.setPen(self._pen_data)
+    p.drawPolyline(make_polygon(to_x(xs), to_y(ys)))
+    for _, style, ex, ey in extra:
+      p.setPen(self._pen_extra[style])
+      p.drawPolyline(make_polygon(to_x(ex), to_y(ey)))
+    if self.fit_params:
+      p.setPen(self._pen_fit)
+      p.drawPolyline(make_polygon(to_x(x_fit), to_y(y_fit)))
+    p.restore()
+
+    self._draw_texts(p, rect, extra)
+
+  def _from_pixel(self, x: float) -> float:
+    rect = self.plot_rect()
+    x0, x1 = self._x_limits
+    return x0 + (x - rect.left()) * (x1 - x0) / rect.width()
+
+  def mousePressEvent(self, event):
+    if event.button() == Qt.LeftButton and self.x_range and self.plot_rect().contains(event.position()):
+      x = event.position().x()
+      self._drag = (x, x)
+
+  def mouseMoveEvent(self, event):
+    if self._drag:
+      self._drag = (self._drag[0], event.position().x())
+      self.update()
+
+  def mouseReleaseEvent(self, event):
+    if not self._drag:
+      return
+    start, stop = self._drag
+    self._drag = None
+    if abs(stop - start) < 3:
+      self.update()
+      return
+    self.set_roi(self._from_pixel(start), self._from_pixel(stop))
+
+  def _draw_axes(self, p: QPainter, rect: QRectF, x0, x1, y0, y1, to_x, to_y):
+    fm = p.fontMetrics()
+    x_ticks = nice_ticks(x0, x1, max(2, int(rect.width() / 100)))
+    y_ticks = nice_ticks(y0, y1, max(2, int(rect.height() / 60)))
+    x_step = x_ticks[1] - x_ticks[0] if len(x_ticks) > 1 else 1
+    y_step = y_ticks[1] - y_ticks[0] if len(y_ticks) > 1 else 1
+    for v in x_ticks:
+      x = to_x(v)
+      p.setPen(self._pen_grid)
+      p.drawLine(QPointF(x, rect.top()), QPointF(x, rect.bottom()))
+      p.setPen(self._pen_axes)
+      p.drawLine(QPointF(x, rect.bottom()), QPointF(x, rect.bottom() + 4))
+      text = _tick_text(v, x_step)
+      p.drawText(QPointF(x - fm.horizontalAdvance(text) / 2, rect.bottom() + 6 + fm.ascent()), text)
+    for v in y_ticks:
+      y = to_y(v)
+      p.setPen(self._pen_grid)
+      p.drawLine(QPointF(rect.left(), y), QPointF(rect.right(), y))
+      p.setPen(self._pen_axes)
+      p.drawLine(QPointF(rect.left() - 4, y), QPointF(rect.left(), y))
+      text = _tick_text(v, y_step)
+      p.drawText(QPointF(rect.left() - 6 - fm.horizontalAdvance(text), y + fm.ascent() / 2 - 1), text)
+    p.setPen(self._pen_axes)
+    p.drawRect(rect)
+
+    text = self.x_label()
+    p.drawText(QPointF(rect.center().x() - fm.horizontalAdvance(text) / 2, self.height() - 6), text)
+    text = self.y_label()
+    p.save()
+    p.translate(fm.ascent() + 2, rect.center().y() + fm.horizontalAdvance(text) / 2)
+    p.rotate(-90)
+    p.drawText(QPointF(0, 0), text)
+    p.restore()
+
+  def _draw_texts(self, p: QPainter, rect: QRectF, extra: list):
+    fm = p.fontMetrics()
+    p.setPen(self._pen_axes)
+    y = rect.top() + 6 + fm.ascent()
+    for line in self.fit_text():
+      p.drawText(QPointF(rect.left() + 8, y), line)
+      y += fm.height()
+
+    # Legend
+    items = [(self._pen_data, "Experimental")]
+    items.extend((self._pen_extra[style], label) for label, style, _, _ in extra)
+    if self.fit_params:
+      items.append((self._pen_fit, self.fit_params["label"]))
+    w = max(fm.horizontalAdvance(t) for _, t in items) + 40
+    h = fm.height() * len(items) + 8
+    box = QRectF(rect.right() - w - 8, rect.top() + 8, w, h)
+    p.setPen(QPen(QColor(0, 0, 0, 60), 1))
+    p.setBrush(QColor(255, 255, 255, 220))
+    p.drawRect(box)
+    p.setBrush(Qt.NoBrush)
+    y = box.top() + 4
+    for pen, text in items:
+      mid = y + fm.height() / 2
+      p.setPen(pen)
+      p.drawLine(QPointF(box.left() + 6, mid), QPointF(box.left() + 28, mid))
+      p.setPen(self._pen_axes)
+      p.drawText(QPointF(box.left() + 34, y + fm.ascent()), text)
+      y += fm.height()
@@ -0,0 +1,257 @@
+from enum import Enum
+import logging
+import os
+import numpy as np
+
+class FIT(Enum):
+  gauss = 0
+  lorentz = 1
+  sech2 = 2
+  # All models are fitted and the best one is chosen
+  auto = 3
+
+LIGHT_SPEED = 0.299792458 # mkm/fs
+
+log = logging.getLogger(__name__)
+
+def gaussian(x, amplitude, center, width):
+  return amplitude * np.exp(-(x - center)**2 / (2 * width**2))
+
+def lorentzian(x, amplitude, center, width):
+  return amplitude / (1 + ((x - center) / width)**2)
+
+def sech_squared(x, amplitude, center, width):
+  return amplitude / np.cosh((x - center) / width)**2
+
+FIT_FUNCS = {
+  FIT.gauss: (gaussian, "Gaussian Fit"),
+  FIT.lorentz: (lorentzian, "Lorentzian Fit"),
+  FIT.sech2: (sech_squared, "sech² Fit"),
+}
+
+def estimate_peak(xs, ys):
+  """
+  Roughly locates the peak by its half maximum, returns its center and FWHM
+  or None if there is no distinct peak. It's cheap enough to be done for every sweep.
+  """
+  n = len(ys)
+  if n < 4:
+    return None
+  # Moving average prevents single noisy points from cutting the peak
+  box = max(1, n // 256)
+  noise = np.std(np.diff(ys)) / np.sqrt(2 * box)
+  if box > 1:
+    sums = np.cumsum(np.concatenate(([0.0], ys)))
+    ys = (sums[box:] - sums[:-box]) / box
+    xs = xs[box // 2:box // 2 + len(ys)]
+  k = int(np.argmax(ys))
+  base = np.percentile(ys, 5)
+  if ys[k] - base <= 8 * noise:
+    return None
+  half = (ys[k] + base) / 2.0
+  below = ys < half
+  left = np.flatnonzero(below[:k])
+  right = np.flatnonzero(below[k:])
+  i0 = left[-1] if len(left) else 0
+  i1 = k + right[0] if len(right) else len(ys) - 1
+  return (xs[i0] + xs[i1]) / 2.0, abs(xs[i1] - xs[i0])
+
+def fit_profile(xs, ys, fit_type: FIT, show_delay: bool, roi: tuple = None) -> dict:
+  """
+  Fits experimental data with a specified fit function and returns fit parameters.
+  When `roi` is given as (start, stop), only points inside it are fitted.
+  When showing delays, positions are converted to delays relative to the fit center,
+  converted positions are returned in the "xs" item.
+  Other positions can be converted the same way with `to_delay`.
+  """
+  if xs is None or ys is None or len(xs) < 4:
+    return None
+
+  fit_xs, fit_ys = xs, ys
+  if roi:
+    inside = (xs >= roi[0]) & (xs <= roi[1])
+    if np.count_nonzero(inside) >= 4:
+      fit_xs, fit_ys = xs[inside], ys[inside]
+
+  fit = FIT_FUNCS.get(fit_type)
+  if not fit:
+    return None
+  fit_func, fit_label = fit
+
+  # scipy takes a while to import, it's usually preloaded along with the plot
+  from scipy.optimize import curve_fit
+
+  try:
+    amplitude_guess = np.max(fit_ys)
+    center_guess = np.mean(fit_xs)
+    width_guess = (np.max(fit_xs) - np.min(fit_xs)) / 6
+    [amplitude, center, width], pcov = curve_fit(fit_func, fit_xs, fit_ys,
+                          p0=[amplitude_guess, center_guess, width_guess],
+                          maxfev=10000)
+
+    # Akaike information criterion for comparing models, all of them have 3 parameters
+    n = len(fit_xs)
+    rss = np.sum((fit_func(fit_xs, amplitude, center, width) - fit_ys)**2)
+    aic = n * np.log(max(rss, 1e-300) / n) + 2 * 3
+
+    origin = 0.0
+    if show_delay:
+      # Convert positions in mkm to delays in fs
+      origin = center
+      xs = (xs - center) / LIGHT_SPEED
+      center = 0.0
+      width /= LIGHT_SPEED
+
+    return {
+      "amplitude": amplitude,
+      "center": center,
+      "width": width,
+      "label": fit_label,
+      "type": fit_type,
+      "func": fit_func,
+      "aic": aic,
+      "xs": xs,
+      # Position that became zero delay
+      "origin": origin,
+    }
+  except Exception as e:
+    log.exception("fit")
+    return None
+
+_pool = None
+_pool_ready = []
+
+def _preload_fit():
+  from scipy.optimize import curve_fit
+
+def fit_models(xs, ys, show_delay: bool, roi: tuple = None) -> dict:
+  """
+  Fits the profile with all models, see `fit_profile`.
+  Returns fit parameters by fit type, None for failed fits.
+  curve_fit holds the GIL, so models are fitted in worker processes when there are several cores.
+  """
+  global _pool
+  workers = min(len(FIT_FUNCS), os.cpu_count() or 1)
+  if workers > 1 and not _pool:
+    # Not needed before the window is shown
+    import atexit
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    # Forked workers would inherit Qt and serial port state of the app
+    _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    # Before the interpreter clears modules that the pool needs to shut down
+    atexit.register(_pool.shutdown)
+    _pool_ready.extend(_pool.submit(_preload_fit) for _ in range(workers))
+  # Workers take a second to start and import scipy, models are fitted here until then
+  if not _pool or not all(future.done() for future in _pool_ready):
+    return {fit_type: fit_profile(xs, ys, fit_type, show_delay, roi) for fit_type in FIT_FUNCS}
+  futures = {fit_type: _pool.submit(fit_profile, xs, ys, fit_type, show_delay, roi) for fit_type in FIT_FUNCS}
+  return {fit_type: future.result() for fit_type, future in futures.items()}
+
+def rank_fits(fits) -> list:
+  """
+  Returns successful fits ordered from the best to the worst.
+  """
+  return sorted((f for f in fits if f), key=lambda f: f["aic"])
+
+def to_delay(xs, fit_params: dict):
+  return (xs - fit_params["origin"]) / LIGHT_SPEED
+
+def fit_curve(fit_params: dict, xs):
+  return fit_params["func"](xs, fit_params["amplitude"], fit_params["center"], fit_params["width"])
+
+def fit_fwhm(fit_type: FIT, width: float):
+  """
+  Returns FWHM of a fitted profile and the autocorrelation deconvolution factor.
+  Different fit types have different relationships between width parameter and FWHM.
+  """
+  if fit_type == FIT.gauss:
+    # FWHM = 2 * sqrt(2 * ln(2)) * sigma
+    return 2.3548200450309493 * width, 1.4142135623730951 # sqrt(2)
+  if fit_type == FIT.lorentz:
+    return 2.0 * width, 1.4142135623730951 # sqrt(2)
+  if fit_type == FIT.sech2:
+    # FWHM = 2 * ln(1 + sqrt(2)) * width
+    return 1.7627471740390859 * width, 1.543
+  return None, None
+
+def fit_summary(fit_type: FIT, fit_params: dict, show_delay: bool) -> list:
+  """
+  Returns fit parameters and estimated pulse duration as text lines.
+  """
+  fwhm, deconvolution_factor = fit_fwhm(fit_type, fit_params['width'])
+  if fwhm is None:
+    return []
+
+  pulse_duration = fwhm / deconvolution_factor
+
+  if show_delay:
+    return [
+      f"Fit FWHM: {fwhm:.2f} fs",
+      f"Pulse duration: {pulse_duration:.2f} fs",
+      #f"Amplitude: {fit_params['amplitude']:.2f} a.u."
+    ]
+  return [
+    f"Fit FWHM: {fwhm:.2f} µm",
+    f"Center: {fit_params['center']:.2f} µm",
+    #f"Amplitude: {fit_params['amplitude']:.2f} a.u."
+  ]
+
+def ranking_summary(ranked: list, show_delay: bool) -> list:
+  """
+  Returns text lines comparing the best fit in `ranked` with other models.
+  """
+  if not ranked:
+    return []
+  best = ranked[0]
+  lines = [f"Best model: {best['label']}"]
+  for f in ranked[1:]:
+    fwhm, deconvolution_factor = fit_fwhm(f["type"], abs(f["width"]))
+    value = f"{fwhm / deconvolution_factor:.2f} fs" if show_delay else f"{fwhm:.2f} µm"
+    lines.append(f"{f['label']}: {value}, ΔAIC {f['aic'] - best['aic']:.1f}")
+  return lines
+
+def calc_measured_fwhm(xs, ys):
+  """
+  Returns FWHM from measured data or None if it cannot be calculated.
+  """
+  if ys is None or xs is None or len(ys) < 3:
+    return None
+
+  try:
+    # Find the maximum value and half maximum
+    y_max = np.max(ys)
+    half_max = y_max / 2.0
+
+    # Find indices where y crosses half maximum
+    # Use interpolation for better accuracy
+    above_half = ys >= half_max
+
+    # Find left crossing point
+    left_idx = None
+    for i in range(len(above_half) - 1):
+      if not above_half[i] and above_half[i + 1]:
+        # Interpolate
+        left_idx = i + (half_max - ys[i]) / (ys[i + 1] - ys[i])
+        break
+
+    # Find right crossing point
+    right_idx = None
+    for i in range(len(above_half) - 1, 0, -1):
+      if above_half[i - 1] and not above_half[i]:
+        # Interpolate
+        right_idx = i - 1 + (half_max - ys[i - 1]) / (ys[i] - ys[i - 1])
+        break
+
+    if left_idx is not None and right_idx is not None:
+      # Calculate x positions using interpolated indices
+      x_left = xs[int(left_idx)] + (left_idx - int(left_idx)) * (xs[int(left_idx) + 1] - xs[int(left_idx)])
+      x_right = xs[int(right_idx)] + (right_idx - int(right_idx)) * (xs[int(right_idx) + 1] - xs[int(right_idx)])
+      fwhm = abs(x_right - x_left)
+      return fwhm
+
+    return None
+
+  except Exception as e:
+    log.exception("Failed to calculate measured FWHM")
+    return None
@@ -0,0 +1,96 @@
+import math
+import numpy as np
+
+class FringeTrace:
+  """
+  Components of an interferometric autocorrelation trace, sampled sparser than the trace.
+  """
+  def __init__(self, xs, envelope, intensity, baseline):
+    self.xs = xs
+    # Upper envelope of fringes
+    self.envelope = envelope
+    # Low-pass component, it's proportional to the intensity autocorrelation
+    self.intensity = intensity
+    # Background level far from the pulse
+    self.baseline = baseline
+
+def fringe_period(ys, block_size = 262144) -> float:
+  """
+  Returns the period of fringes in samples, or None if there are no fringes.
+  Fringes are the strongest around the center of the trace, so only that part is analyzed.
+  """
+  n = len(ys)
+  size = min(n, block_size)
+  center = int(np.argmax(ys))
+  start = max(0, min(n - size, center - size // 2))
+  block = ys[start:start + size]
+  spectrum = np.abs(np.fft.rfft((block - np.mean(block)) * np.hanning(size)))
+  # Skip the slow part which is the intensity autocorrelation itself
+  spectrum[:4] = 0
+  k = int(np.argmax(spectrum))
+  # Fringes must stand out clearly, otherwise it's just a noise peak
+  if k == 0 or spectrum[k] <= 10 * np.median(spectrum[4:]):
+    return None
+  return size / k
+
+def _lowpass_weights(freqs, cutoff):
+  # Smooth transition reduces ringing around the pulse
+  return np.clip((1.25 * cutoff - freqs) / (0.5 * cutoff), 0.0, 1.0)
+
+def _amplitude(spectrum, size):
+  # Magnitude of the analytic signal of a band
+  full = np.zeros(size, dtype=complex)
+  half = len(spectrum)
+  full[1:half] = spectrum[1:] * 2.0
+  if size % 2 == 0:
+    full[half - 1] /= 2.0
+  return np.abs(np.fft.ifft(full))
+
+def extract_fringe_trace(xs, ys, block_size = 65536) -> FringeTrace:
+  """
+  Separates an interferometric trace into its upper envelope and intensity component.
+  The trace is filtered by FFT in blocks overlapped with their neighbours
+  to avoid edge effects, so memory used doesn't depend on the trace length.
+  Results are sampled a few times per fringe period which is enough
+  for the low-pass intensity component and the envelope.
+  """
+  xs = np.asarray(xs, dtype=float)
+  ys = np.asarray(ys, dtype=float)
+  n = len(ys)
+  period = fringe_period(ys)
+  if not period or period < 4:
+    raise ValueError("Fringes are not resolved in the trace, scan step is too large")
+  # Intensity component is below, and fringes are above the half of fringe frequency
+  cutoff = 0.5 / period
+  step = max(1, int(period / 4))
+  overlap = min(block_size // 4, max(256, int(period * 16)))
+
+  count = (n + step - 1) // step
+  out_x = xs[::step].copy()
+  envelope = np.empty(count)
+  intensity = np.empty(count)
+
+  for start in range(0, n, block_size):
+    end = min(n, start + block_size)
+    a = max(0, start - overlap)
+    b = min(n, end + overlap)
+    seg = ys[a:b]
+    m = len(seg)
+    spectrum = np.fft.rfft(seg)
+    freqs = np.fft.rfftfreq(m)
+    weights = _lowpass_weights(freqs, cutoff)
+    low = np.fft.irfft(spectrum * weights, m)
+    # Fringes at the fundamental and the second harmonic frequencies
+    # reach their maximums at the same delays, so their amplitudes are summed
+    weights_fund = _lowpass_weights(freqs, 3 * cutoff)
+    amplitude = _amplitude(spectrum * (weights_fund - weights), m) \
+      + _amplitude(spectrum * (1.0 - weights_fund), m)
+    # Outputs of this block, aligned to the common step grid
+    first = math.ceil(start / step) * step
+    idx = np.arange(first, end, step)
+    envelope[idx // step] = low[idx - a] + amplitude[idx - a]
+    intensity[idx // step] = low[idx - a]
+
+  edge = max(1, count // 20)
+  baseline = float(np.median(np.concatenate((intensity[:edge], intensity[-edge:]))))
+  return FringeTrace(out_x, envelope, intensity, baseline)
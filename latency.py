@@ -0,0 +1,63 @@
+import logging
+import time
+from collections import deque
+
+from utils import load_state, save_state
+
+log = logging.getLogger(__name__)
+
+class LatencyStats:
+  """
+  Keeps recently observed latencies of each command
+  and derives adaptive command timeouts from them.
+  """
+  percentile = 99
+  margin = 3.0
+  min_samples = 20
+  min_timeout = 0.05
+  max_samples = 500
+  save_interval = 60
+
+  def __init__(self, state_name = "latency"):
+    self._state_name = state_name
+    self._samples = {}
+    self._changed = False
+    self._last_save = time.perf_counter()
+    try:
+      for name, samples in load_state(state_name).items():
+        self._samples[name] = deque(samples, maxlen=self.max_samples)
+    except Exception:
+      log.exception("load_latency")
+
+  def record(self, name: str, elapsed: float):
+    samples = self._samples.get(name)
+    if samples is None:
+      samples = deque(maxlen=self.max_samples)
+      self._samples[name] = samples
+    samples.append(round(elapsed, 4))
+    self._changed = True
+    if time.perf_counter() - self._last_save > self.save_interval:
+      self.save()
+
+  def timeout(self, name: str, limit: float) -> float:
+    """
+    Returns a timeout for the command, it's never greater than the configured limit.
+    The limit is also returned until enough samples have been collected.
+    """
+    samples = self._samples.get(name)
+    if not samples or len(samples) < self.min_samples:
+      return limit
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100.0))
+    timeout = max(ordered[idx] * self.margin, self.min_timeout)
+    return min(timeout, limit)
+
+  def save(self):
+    self._last_save = time.perf_counter()
+    if not self._changed:
+      return
+    try:
+      save_state(self._state_name, {name: [*samples] for name, samples in self._samples.items()})
+      self._changed = False
+    except Exception:
+      log.exception("save_latency")
@@ -1,21 +1,38 @@
 import sys
+
+if "--profile-startup" in sys.argv:
+  # Must be started before anything else is imported
+  from startup import ImportProfiler
+  profiler = ImportProfiler()
+  profiler.start()
+else:
+  profiler = None
+
 import argparse
 import logging
-from PySide6.QtCore import Qt
+import signal
+from PySide6.QtCore import QCoreApplication, Qt, QTimer
 from PySide6.QtWidgets import QApplication, QMessageBox
 
 from consts import APP_NAME
 from utils import load_icon
 
 def main():
-  logging.basicConfig(level=logging.DEBUG)
-  log = logging.getLogger(__name__)
-
   parser = argparse.ArgumentParser(description=APP_NAME)
   parser.add_argument('--dev', action='store_true', help='Enable development mode')
   parser.add_argument('--virtual', action='store_true', help='Use virtual board')
+  parser.add_argument('--profile-startup', action='store_true', help='Report time spent on importing modules')
+  parser.add_argument('--server', action='store_true', help='Let other processes control the board and receive profiles')
+  parser.add_argument('--headless', action='store_true', help='Run the server without the main window')
+  parser.add_argument('--address', help='Server address, host:port or unix:/path/to/socket')
   args = parser.parse_args()
 
+  logging.basicConfig(level=logging.DEBUG if args.dev else logging.INFO)
+  log = logging.getLogger(__name__)
+
+  if args.headless:
+    sys.exit(run_headless(args))
+
   app = QApplication(sys.argv)
   app.setStyle("fusion")
   app.setWindowIcon(load_icon("main.png"))
@@ -34,11 +51,60 @@ def main():
     QMessageBox.critical(None, APP_NAME, f"Error board initialization: {e}")
     sys.exit(1)
 
+  if args.server:
+    # The main window reports its fits to the server
+    if not start_server(args, fit=False):
+      QMessageBox.critical(None, APP_NAME, "Failed to start server, see the log for details")
+
   # Import MainWindow after the board gets initialized
   from main_window import MainWindow
   window = MainWindow(dev_mode=args.dev)
   window.show()
+  if profiler:
+    QTimer.singleShot(0, lambda: profiler.mark("window shown"))
+    window.plot_ready.connect(lambda: profiler.mark("plot ready"))
   sys.exit(app.exec())
 
+def start_server(args, fit: bool):
+  log = logging.getLogger(__name__)
+  from board import board
+  from server import AcquisitionServer
+  try:
+    AcquisitionServer(board, args.address, fit=fit).start()
+    return True
+  except Exception:
+    log.exception("Error starting server")
+    return False
+
+def run_headless(args) -> int:
+  log = logging.getLogger(__name__)
+  app = QCoreApplication(sys.argv)
+  try:
+    if args.virtual:
+      from virtual_board import VirtualBoard
+      VirtualBoard()
+    else:
+      from serial_board import SerialBoard
+      SerialBoard()
+  except Exception:
+    log.exception("Error board initialization")
+    return 1
+  if not start_server(args, fit=True):
+    return 1
+  signal.signal(signal.SIGINT, lambda *_: app.quit())
+  signal.signal(signal.SIGTERM, lambda *_: app.quit())
+  # Python signal handlers only run when the interpreter gets control
+  timer = QTimer()
+  timer.timeout.connect(lambda: None)
+  timer.start(250)
+  code = app.exec()
+  from server import server
+  server.stop()
+  return code
+
 if __name__ == "__main__":
+    if getattr(sys, "frozen", False):
+      # Fit workers of the frozen app are started by its executable
+      import multiprocessing
+      multiprocessing.freeze_support()
     main()
@@ -1,19 +1,40 @@
+import importlib
 import logging
-from PySide6.QtCore import Qt, QSize
-from PySide6.QtGui import QAction, QActionGroup, QDesktopServices
+import os
+import threading
+from PySide6.QtCore import Qt, QSize, Signal
+from PySide6.QtGui import QAction, QActionGroup, QDesktopServices, QFontDatabase
 from PySide6.QtWidgets import (
-  QLabel, QMainWindow, QMessageBox, QStatusBar, QToolBar, QToolButton, QInputDialog)
+  QDialog, QDockWidget, QFileDialog, QLabel, QMainWindow, QMessageBox, QPlainTextEdit, QStatusBar, QToolBar,
+  QToolButton, QInputDialog, QVBoxLayout)
 
 from board import board
 from board_params_dialog import BoardParamsDialog
 from consts import APP_NAME, APP_VERSION, APP_PAGE, CMD
-from plot import Plot
-from utils import load_icon, make_sample_profile, VisibilityEventFilter
+from pipeline import Pipeline
+from profiling import DETERMINISTIC, SAMPLING, ThreadProfiler
+from roi import FitRoi
+from scan_profile import ScanProfile
+from server import server
+from session import Session
+from tracing import tracer
+from trend_panel import TREND_METRICS, TrendPanel, make_trend_history
+from utils import app_dir, load_icon, load_state, make_sample_profile, save_state, VisibilityEventFilter
 
 log = logging.getLogger(__name__)
 
+# Plot widget classes and modules they are defined in
+PLOT_BACKENDS = {
+  "matplotlib": ("plot", "Plot"),
+  "fast": ("fast_plot", "FastPlot"),
+}
+
 class MainWindow(QMainWindow):
   action_groups = {}
+  # Emitted when the plot has been created and put in the window
+  plot_ready = Signal()
+  _plot_loaded = Signal(str, str)
+  _session_exported = Signal(str, int, str)
 
   def __init__(self, dev_mode=False):
     super().__init__()
@@ -21,9 +42,45 @@ class MainWindow(QMainWindow):
     self.setWindowTitle(f"{APP_NAME} {APP_VERSION}")
 
     self.dev_mode = dev_mode
-
-    self.plot = Plot(self)
-    self.setCentralWidget(self.plot)
+    self.params_dialog = None
+    # Parameters are being read for the dialog that is not shown yet
+    self._params_requested = False
+
+    try:
+      self.ui_state = load_state("window")
+    except Exception:
+      log.exception("load_window_state")
+      self.ui_state = {}
+    self.plot_backend = self.ui_state.get("plot")
+    if self.plot_backend not in PLOT_BACKENDS:
+      self.plot_backend = "matplotlib"
+
+    # The plot needs matplotlib and scipy that take several seconds to import,
+    # they are loaded in background while the window is already usable
+    self.plot = None
+    self.pipeline = Pipeline(board.config)
+    self.fit_roi = FitRoi(board.config)
+    self._plot_actions = []
+    self._plot_data = None
+    self.lab_plot_loading = QLabel("Loading plot...")
+    self.lab_plot_loading.setAlignment(Qt.AlignCenter)
+    self.lab_plot_loading.setStyleSheet("QLabel{color:gray;}")
+    self.setCentralWidget(self.lab_plot_loading)
+    self._plot_loaded.connect(self.create_plot)
+    threading.Thread(target=self.load_plot, args=(self.plot_backend,), daemon=True).start()
+
+    # Fit results of all sweeps for watching the laser stability
+    self.trend = make_trend_history()
+    self.trend_panel = TrendPanel(self.trend)
+    self.trend_dock = QDockWidget("Trend", self)
+    self.trend_dock.setObjectName("trend")
+    self.trend_dock.setWidget(self.trend_panel)
+    self.addDockWidget(Qt.BottomDockWidgetArea, self.trend_dock)
+    self.trend_dock.setVisible(self.ui_state.get("trend", False))
+
+    # All sweeps with their fit results for exporting
+    self.session = Session(board.config.value("session/spool_dir", ""))
+    self._session_exported.connect(self.session_exported)
 
     self.create_menu_bar()
     self.create_tool_bar()
@@ -31,9 +88,8 @@ class MainWindow(QMainWindow):
 
     board.on_command_beg.connect(self.board_command_beg)
     board.on_command_end.connect(self.board_command_end)
-    board.on_data_received.connect(self.plot.draw_graph)
-    board.on_params_received.connect(self.edit_board_params)
-    board.on_param_stored.connect(self.board_param_stored)
+    board.on_data_received.connect(self.draw_graph)
+    board.on_params_received.connect(self.board_params_received)
     board.on_stage_moved.connect(self.show_position)
 
     self.show_connection()
@@ -68,7 +124,7 @@ class MainWindow(QMainWindow):
     m = self.menuBar().addMenu("Board")
     self.act_connect = A("Connect", board.toggle_connection, m, icon="connect")
     self.act_disconnect = A("Disconnect", board.toggle_connection, m, icon="disconnect")
-    self.act_board_params = A("Firmware Parameters...", board.query_params, m, icon="chip")
+    self.act_board_params = A("Firmware Parameters...", self.open_board_params, m, icon="chip")
     m.addSeparator()
     A("Exit", self.close, m, key="Ctrl+Q")
 
@@ -88,18 +144,56 @@ class MainWindow(QMainWindow):
     self.act_scan.setToolTip("Single Scan")
     self.act_scans = A("Continuous", board.scans, m, key="F9", icon="video")
     self.act_scans.setToolTip("Continuous Scanning")
+    self.act_auto_window = A("Auto Window", self.toggle_auto_window, m, checked=board.auto_window)
+    self.act_auto_window.setToolTip("Scan only around the peak found in the previous sweep")
+    m.addSeparator()
+    A("Show Delay", self.plot_action("show_as_delay"), m, group="scan", checked=True)
+    A("Show Position", self.plot_action("show_as_pos"), m, group="scan")
+    m.addSeparator()
+    A("Intensity Autocorrelation", self.plot_action("show_intensity_ac"), m, group="trace", checked=True)
+    A("Interferometric Autocorrelation", self.plot_action("show_interferometric_ac"), m, group="trace")
+    m.addSeparator()
+    for key in ("subtract", "smooth", "normalize"):
+      stage = self.pipeline.stage(key)
+      A(stage.title, lambda checked, stage=stage: self.toggle_processing(stage, checked), m, checked=stage.enabled)
+    m.addSeparator()
+    A("Gaussian Fit", self.plot_action("fit_gauss"), m, group="fit", checked=True)
+    A("Lorentzian Fit", self.plot_action("fit_lorentz"), m, group="fit")
+    A("sech² Fit", self.plot_action("fit_sech2"), m, group="fit")
+    a = A("Best Fit", self.plot_action("fit_auto"), m, group="fit")
+    a.setToolTip("Fit all models and show the one that matches the profile best")
+    self.act_fit_roi = A("Fit Peak Region", self.toggle_fit_roi, m, checked=self.fit_roi.enabled)
+    self.act_fit_roi.setToolTip("Fit only the region around the peak, drag over the plot to set it")
+    A("Reset Fit Region", self.plot_action("reset_roi"), m)
     m.addSeparator()
-    A("Show Delay", self.plot.show_as_delay, m, group="scan", checked=True)
-    A("Show Position", self.plot.show_as_pos, m, group="scan")
+    A("Matplotlib Plot", lambda: self.set_plot_backend("matplotlib"), m, group="plot", checked=self.plot_backend == "matplotlib")
+    A("Fast Plot", lambda: self.set_plot_backend("fast"), m, group="plot", checked=self.plot_backend == "fast")
+    self.act_save_image = A("Save Plot Image...", self.save_plot_image, m)
     m.addSeparator()
-    A("Gaussian Fit", self.plot.fit_gauss, m, group="fit", checked=True)
-    A("Lorentzian Fit", self.plot.fit_lorentz, m, group="fit")
-    A("sech² Fit", self.plot.fit_sech2, m, group="fit")
+    act_trend = self.trend_dock.toggleViewAction()
+    act_trend.setText("Show Trend")
+    act_trend.triggered.connect(self.toggle_trend)
+    m.addAction(act_trend)
+    A("Clear Trend", self.clear_trend, m)
+    m.addSeparator()
+    self.act_export_session = A("Export Session...", self.export_session, m)
+    self.act_export_session.setToolTip("Save all sweeps of the session with their fit results")
+    self.act_clear_session = A("Clear Session", self.clear_session, m)
 
     if self.dev_mode:
       m = self.menuBar().addMenu("Debug")
       A("Simulate disconnection", board.debug_simulate_disconnection, m)
       A("Simulate command error", board.debug_simulate_command_error, m)
+      m.addSeparator()
+      for ch in tracer.channels():
+        A(f"Trace {ch.name}", lambda checked, name=ch.name: tracer.enable(name, checked), m, checked=ch.enabled)
+      m.addSeparator()
+      self.profilers = {"board": board.profiler, "gui": ThreadProfiler("gui", threading.get_ident())}
+      self.profile_actions = {}
+      for name, title in (("board", "Board Thread"), ("gui", "GUI Thread")):
+        for mode, verb in ((DETERMINISTIC, "Profile"), (SAMPLING, "Sample")):
+          self.profile_actions[(name, mode)] = A(f"{verb} {title}",
+            lambda checked, name=name, mode=mode: self.toggle_profiling(name, mode, checked), m, checked=False)
 
     m = self.menuBar().addMenu('Help')
     A("Visit Project Page", self.show_homepage, m, icon="globe")
@@ -178,6 +272,190 @@ class MainWindow(QMainWindow):
     sb.addWidget(self.lab_run)
     self.setStatusBar(sb)
 
+  def load_plot(self, backend: str):
+    # Runs in a background thread, only imports are done here,
+    # widgets must be created in the main thread
+    try:
+      importlib.import_module(PLOT_BACKENDS[backend][0])
+      import scipy.optimize
+      self._plot_loaded.emit(backend, "")
+    except Exception as e:
+      log.exception("load_plot")
+      self._plot_loaded.emit(backend, str(e))
+
+  def create_plot(self, backend: str, err: str):
+    if backend != self.plot_backend:
+      # Another backend has been selected while this one was loading
+      return
+    if err:
+      if self.plot:
+        QMessageBox.critical(self, APP_NAME, f"Failed to load plot: {err}")
+      else:
+        self.lab_plot_loading.setText(f"Failed to load plot: {err}")
+      return
+    module_name, class_name = PLOT_BACKENDS[backend]
+    old_plot = self.plot
+    self.plot = getattr(importlib.import_module(module_name), class_name)(self)
+    self.plot.pipeline = self.pipeline
+    self.plot.fit_roi = self.fit_roi
+    if old_plot:
+      self.plot.copy_view(old_plot)
+    self.setCentralWidget(self.plot)
+    self.lab_plot_loading = None
+    for name in self._plot_actions:
+      getattr(self.plot, name)()
+    self._plot_actions = []
+    if self._plot_data:
+      self.plot.draw_graph(*self._plot_data)
+      self._plot_data = None
+    self.plot_ready.emit()
+
+  def plot_action(self, name: str):
+    def handler():
+      if self.plot:
+        getattr(self.plot, name)()
+      else:
+        # Applied when the plot gets loaded
+        self._plot_actions.append(name)
+    return handler
+
+  def set_plot_backend(self, backend: str):
+    if backend == self.plot_backend:
+      return
+    self.plot_backend = backend
+    self.ui_state["plot"] = backend
+    try:
+      save_state("window", self.ui_state)
+    except Exception:
+      log.exception("save_window_state")
+    threading.Thread(target=self.load_plot, args=(backend,), daemon=True).start()
+
+  def save_plot_image(self):
+    if not self.plot or self.plot.xs is None:
+      QMessageBox.information(self, APP_NAME, "There is no profile to save yet")
+      return
+    file_name, _ = QFileDialog.getSaveFileName(self, APP_NAME, "",
+      "PNG image (*.png);;SVG image (*.svg);;PDF document (*.pdf)")
+    if not file_name:
+      return
+    try:
+      # The image is always made by matplotlib regardless of the plot backend
+      from plot_image import export_image
+      export_image(self.plot, file_name)
+    except Exception as e:
+      log.exception("save_plot_image")
+      QMessageBox.critical(self, APP_NAME, f"Failed to save image: {e}")
+
+  def toggle_processing(self, stage, enabled: bool):
+    stage.enabled = enabled
+    self.plot_action("reprocess")()
+
+  def toggle_fit_roi(self):
+    self.fit_roi.enabled = self.act_fit_roi.isChecked()
+    self.plot_action("reset_roi")()
+
+  def toggle_trend(self, visible: bool):
+    self.ui_state["trend"] = visible
+    try:
+      save_state("window", self.ui_state)
+    except Exception:
+      log.exception("save_window_state")
+
+  def clear_trend(self):
+    self.trend.clear()
+    self.trend_panel.plot.update()
+
+  def export_session(self):
+    if not len(self.session):
+      QMessageBox.information(self, APP_NAME, "There are no sweeps to export yet")
+      return
+    from export import EXPORT_FILTERS
+    file_name, selected = QFileDialog.getSaveFileName(self, APP_NAME, "", EXPORT_FILTERS)
+    if not file_name:
+      return
+    if not os.path.splitext(file_name)[1]:
+      # The format is given by the extension, take it from the selected filter "Title (*.ext)"
+      file_name += selected[selected.index("*") + 1:-1]
+    # Sweeps keep coming while the session is written,
+    # only the ones recorded before are exported
+    self.act_export_session.setEnabled(False)
+    self.act_clear_session.setEnabled(False)
+    threading.Thread(target=self._export_session, args=(file_name,), daemon=True).start()
+
+  def _export_session(self, file_name: str):
+    # Runs in a background thread
+    try:
+      from export import export_session
+      count = export_session(self.session, file_name)
+      self._session_exported.emit(file_name, count, "")
+    except Exception as e:
+      log.exception("export_session")
+      self._session_exported.emit(file_name, 0, str(e) or type(e).__name__)
+
+  def session_exported(self, file_name: str, count: int, err: str):
+    self.act_export_session.setEnabled(True)
+    self.act_clear_session.setEnabled(True)
+    if err:
+      QMessageBox.critical(self, APP_NAME, f"Failed to export session: {err}")
+    else:
+      QMessageBox.information(self, APP_NAME, f"{count} sweeps exported to {file_name}")
+
+  def clear_session(self):
+    self.session.clear()
+
+  def toggle_profiling(self, name: str, mode: str, enabled: bool):
+    profiler = self.profilers[name]
+    other = self.profile_actions[(name, SAMPLING if mode == DETERMINISTIC else DETERMINISTIC)]
+    try:
+      if enabled:
+        profiler.start(mode, board.config.value("profiling/sample_interval_ms", 2) / 1000.0)
+      else:
+        out_dir = board.config.value("profiling/dir", "") or os.path.join(app_dir(), "profiles")
+        summary = profiler.stop(out_dir)
+    except Exception as e:
+      log.exception("profiling")
+      self.profile_actions[(name, mode)].setChecked(profiler.mode == mode)
+      QMessageBox.critical(self, APP_NAME, f"Profiling failed: {e}")
+      return
+    other.setEnabled(not enabled)
+    if not enabled:
+      self.show_profile_summary(summary)
+
+  def show_profile_summary(self, summary: str):
+    dlg = QDialog(self)
+    dlg.setWindowTitle("Profiling Results")
+    dlg.setAttribute(Qt.WA_DeleteOnClose)
+    text = QPlainTextEdit(summary)
+    text.setReadOnly(True)
+    text.setLineWrapMode(QPlainTextEdit.NoWrap)
+    text.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+    layout = QVBoxLayout(dlg)
+    layout.addWidget(text)
+    dlg.resize(900, 500)
+    dlg.show()
+
+  def toggle_auto_window(self):
+    board.auto_window = self.act_auto_window.isChecked()
+    if not board.auto_window:
+      board.scan_window.peak_lost()
+
+  def draw_graph(self, profile: ScanProfile):
+    if self.plot:
+      self.plot.draw_graph(profile.xs, profile.ys)
+      if board.auto_window and len(profile) > 0:
+        board.scan_window.profile_fitted(self.plot.peak_position(), profile.xs.min(), profile.xs.max())
+      if server:
+        server.publish_fit(self.plot, profile.seq)
+      values = self.plot.fit_values()
+      if values:
+        self.trend.add(profile.finished, [values[key] for key, _ in TREND_METRICS])
+        self.trend_panel.result_added()
+      self.session.add(profile, self.plot.fit_params["type"] if values else None, values)
+    else:
+      # Only the latest profile is worth drawing
+      self._plot_data = (profile.xs, profile.ys)
+      self.session.add(profile)
+
   def show_homepage(self):
     QDesktopServices.openUrl(APP_PAGE)
 
@@ -199,6 +477,9 @@ class MainWindow(QMainWindow):
     self.lab_run.hide()
     if cmd == CMD.connect or cmd == CMD.disconnect:
       self.show_connection()
+    if cmd == CMD.param and err:
+      # Values have not been read, the dialog waiting for them is not shown
+      self._params_requested = False
     if err:
       QMessageBox.critical(self, APP_NAME, err)
 
@@ -239,12 +520,28 @@ class MainWindow(QMainWindow):
     if ok and int(new_pos*10) != int(old_pos*10):
       board.move(new_pos)
 
-  def edit_board_params(self):
-    changes = BoardParamsDialog(self).run()
+  def open_board_params(self):
+    cached = board.port_cached_params()
+    requested = board.query_params()
+    # The dialog is shown once per request, either now or when the board answers
+    self._params_requested = requested and cached is None
+    if cached is not None:
+      # Show remembered values immediately, they are refreshed when the board answers
+      self.edit_board_params(cached, updating=requested)
+
+  def board_params_received(self):
+    if self.params_dialog:
+      self.params_dialog.refresh()
+    elif self._params_requested:
+      self._params_requested = False
+      self.edit_board_params()
+
+  def edit_board_params(self, params: dict = None, updating=False):
+    self.params_dialog = BoardParamsDialog(self, params, updating)
+    try:
+      changes = self.params_dialog.run()
+    finally:
+      self.params_dialog = None
     if changes:
       log.debug(f"changes:{changes}({len(changes)})")
       board.store_params(changes)
-
-  def board_param_stored(self, has_more):
-    if has_more:
-      board.store_next_param()
@@ -0,0 +1,150 @@
+import logging
+import time
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+class Stage:
+  """
+  A processing step applied to profiles before fitting.
+  Stages change `ys` in place, `Pipeline` gives them a buffer they own.
+  """
+  # Key of the stage in the "processing" config section
+  key = ""
+  title = ""
+  enabled_default = False
+  # Whether the stage keeps fringes of interferometric traces
+  fringe_safe = True
+
+  def __init__(self, config):
+    self.config = config
+    self.enabled = config.value(f"processing/{self.key}", self.enabled_default)
+
+  def process(self, pipeline: 'Pipeline', xs, ys):
+    # Stages override it to change `ys` in place
+    pass
+
+class EstimateBaseline(Stage):
+  """
+  Fits a straight line through both wings of the profile, far from the peak.
+  """
+  key = "baseline"
+  title = "Estimate Baseline"
+  enabled_default = True
+
+  def process(self, pipeline: 'Pipeline', xs, ys):
+    n = len(ys)
+    wing = max(2, int(n * self.config.value("processing/baseline_wings", 0.1)))
+    if n < wing * 2:
+      pipeline.baseline = (0.0, 0.0)
+      return
+    # Medians of the wings are not affected by noise spikes
+    x0 = np.median(xs[:wing])
+    x1 = np.median(xs[-wing:])
+    y0 = np.median(ys[:wing])
+    y1 = np.median(ys[-wing:])
+    slope = (y1 - y0) / (x1 - x0) if x1 != x0 else 0.0
+    if not self.config.value("processing/baseline_slope", True):
+      slope = 0.0
+    pipeline.baseline = ((y0 + y1) / 2.0 - slope * (x0 + x1) / 2.0, slope)
+
+class SubtractBackground(Stage):
+  key = "subtract"
+  title = "Subtract Background"
+  enabled_default = True
+
+  def process(self, pipeline: 'Pipeline', xs, ys):
+    offset, slope = pipeline.baseline
+    if slope:
+      scratch = pipeline.scratch(len(ys))
+      np.multiply(xs, slope, out=scratch)
+      ys -= scratch
+    ys -= offset
+
+class Normalize(Stage):
+  """
+  Scales the profile to the unit peak height.
+  """
+  key = "normalize"
+  title = "Normalize"
+
+  def process(self, pipeline: 'Pipeline', xs, ys):
+    peak = np.max(ys) if len(ys) else 0.0
+    if peak > 0:
+      ys *= 1.0 / peak
+
+class Smooth(Stage):
+  """
+  Savitzky-Golay smoothing, it reduces noise keeping the peak shape.
+  """
+  key = "smooth"
+  title = "Smooth"
+  fringe_safe = False
+
+  def __init__(self, config):
+    super().__init__(config)
+    self._coeffs = {}
+
+  def process(self, pipeline: 'Pipeline', xs, ys):
+    window = int(self.config.value("processing/smooth_window", 11)) | 1
+    order = int(self.config.value("processing/smooth_order", 3))
+    if len(ys) < window or order >= window:
+      return
+    from scipy.ndimage import convolve1d
+    coeffs = self._coeffs.get((window, order))
+    if coeffs is None:
+      from scipy.signal import savgol_coeffs
+      coeffs = savgol_coeffs(window, order)
+      self._coeffs[(window, order)] = coeffs
+    scratch = pipeline.scratch(len(ys))
+    convolve1d(ys, coeffs, output=scratch, mode='nearest')
+    ys[:] = scratch
+
+STAGES = (EstimateBaseline, SubtractBackground, Smooth, Normalize)
+
+class Pipeline:
+  """
+  Processing stages applied in order to every profile before fitting.
+  The raw profile is kept intact, it's copied once to a buffer that stages work on.
+  """
+  def __init__(self, config):
+    self.stages = [stage(config) for stage in STAGES]
+    # Offset and slope of the background line found by `EstimateBaseline`
+    self.baseline = (0.0, 0.0)
+    # Time taken by each stage for the last profile in seconds
+    self.timings = {}
+    self._scratch = None
+
+  def stage(self, key: str) -> Stage:
+    return next(s for s in self.stages if s.key == key)
+
+  def scratch(self, size: int):
+    """
+    Returns a temporary buffer for stages, it's reused between them and between profiles.
+    """
+    if self._scratch is None or len(self._scratch) != size:
+      self._scratch = np.empty(size)
+    return self._scratch
+
+  def run(self, xs, ys, interferometric = False, out = None):
+    """
+    Returns the processed copy of `ys`, it's made in `out` if given.
+    """
+    if out is None:
+      ys = np.array(ys, dtype=float)
+    else:
+      out[:] = ys
+      ys = out
+    self.baseline = (0.0, 0.0)
+    self.timings = {}
+    for stage in self.stages:
+      if not stage.enabled or (interferometric and not stage.fringe_safe):
+        continue
+      t = time.perf_counter()
+      try:
+        stage.process(self, xs, ys)
+      except Exception:
+        log.exception(f"pipeline:{stage.key}")
+      self.timings[stage.key] = time.perf_counter() - t
+    log.debug("pipeline:" + " ".join(f"{k}={v * 1000:.2f}ms" for k, v in self.timings.items()))
+    return ys
@@ -0,0 +1,66 @@
+"""
+Drawing of profiles by matplotlib without a GUI,
+it's shared by the plot widget, image export and reports.
+"""
+import logging
+
+# There are tons of debug messages about found fonts
+# that makes the global DEBUG level totally useless
+logging.getLogger('matplotlib').level = logging.WARN
+logging.getLogger('matplotlib.font_manager').level = logging.WARN
+
+from matplotlib.figure import Figure
+
+from plot_view import ProfileView
+
+EXTRA_STYLES = {
+  "envelope": 'k-',
+  "intensity": 'g-',
+}
+
+def draw_profile(axes, view: ProfileView):
+  """
+  Draws the profile and its fit of a plot on matplotlib axes.
+  """
+  axes.clear()
+  xs, ys, x_fit, y_fit = view.display_data(axes.bbox.width)
+  if xs is None:
+    return
+
+  text = view.fit_text()
+  if text:
+    axes.text(
+      0.02,
+      0.98,
+      '\n'.join(text),
+      transform=axes.transAxes,
+      verticalalignment='top',
+      horizontalalignment='left',
+      #bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.8),
+      #fontsize=9,
+      #family='monospace'
+    )
+  axes.plot(xs, ys, 'b-', linewidth=1.5, label="Experimental", alpha=0.7)
+  for label, style, ex, ey in view.display_extra(axes.bbox.width):
+    axes.plot(ex, ey, EXTRA_STYLES[style], linewidth=1.5, label=label)
+  if view.fit_params:
+    axes.plot(x_fit, y_fit, 'r-', linewidth=2, label=view.fit_params["label"])
+  roi = view.display_roi()
+  if roi:
+    axes.axvspan(*roi, color='orange', alpha=0.1, label="Fit region")
+  axes.set_xlabel(view.x_label())
+  axes.set_ylabel(view.y_label())
+  #axes.set_title('')
+  axes.grid(True, alpha=0.3)
+  axes.legend()
+
+def export_image(view: ProfileView, file_name: str):
+  """
+  Saves the plot as an image, the format is defined by the file extension.
+  Works for any plot widget, the figure is rendered by matplotlib.
+  """
+  fig = Figure(figsize=(8, 6), dpi=150)
+  axes = fig.add_subplot(111)
+  fig.tight_layout(pad=4.0, w_pad=1.0, h_pad=1.0)
+  draw_profile(axes, view)
+  fig.savefig(file_name)
@@ -0,0 +1,298 @@
+import logging
+import numpy as np
+
+from decimation import Decimator
+from fitting import (
+  FIT, FIT_FUNCS, LIGHT_SPEED, fit_curve, fit_fwhm, fit_models, fit_profile, fit_summary, rank_fits, ranking_summary, to_delay)
+from interferometric import extract_fringe_trace
+
+log = logging.getLogger(__name__)
+
+class ProfileView:
+  """
+  Display options and fitting shared by plot widgets.
+  Subclasses implement `_redraw` to show the data and the fit, see `display_data`.
+  """
+  fit_type = FIT.gauss
+  show_delay = True
+  # Fringe-resolved trace, its intensity component is fitted
+  interferometric = False
+  x_data = None
+  y_data = None
+  xs = None
+  ys = None
+  fit_params = None
+  # Fits of the current profile by fit type, switching between models doesn't refit
+  _fits = None
+  _fits_roi = None
+  # Fits of all models from the best one, in the auto mode
+  ranked_fits = ()
+  x_range = None
+  # The fit curve evaluated for the last drawn width
+  x_fit = None
+  y_fit = None
+  # Buffers for the current profile transformed in place, reused while its length is the same
+  _xs_buf = None
+  _ys_buf = None
+  _decimator: Decimator = None
+  # Additional curves as tuples (label, style, decimator)
+  _extra = ()
+  # Processing stages applied before fitting, see `Pipeline`
+  pipeline = None
+  # Chooses the fitted part of profiles, see `FitRoi`
+  fit_roi = None
+  # The fitted part of the current profile in stage positions
+  roi = None
+
+  def show_as_pos(self):
+    self.show_delay = False
+    self._refit()
+
+  def show_as_delay(self):
+    self.show_delay = True
+    self._refit()
+
+  def show_intensity_ac(self):
+    self.interferometric = False
+    self._refit()
+
+  def show_interferometric_ac(self):
+    self.interferometric = True
+    self._refit()
+
+  def fit_gauss(self):
+    self.fit_type = FIT.gauss
+    self._replot()
+
+  def fit_lorentz(self):
+    self.fit_type = FIT.lorentz
+    self._replot()
+
+  def fit_sech2(self):
+    self.fit_type = FIT.sech2
+    self._replot()
+
+  def fit_auto(self):
+    self.fit_type = FIT.auto
+    self._replot()
+
+  def draw_graph(self, x, y):
+    self.x_data = np.asarray(x, dtype=float)
+    self.y_data = np.asarray(y, dtype=float)
+    self._refit()
+
+  def copy_view(self, other: 'ProfileView'):
+    """
+    Takes display options and data from another plot.
+    """
+    self.fit_type = other.fit_type
+    self.show_delay = other.show_delay
+    self.interferometric = other.interferometric
+    self.pipeline = other.pipeline
+    self.fit_roi = other.fit_roi
+    if other.x_data is not None:
+      self.draw_graph(other.x_data, other.y_data)
+
+  def _refit(self):
+    self._fits = None
+    self._replot()
+
+  def _fit(self, xs, ys, roi):
+    if self._fits is None or roi != self._fits_roi:
+      self._fits = {}
+      self._fits_roi = roi
+    if self.fit_type == FIT.auto:
+      if any(fit_type not in self._fits for fit_type in FIT_FUNCS):
+        self._fits.update(fit_models(xs, ys, self.show_delay, roi))
+      self.ranked_fits = rank_fits(self._fits.values())
+      return self.ranked_fits[0] if self.ranked_fits else None
+    self.ranked_fits = ()
+    if self.fit_type not in self._fits:
+      self._fits[self.fit_type] = fit_profile(xs, ys, self.fit_type, self.show_delay, roi)
+    return self._fits[self.fit_type]
+
+  def _replot(self):
+    if self.x_data is None:
+      return
+
+    # For delay calculation we need to double the positions
+    # When the stage shifts on a distance, the beam passes that distance back and forth
+    scale = 2.0 if self.show_delay else 1.0
+    n = len(self.x_data)
+    if self._xs_buf is None or len(self._xs_buf) != n:
+      self._xs_buf = np.empty(n)
+      self._ys_buf = np.empty(n)
+    self.xs = np.multiply(self.x_data, scale, out=self._xs_buf)
+    self.ys = self.y_data
+    if self.pipeline:
+      self.ys = self.pipeline.run(self.xs, self.y_data, self.interferometric, out=self._ys_buf)
+    self._extra = ()
+
+    trace = None
+    if self.interferometric and len(self.xs) > 0:
+      try:
+        trace = extract_fringe_trace(self.xs, self.ys)
+      except ValueError as e:
+        log.warning(f"Interferometric trace is fitted as is: {e}")
+      except Exception:
+        log.exception("extract_fringe_trace")
+
+    if trace:
+      # Fit the intensity autocorrelation over its background,
+      # fit models and deconvolution factors are made for it
+      if self.ys is self._ys_buf:
+        self.ys -= trace.baseline
+      else:
+        self.ys = self.ys - trace.baseline
+      envelope = trace.envelope - trace.baseline
+      intensity = trace.intensity - trace.baseline
+      self.fit_params = self._fit(trace.xs, intensity, self._update_roi(trace.xs, intensity, scale))
+      trace_xs = trace.xs
+      if self.fit_params:
+        trace_xs = self.fit_params["xs"]
+        if self.show_delay:
+          self.xs = to_delay(self.xs, self.fit_params)
+      self._extra = (
+        ("Envelope", "envelope", Decimator(trace_xs, envelope)),
+        ("Intensity AC", "intensity", Decimator(trace_xs, intensity)),
+      )
+    else:
+      self.fit_params = self._fit(self.xs, self.ys, self._update_roi(self.xs, self.ys, scale))
+      if self.fit_params:
+        self.xs = self.fit_params["xs"]
+    self.x_fit = None
+    self.y_fit = None
+
+    # Fitting uses all points but only a few per pixel are drawn
+    self.x_range = (float(np.min(self.xs)), float(np.max(self.xs))) if len(self.xs) else None
+    if not self._decimator:
+      self._decimator = Decimator()
+    self._decimator.set_data(self.xs, self.ys)
+
+    self._redraw()
+
+  def reprocess(self):
+    """
+    Applies changed processing settings to the current profile.
+    """
+    self._refit()
+
+  def _update_roi(self, xs, ys, scale: float):
+    # Returns the region to fit in the same units as `xs`
+    self.roi = self.fit_roi.update(xs / scale, ys) if self.fit_roi else None
+    if not self.roi:
+      return None
+    return self.roi[0] * scale, self.roi[1] * scale
+
+  def _to_position(self, x: float) -> float:
+    if not self.show_delay:
+      return x
+    if self.fit_params:
+      x = x * LIGHT_SPEED + self.fit_params["origin"]
+    return x / 2.0
+
+  def _from_position(self, x: float) -> float:
+    if not self.show_delay:
+      return x
+    x *= 2.0
+    if self.fit_params:
+      x = (x - self.fit_params["origin"]) / LIGHT_SPEED
+    return x
+
+  def set_roi(self, start: float, stop: float):
+    """
+    Sets the fitted region by its bounds on the plot.
+    """
+    if not self.fit_roi or self.x_data is None:
+      return
+    self.fit_roi.set_manual(self._to_position(start), self._to_position(stop))
+    self._replot()
+
+  def reset_roi(self):
+    if self.fit_roi:
+      self.fit_roi.reset()
+      self._replot()
+
+  def display_roi(self):
+    """
+    Returns bounds of the fitted region on the plot, or None if the whole profile is fitted.
+    """
+    if not self.roi or not self.x_range:
+      return None
+    return self._from_position(self.roi[0]), self._from_position(self.roi[1])
+
+  def display_data(self, columns: float):
+    """
+    Returns the data and the fit curve to be drawn on the given number of pixel columns.
+    """
+    if not self.x_range:
+      return None, None, None, None
+    columns = max(1, int(columns))
+    x0, x1 = self.x_range
+    xs, ys = self._decimator.get(x0, x1, columns)
+    if self.fit_params:
+      if self.x_fit is None or len(self.x_fit) != columns + 1:
+        self.x_fit = np.linspace(x0, x1, columns + 1)
+        self.y_fit = fit_curve(self.fit_params, self.x_fit)
+    return xs, ys, self.x_fit, self.y_fit
+
+  def display_extra(self, columns: float) -> list:
+    """
+    Returns additional curves as tuples (label, style, xs, ys)
+    to be drawn on the given number of pixel columns.
+    """
+    if not self.x_range:
+      return []
+    columns = max(1, int(columns))
+    x0, x1 = self.x_range
+    return [(label, style, *decimator.get(x0, x1, columns)) for label, style, decimator in self._extra]
+
+  def _redraw(self):
+    # Plot backends override it to draw the data and the fit
+    pass
+
+  def fit_text(self) -> list:
+    if not self.fit_params:
+      return []
+    return fit_summary(self.fit_params["type"], self.fit_params, self.show_delay) \
+      + ranking_summary(self.ranked_fits, self.show_delay)
+
+  def peak_position(self):
+    """
+    Returns center and FWHM of the fitted peak in stage positions, or None if there is no fit.
+    """
+    if not self.fit_params:
+      return None
+    fwhm, _ = fit_fwhm(self.fit_params["type"], abs(self.fit_params["width"]))
+    if fwhm is None:
+      return None
+    if self.show_delay:
+      # Delays are counted for the doubled beam path
+      return self.fit_params["origin"] / 2.0, fwhm * LIGHT_SPEED / 2.0
+    return self.fit_params["center"], fwhm
+
+  def fit_values(self) -> dict:
+    """
+    Returns pulse duration and autocorrelation FWHM in fs and the peak position in stage positions,
+    they don't depend on the display mode. Returns None if there is no fit.
+    """
+    peak = self.peak_position()
+    if not peak:
+      return None
+    center, fwhm = peak
+    _, deconvolution_factor = fit_fwhm(self.fit_params["type"], 1.0)
+    ac_fwhm = fwhm * 2.0 / LIGHT_SPEED
+    return {"duration": ac_fwhm / deconvolution_factor, "fwhm": ac_fwhm, "center": center}
+
+  def x_label(self) -> str:
+    return "Delay (fs)" if self.show_delay else "Position (um)"
+
+  def y_label(self) -> str:
+    return "Intensity (a.u.)"
+
+class HeadlessView(ProfileView):
+  """
+  Processes and fits profiles the same way as plots do but doesn't draw them.
+  """
+  def _redraw(self):
+    pass
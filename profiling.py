@@ -0,0 +1,236 @@
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+log = logging.getLogger(__name__)
+
+DETERMINISTIC = "deterministic"
+SAMPLING = "sampling"
+
+_now = time.perf_counter
+
+def _label(file: str, line: int, func: str) -> str:
+  if file == "~":
+    # Built-in functions are reported as "<built-in method time.sleep>"
+    return func
+  return f"{func} ({os.path.basename(file)}:{line})"
+
+def _code_label(code) -> str:
+  return _label(code.co_filename, code.co_firstlineno, code.co_qualname)
+
+def _builtin_label(func) -> str:
+  owner = getattr(func, "__self__", None)
+  if owner is None or type(owner).__name__ == "module":
+    module = getattr(func, "__module__", None) or getattr(owner, "__name__", "")
+    return f"<built-in method {module}.{func.__name__}>" if module else f"<built-in method {func.__name__}>"
+  return f"<method '{func.__name__}' of '{type(owner).__name__}' objects>"
+
+class _ThreadProfile:
+  """
+  Deterministic profiler of the thread that enables it, with results in the cProfile format.
+  Since Python 3.12, cProfile sees calls in all threads, this one is used instead.
+  It's slower than cProfile as it's written in Python.
+  """
+  def __init__(self):
+    # Same as `pstats.Stats.stats`: calls, primitive calls, own time, cumulative time, callers
+    self.stats = {}
+    self._entries = {}
+    # Calls in progress: key, start time, time in callees, frame, whether it's a built-in
+    self._stack = []
+    self._depth = Counter()
+
+  def enable(self):
+    sys.setprofile(self._event)
+
+  def disable(self):
+    sys.setprofile(None)
+
+  def create_stats(self):
+    self.stats = {key: (e[0], e[1], e[2], e[3], e[4]) for key, e in self._entries.items()}
+
+  def _event(self, frame, event, arg):
+    t = _now()
+    if event == "call":
+      code = frame.f_code
+      self._push((code.co_filename, code.co_firstlineno, code.co_name), t, frame, False)
+    elif event == "c_call":
+      self._push(("~", 0, _builtin_label(arg)), t, frame, True)
+    else:
+      stack = self._stack
+      # Calls started before profiling are not tracked
+      if not stack or stack[-1][3] is not frame or stack[-1][4] != (event != "return"):
+        return
+      key, start, inner, _, _ = stack.pop()
+      elapsed = t - start
+      self._depth[key] -= 1
+      recursive = self._depth[key] > 0
+      entry = self._entries.get(key)
+      if entry is None:
+        entry = self._entries[key] = [0, 0, 0.0, 0.0, {}]
+      entry[0] += 0 if recursive else 1
+      entry[1] += 1
+      entry[2] += elapsed - inner
+      if not recursive:
+        entry[3] += elapsed
+      if stack:
+        stack[-1][2] += elapsed
+        caller = stack[-1][0]
+        cc, nc, tt, ct = entry[4].get(caller, (0, 0, 0.0, 0.0))
+        entry[4][caller] = (cc + (0 if recursive else 1), nc + 1, tt + elapsed - inner, ct + (0 if recursive else elapsed))
+
+  def _push(self, key, t, frame, builtin):
+    self._depth[key] += 1
+    self._stack.append([key, t, 0.0, frame, builtin])
+
+class ThreadProfiler:
+  """
+  Profiles a single thread, either deterministically by tracking every call,
+  or by sampling its stack from another thread which barely slows it down.
+
+  Calls are only tracked in the thread that enables it, so when profiling is started
+  from another thread, the profiled thread should call `poll` from time to time.
+  """
+  def __init__(self, name: str, thread_id: int = None):
+    self.name = name
+    self.thread_id = thread_id
+    self.mode = None
+    self._lock = threading.Lock()
+    # Action to be done by the profiled thread itself
+    self._pending = None
+    self._done = threading.Event()
+    self._profile = None
+    self._sampler = None
+    self._stop_sampling = threading.Event()
+    self._samples = None
+    self._started = 0
+
+  def poll(self):
+    if self._pending is None:
+      return
+    self._lock.acquire()
+    action = self._pending
+    self._pending = None
+    self._lock.release()
+    if action:
+      action()
+      self._done.set()
+
+  def _switch(self, action, timeout: float):
+    if threading.get_ident() == self.thread_id:
+      action()
+      return
+    self._done.clear()
+    self._pending = action
+    if self._done.wait(timeout):
+      return
+    self._lock.acquire()
+    taken = self._pending is None
+    self._pending = None
+    self._lock.release()
+    if not taken:
+      raise TimeoutError(f"The {self.name} thread is busy, try again later")
+    # The thread is doing it right now
+    self._done.wait()
+
+  def start(self, mode: str, interval: float = 0.002, timeout: float = 2.0):
+    if self.mode:
+      raise RuntimeError(f"The {self.name} thread is already being profiled")
+    if mode == DETERMINISTIC:
+      profile = cProfile.Profile() if sys.version_info < (3, 12) else _ThreadProfile()
+      self._switch(profile.enable, timeout)
+      self._profile = profile
+    else:
+      self._samples = Counter()
+      self._stop_sampling.clear()
+      self._sampler = threading.Thread(target=self._sample_loop, args=(interval,), daemon=True)
+      self._sampler.start()
+    self.mode = mode
+    self._started = time.perf_counter()
+    log.info(f"profiling:{self.name}:{mode}")
+
+  def stop(self, out_dir: str, top: int = 20, timeout: float = 2.0) -> str:
+    """
+    Writes results to `out_dir` and returns a summary of the top hotspots.
+    Deterministic results are saved as pstats, samples as collapsed stacks for flame graphs.
+    """
+    if not self.mode:
+      return ""
+    if self.mode == DETERMINISTIC:
+      self._switch(self._profile.disable, timeout)
+    else:
+      self._stop_sampling.set()
+      self._sampler.join()
+    duration = time.perf_counter() - self._started
+    mode = self.mode
+    self.mode = None
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.join(out_dir, f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}")
+    if mode == DETERMINISTIC:
+      profile, self._profile = self._profile, None
+      file_name = base + ".pstats"
+      stats = pstats.Stats(profile)
+      stats.dump_stats(file_name)
+      summary = self._stats_summary(stats, top)
+    else:
+      samples, self._samples = self._samples, None
+      file_name = base + ".collapsed.txt"
+      self._write_collapsed(samples, file_name)
+      summary = self._samples_summary(samples, top)
+    log.info(f"profiling:{self.name}:saved {file_name}")
+    return f"{self.name} thread, {mode}, {duration:.1f} s\n{file_name}\n\n{summary}"
+
+  def _sample_loop(self, interval: float):
+    samples = self._samples
+    frames = sys._current_frames
+    while not self._stop_sampling.wait(interval):
+      frame = frames().get(self.thread_id)
+      if frame is None:
+        continue
+      # Codes from the innermost frame outwards
+      stack = []
+      while frame:
+        stack.append(frame.f_code)
+        frame = frame.f_back
+      samples[tuple(stack)] += 1
+
+  def _write_collapsed(self, samples: Counter, file_name: str):
+    labels = {}
+    with open(file_name, "w", encoding="utf-8") as f:
+      for stack, count in samples.most_common():
+        names = []
+        for code in reversed(stack):
+          label = labels.get(code)
+          if label is None:
+            label = labels[code] = _code_label(code).replace(";", ",")
+          names.append(label)
+        f.write(f"{';'.join(names)} {count}\n")
+
+  def _samples_summary(self, samples: Counter, top: int) -> str:
+    total = sum(samples.values())
+    if not total:
+      return "No samples"
+    own = Counter()
+    cumulative = Counter()
+    for stack, count in samples.items():
+      own[stack[0]] += count
+      for code in set(stack):
+        cumulative[code] += count
+    lines = [f"{total} samples", "", f"{'own %':>7} {'total %':>7}  function"]
+    for code, count in own.most_common(top):
+      lines.append(f"{count * 100 / total:7.1f} {cumulative[code] * 100 / total:7.1f}  {_code_label(code)}")
+    return "\n".join(lines)
+
+  def _stats_summary(self, stats: pstats.Stats, top: int) -> str:
+    total = stats.total_tt
+    if not total:
+      return "No calls"
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    lines = [f"{total:.3f} s in {stats.total_calls} calls", "", f"{'own s':>8} {'own %':>6} {'total s':>8} {'calls':>8}  function"]
+    for (file, line, func), (_, calls, own, cumulative, _) in rows:
+      lines.append(f"{own:8.3f} {own * 100 / total:6.1f} {cumulative:8.3f} {calls:8d}  {_label(file, line, func)}")
+    return "\n".join(lines)
@@ -0,0 +1,260 @@
+"""
+Renders a report of each recorded profile: the profile with its fit and the fit summary,
+as the main window plots them. Reports are rendered off-screen by matplotlib in a pool of processes,
+each process draws all its reports on the same figure.
+A summary table of fit results of all profiles is written along with the reports.
+
+Profiles are text files with positions (in µm) and signal values in the first two columns,
+separated by commas, tabs or spaces, or NPZ files with `xs` and `ys` arrays.
+
+  python report.py recorded/ --output reports --format png pdf
+"""
+import argparse
+import csv
+import glob
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from consts import APP_NAME
+from fitting import FIT
+
+log = logging.getLogger(__name__)
+
+PROFILE_EXTS = (".csv", ".tsv", ".txt", ".dat", ".npz")
+
+SUMMARY_COLUMNS = ("file", "report", "points", "fit", "duration_fs", "fwhm_fs", "center_um", "error")
+
+def find_profiles(paths: list) -> list:
+  files = []
+  for path in paths:
+    if os.path.isdir(path):
+      files.extend(sorted(f for f in glob.glob(os.path.join(path, "*")) if f.lower().endswith(PROFILE_EXTS)))
+    else:
+      files.append(path)
+  return files
+
+def report_names(files: list) -> list:
+  """
+  Returns names of reports of profile files without the directory and extension.
+  Files differing only by them get the extension in the name, then a counter,
+  e.g. `p00-csv` and `p00-npz`, so their reports don't overwrite each other.
+  """
+  stems = [os.path.splitext(os.path.basename(f)) for f in files]
+  stem_counts = Counter(stem for stem, _ in stems)
+  names = [stem if stem_counts[stem] == 1 else f"{stem}-{ext.lstrip('.').lower()}" for stem, ext in stems]
+  name_counts = Counter(names)
+  seen = Counter()
+  for i, name in enumerate(names):
+    if name_counts[name] > 1:
+      seen[name] += 1
+      names[i] = f"{name}-{seen[name]}"
+  return names
+
+def load_profile(file_name: str):
+  """
+  Returns positions and values of a recorded profile.
+  """
+  if file_name.lower().endswith(".npz"):
+    with np.load(file_name) as data:
+      return data["xs"], data["ys"]
+  with open(file_name, "r", encoding="utf-8") as f:
+    lines = [line for line in f if line.strip() and not line.lstrip().startswith("#")]
+  delimiter = "," if lines and "," in lines[-1] else None
+  if lines:
+    try:
+      float(lines[0].split(delimiter)[0])
+    except ValueError:
+      # Column titles
+      lines = lines[1:]
+  if not lines:
+    raise ValueError("No points")
+  data = np.loadtxt(lines, delimiter=delimiter, usecols=(0, 1), ndmin=2)
+  return data[:, 0], data[:, 1]
+
+# The renderer of the current worker process
+_renderer = None
+
+def _init_worker(options: dict):
+  global _renderer
+  _renderer = ReportRenderer(options)
+
+def _render(file_name: str, name: str) -> dict:
+  return _renderer.render(file_name, name)
+
+class ReportRenderer:
+  """
+  Fits profiles and draws them on a figure made once and reused for all reports,
+  only data of its artists changes from report to report.
+  Processing and the fit region follow the `[processing]` and `[fitting]` config sections.
+  """
+  def __init__(self, options: dict):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from config import Config
+    from pipeline import Pipeline
+    from plot_image import EXTRA_STYLES
+    from plot_view import HeadlessView
+    from roi import FitRoi
+
+    self.options = options
+    config = Config(options["config"])
+    self.view = HeadlessView()
+    self.view.fit_type = FIT[options["fit"]]
+    self.view.show_delay = not options["position"]
+    self.view.interferometric = options["interferometric"]
+    self.view.pipeline = Pipeline(config)
+    self.view.fit_roi = FitRoi(config)
+
+    # The same look as `plot_image.draw_profile`
+    self.fig = Figure(figsize=(8, 6), dpi=options["dpi"])
+    FigureCanvasAgg(self.fig)
+    self.axes = axes = self.fig.add_subplot(111)
+    self.fig.tight_layout(pad=4.0, w_pad=1.0, h_pad=1.0)
+    self.text = axes.text(0.02, 0.98, "", transform=axes.transAxes, verticalalignment='top', horizontalalignment='left')
+    self.data_line, = axes.plot([], [], 'b-', linewidth=1.5, label="Experimental", alpha=0.7)
+    self.extra_lines = {style: axes.plot([], [], fmt, linewidth=1.5)[0] for style, fmt in EXTRA_STYLES.items()}
+    self.fit_line, = axes.plot([], [], 'r-', linewidth=2)
+    self.roi_span = None
+    axes.set_xlabel(self.view.x_label())
+    axes.set_ylabel(self.view.y_label())
+    axes.grid(True, alpha=0.3)
+
+  def render(self, file_name: str, name: str) -> dict:
+    """
+    Writes reports of a profile named `name` and returns its fit results as a row of the summary.
+    """
+    row = {"file": file_name, "report": name}
+    try:
+      xs, ys = load_profile(file_name)
+      row["points"] = len(xs)
+      view = self.view
+      # Each profile has its own fit region
+      view.fit_roi.reset()
+      view.draw_graph(xs, ys)
+      self._draw(name)
+      for fmt in self.options["formats"]:
+        path = os.path.join(self.options["output"], f"{name}.{fmt}")
+        if fmt == "png":
+          self._save_png(path)
+        else:
+          self.fig.savefig(path)
+      values = view.fit_values()
+      if values:
+        row["fit"] = view.fit_params["label"]
+        row["duration_fs"] = f"{values['duration']:.3f}"
+        row["fwhm_fs"] = f"{values['fwhm']:.3f}"
+        row["center_um"] = f"{values['center']:.4f}"
+    except Exception as e:
+      row["error"] = str(e) or type(e).__name__
+    return row
+
+  def _save_png(self, file_name: str):
+    """
+    Saves pixels of the figure drawn once, `savefig` would draw it again for each format.
+    """
+    from PIL import Image
+    canvas = self.fig.canvas
+    canvas.draw()
+    # Fast compression, the plot is mostly blank and compresses well anyway
+    Image.fromarray(np.asarray(canvas.buffer_rgba())[:, :, :3]).save(file_name, compress_level=1)
+
+  def _draw(self, title: str):
+    view = self.view
+    axes = self.axes
+    width = axes.bbox.width
+    xs, ys, x_fit, y_fit = view.display_data(width)
+    if xs is None:
+      raise ValueError("No points")
+    self.text.set_text("\n".join(view.fit_text()))
+    self.data_line.set_data(xs, ys)
+    handles = [self.data_line]
+    for line in self.extra_lines.values():
+      line.set_visible(False)
+    for label, style, ex, ey in view.display_extra(width):
+      line = self.extra_lines[style]
+      line.set_data(ex, ey)
+      line.set_label(label)
+      line.set_visible(True)
+      handles.append(line)
+    self.fit_line.set_visible(bool(view.fit_params))
+    if view.fit_params:
+      self.fit_line.set_data(x_fit, y_fit)
+      self.fit_line.set_label(view.fit_params["label"])
+      handles.append(self.fit_line)
+    if self.roi_span:
+      self.roi_span.remove()
+      self.roi_span = None
+    roi = view.display_roi()
+    if roi:
+      self.roi_span = axes.axvspan(*roi, color='orange', alpha=0.1, label="Fit region")
+      handles.append(self.roi_span)
+    axes.relim(visible_only=True)
+    axes.autoscale_view()
+    axes.set_title(title)
+    # The best location is slow to find, the fit summary is at the top left
+    axes.legend(handles=handles, loc="upper right")
+
+def write_summary(rows: list, file_name: str):
+  with open(file_name, "w", newline="", encoding="utf-8") as f:
+    writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+def main():
+  parser = argparse.ArgumentParser(description=f"{APP_NAME} report generator")
+  parser.add_argument("profiles", nargs="+", help="Profile files or directories with them")
+  parser.add_argument("--output", default="reports", help="Directory for reports (default: reports)")
+  parser.add_argument("--format", nargs="+", choices=("png", "pdf", "svg"), default=["png"], dest="formats",
+    help="Report formats (default: png)")
+  parser.add_argument("--fit", choices=[t.name for t in FIT], default=FIT.auto.name,
+    help="Fit model, auto for the best one (default: auto)")
+  parser.add_argument("--position", action="store_true", help="Show stage positions instead of delays")
+  parser.add_argument("--interferometric", action="store_true", help="Profiles are fringe-resolved traces")
+  parser.add_argument("--config", default="board_config.ini", help="Processing and fitting settings (default: board_config.ini)")
+  parser.add_argument("--dpi", type=int, default=100, help="Resolution of PNG reports (default: 100)")
+  parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Rendering processes (default: CPU count)")
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.INFO)
+
+  files = find_profiles(args.profiles)
+  if not files:
+    log.error("No profiles found")
+    return 1
+  os.makedirs(args.output, exist_ok=True)
+  options = {
+    "output": args.output,
+    "formats": args.formats,
+    "fit": args.fit,
+    "position": args.position,
+    "interferometric": args.interferometric,
+    "config": args.config,
+    "dpi": args.dpi,
+  }
+
+  start = time.perf_counter()
+  rows = {}
+  workers = max(1, min(args.workers, len(files)))
+  with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options,)) as pool:
+    futures = {pool.submit(_render, f, name): f for f, name in zip(files, report_names(files))}
+    for future in as_completed(futures):
+      row = future.result()
+      rows[futures[future]] = row
+      if "error" in row:
+        log.error(f"{row['file']}: {row['error']}")
+  rows = [rows[f] for f in files]
+  write_summary(rows, os.path.join(args.output, "summary.csv"))
+
+  failed = sum(1 for row in rows if "error" in row)
+  log.info(f"{len(files) - failed} reports in {time.perf_counter() - start:.1f} s by {workers} processes, "
+    f"{failed} failed, see {os.path.join(args.output, 'summary.csv')}")
+  return 1 if failed else 0
+
+if __name__ == "__main__":
+  sys.exit(main())
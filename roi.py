@@ -0,0 +1,49 @@
+import logging
+
+from fitting import estimate_peak
+
+log = logging.getLogger(__name__)
+
+class FitRoi:
+  """
+  Region of a profile to be fitted, in stage positions.
+  It follows the peak but doesn't change while the peak stays well inside,
+  so fits of consecutive sweeps are made over the same points.
+  A region set by the user is used as is until it's reset.
+  """
+  def __init__(self, config):
+    self.config = config
+    self.enabled = config.value("fitting/roi", True)
+    self.manual = None
+    self._region = None
+
+  def set_manual(self, start: float, stop: float):
+    self.manual = (min(start, stop), max(start, stop))
+
+  def reset(self):
+    self.manual = None
+    self._region = None
+
+  def update(self, xs, ys):
+    """
+    Returns the region for a new profile as (start, stop), or None to fit the whole profile.
+    """
+    if self.manual:
+      return self.manual
+    if not self.enabled or len(xs) == 0:
+      return None
+    peak = estimate_peak(xs, ys)
+    if not peak or peak[1] <= 0:
+      self._region = None
+      return None
+    center, fwhm = peak
+    half_width = fwhm * self.config.value("fitting/roi_widths", 4) / 2.0
+    region = self._region
+    if region:
+      old_center = (region[0] + region[1]) / 2.0
+      old_half_width = (region[1] - region[0]) / 2.0
+      # Hysteresis, small changes of the rough estimate are just noise
+      if abs(center - old_center) < old_half_width / 4 and 0.7 < half_width / old_half_width < 1.4:
+        return region
+    self._region = (center - half_width, center + half_width)
+    return self._region
@@ -0,0 +1,148 @@
+import sys
+import numpy as np
+
+from consts import CMD
+
+class ScanProfile:
+  """
+  Points of a sweep and how they were measured.
+  Positions, values of each channel and the signal used for fitting are rows of a single array,
+  `xs`, `ys` and `values` are views of it.
+  """
+  __slots__ = ("data", "count", "channels", "reference", "_ys_row",
+    "seq", "direction", "started", "finished", "cmd", "params")
+
+  def __init__(self, capacity: int = 256):
+    self.data = np.empty((2, capacity))
+    self.channels = ("signal",)
+    self.reference = None
+    self._ys_row = 1
+    self.clear()
+
+  def clear(self):
+    self.count = 0
+    # Number of the sweep since the board was created
+    self.seq = 0
+    # 1 when positions go up, -1 when they go down
+    self.direction = 1
+    # Wall clock time of the first and the last points
+    self.started = 0.0
+    self.finished = 0.0
+    self.cmd: CMD = None
+    # Firmware parameters in effect, shared between profiles until they change
+    self.params: dict = None
+
+  def set_channels(self, channels: tuple, reference: str = None):
+    """
+    Sets names of measured values, the first one is the signal.
+    With the reference channel, the signal is normalized by it into a separate row.
+    """
+    self.channels = channels
+    self.reference = reference
+    self._ys_row = len(channels) + 1 if reference else 1
+    rows = self._ys_row + 1 if reference else len(channels) + 1
+    if rows != self.data.shape[0]:
+      self.data = np.empty((rows, self.data.shape[1]))
+      self.count = 0
+
+  @property
+  def xs(self):
+    return self.data[0, :self.count]
+
+  @property
+  def ys(self):
+    return self.data[self._ys_row, :self.count]
+
+  @property
+  def values(self):
+    """
+    Measured values, a row per channel.
+    """
+    return self.data[1:len(self.channels) + 1, :self.count]
+
+  def channel(self, name: str):
+    return self.data[self.channels.index(name) + 1, :self.count]
+
+  def __len__(self):
+    return self.count
+
+  def reserve(self, capacity: int):
+    if capacity > self.data.shape[1]:
+      data = np.empty((self.data.shape[0], capacity))
+      data[:, :self.count] = self.data[:, :self.count]
+      self.data = data
+
+  def assign(self, xs, *values):
+    """
+    Sets positions and values of each channel.
+    """
+    n = len(xs)
+    if n > self.data.shape[1]:
+      self.data = np.empty((self.data.shape[0], n))
+    self.data[0, :n] = xs
+    for i, ys in enumerate(values):
+      self.data[i + 1, :n] = ys
+    self.count = n
+
+  def assign_points(self, points):
+    """
+    Sets points given as rows of a position and values of each channel.
+    """
+    n = len(points)
+    if n > self.data.shape[1]:
+      self.data = np.empty((self.data.shape[0], n))
+    self.data[:points.shape[1], :n] = points.T
+    self.count = n
+
+  def normalize(self):
+    """
+    Divides the signal by the reference channel scaled to its mean,
+    so the signal keeps its magnitude but not fluctuations of the source power.
+    Points where the reference is not positive are left as measured.
+    """
+    n = self.count
+    ref = self.channel(self.reference)
+    ys = self.data[self._ys_row, :n]
+    valid = ref > 0
+    ys.fill(1.0)
+    if valid.any():
+      np.divide(ref.mean(where=valid), ref, out=ys, where=valid)
+    ys *= self.data[1, :n]
+
+class ProfileBuffers:
+  """
+  Profiles the board fills in turn and publishes by reference.
+  A profile is only reused when nobody holds it or its arrays anymore,
+  otherwise it's left to its holders and a new one is taken instead,
+  so a profile being drawn or fitted is never changed.
+  Three buffers let one be filled, one wait in the event queue and one be shown
+  without allocations, while the GUI keeps up.
+  """
+  def __init__(self, count: int = 3):
+    self._buffers = [ScanProfile() for _ in range(count)]
+    self._next = 0
+    buf = self._buffers[0]
+    # References of a buffer that nobody else holds
+    self._free_refs = self._refs(buf)
+
+  def _refs(self, buf: ScanProfile):
+    return sys.getrefcount(buf), sys.getrefcount(buf.data)
+
+  def take(self) -> ScanProfile:
+    """
+    Returns an empty profile to be filled.
+    """
+    for _ in range(len(self._buffers)):
+      i = self._next
+      self._next = (i + 1) % len(self._buffers)
+      buf = self._buffers[i]
+      refs, data_refs = self._refs(buf)
+      if refs <= self._free_refs[0] and data_refs <= self._free_refs[1]:
+        buf.clear()
+        return buf
+    # All are busy, the oldest one is replaced
+    i = self._next
+    self._next = (i + 1) % len(self._buffers)
+    buf = ScanProfile(self._buffers[i].data.shape[1])
+    self._buffers[i] = buf
+    return buf
@@ -0,0 +1,99 @@
+import logging
+import math
+import time
+
+log = logging.getLogger(__name__)
+
+class ScanWindow:
+  """
+  Narrows sweeps to the neighbourhood of the peak found by the previous fit
+  and widens them back to the full range when the peak is lost.
+  Peaks are reported from the UI thread, ranges are taken in the board thread,
+  the peak is replaced as a whole so both threads always see a consistent one.
+  """
+  def __init__(self, config):
+    self.config = config
+    # Peak center and FWHM in stage positions
+    self._peak = None
+    # Time until the next sweep waits for the fit of the previous one
+    self._fit_deadline = None
+
+  def full_range(self) -> dict:
+    """
+    Returns scan arguments for the configured full range,
+    or an empty dict to let the firmware use its own range.
+    """
+    text = str(self.config.value("operations/scan_full_range", "")).strip()
+    if not text:
+      return {}
+    try:
+      start, stop, step = [float(v) for v in text.split()]
+    except ValueError:
+      log.warning(f"Invalid scan_full_range: {text}")
+      return {}
+    return {"start": start, "stop": stop, "step": step}
+
+  def peak_found(self, center: float, fwhm: float, x_min: float, x_max: float):
+    """
+    Takes the peak fitted on a profile measured between `x_min` and `x_max`.
+    """
+    if not math.isfinite(center) or not math.isfinite(fwhm) or fwhm <= 0:
+      self.peak_lost()
+    elif center < x_min or center > x_max:
+      # The fit has drifted out of the measured range
+      self.peak_lost()
+    elif fwhm * 2 > x_max - x_min:
+      # The peak doesn't fit in the sweep well
+      self.peak_lost()
+    else:
+      self._peak = (center, fwhm)
+
+  def profile_fitted(self, peak, x_min: float, x_max: float):
+    """
+    Takes the fit result of `ProfileView.peak_position`, None if the fit failed.
+    """
+    if peak:
+      self.peak_found(*peak, x_min, x_max)
+    else:
+      self.peak_lost()
+    self._fit_deadline = None
+
+  def peak_lost(self):
+    if self._peak:
+      log.info("scan_window:peak_lost")
+    self._peak = None
+    self._fit_deadline = None
+
+  def sweep_published(self):
+    """
+    Holds the next sweep until this one is fitted, it's called by the board before publishing.
+    """
+    self._fit_deadline = time.perf_counter() + self.config.value("operations/scan_window_fit_wait", 1)
+
+  def fit_pending(self) -> bool:
+    deadline = self._fit_deadline
+    if deadline is None:
+      return False
+    if time.perf_counter() >= deadline:
+      log.warning("scan_window:fit_late")
+      self._fit_deadline = None
+      return False
+    return True
+
+  def next_range(self) -> dict:
+    """
+    Returns scan arguments for the next sweep.
+    """
+    peak = self._peak
+    full = self.full_range()
+    if not peak:
+      return full
+    center, fwhm = peak
+    widths = self.config.value("operations/scan_window_widths", 6)
+    points = self.config.value("operations/scan_window_points_per_width", 20)
+    start = center - fwhm * widths / 2.0
+    stop = center + fwhm * widths / 2.0
+    if full:
+      start = max(start, full["start"])
+      stop = min(stop, full["stop"])
+    return {"start": round(start, 4), "stop": round(stop, 4), "step": round(fwhm / points, 4) or 0.0001}
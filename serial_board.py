@@ -1,18 +1,46 @@
 import time
 import logging
+import numpy as np
 import serial
 import serial.tools.list_ports
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from board import Board
 from consts import CMD
+from latency import LatencyStats
+from scan_profile import ScanProfile
+from tracing import tracer
+from utils import load_state, save_state
 
 log = logging.getLogger(__name__)
 
+# Serial traffic is too frequent for logging, it's traced when enabled
+TRACE = tracer.channel("serial")
+EV_SEND = TRACE.event("send", "send:{0}")
+EV_RECEIVE = TRACE.event("receive", "receive:{0}")
+
 class SerialBoard(Board):
   _uart: serial.Serial = None
-  _profile_x = []
-  _profile_y = []
+  _port: str = None
+  _profile: ScanProfile = None
+  # Fields of scan answers of the current sweep, converted to numbers all at once when the sweep ends
+  _points: list = None
+  _point_fields = 3
   _cmd_log_answer = True
+  _latency: LatencyStats = None
+  _checksum = False
+  _answer_seq: int = None
+  _profile_broken = False
+  # The stage is moving to the first point of a scan
+  _scan_travel = False
+  # Commands sent to the board while another command is still running
+  _pipeline: deque = None
+  _pipeline_depth = 1
+  _answer_ok: str = None
+  _answer_error: str = None
+  # Port where the board was found last time, loaded on first use
+  _saved_port: dict = None
 
   def __init__(self):
     super().__init__(log, "board_config.ini")
@@ -20,21 +48,30 @@ class SerialBoard(Board):
   def port(self):
     port = self.config.value("connection/port")
     if not port:
-      ports = serial.tools.list_ports.comports()
-      for p in ports:
-        port = p.device
-        break
+      # Auto-detected port is only known after the first connection,
+      # until then it's the one where the board was found last time
+      port = self._port or self._last_port().get("device", "")
     return port
 
+  def _last_port(self) -> dict:
+    if self._saved_port is None:
+      try:
+        self._saved_port = load_state("port")
+      except Exception:
+        log.exception("load_port")
+        self._saved_port = {}
+    return self._saved_port
+
   def loop(self):
-    answer_ok = self.config.value("commands/answer_ok")
-    answer_error = self.config.value("commands/answer_error")
+    self._pipeline = deque()
+    self._apply_config()
 
     while True:
       time.sleep(0.001)
+      self.profiler.poll()
 
       self._lock.acquire()
-      next_cmd = self._next_cmd
+      next_cmd = self._peek_command()
       cancel = self._cancel_cmd
       self._lock.release()
 
@@ -46,101 +83,474 @@ class SerialBoard(Board):
           # They will be finished when we receive OK after the STOP command
           if cancel:
             log.info(f"cancel:{self._cmd}")
+            # The firmware drops pipelined commands on STOP as well
+            self._pipeline.clear()
           else:
+            if next_cmd and self._can_pipeline(*next_cmd):
+              self._send_command(*self._take_next_command(), pipelined=True)
+              continue
             elapsed = time.perf_counter() - self._cmd_start
             if elapsed >= self._cmd_timeout:
+              if self._profile_broken and self._cmd == CMD.scan:
+                # The final answer of the scan has been lost
+                self._end_command(None)
+                continue
               raise TimeoutError("Command timeout")
-            ans = self._uart.readline().decode('utf-8').strip()
+            ans = self._uart.readline().decode('utf-8', errors='replace').strip()
+            if ans and self._checksum:
+              ans = self._verify_answer(ans)
             if ans:
-              if ans.startswith(answer_ok):
-                if self._cmd_log_answer:
-                  log.debug(f"receive:{ans}")
+              if ans.startswith(self._answer_ok):
+                if TRACE.enabled and self._cmd_log_answer:
+                  TRACE(EV_RECEIVE, ans)
                 if self._command_done(ans):
+                  self._record_latency()
                   self._end_command(None)
-              elif ans.startswith(answer_error):
-                log.debug(f"receive:{ans}")
+              elif ans.startswith(self._answer_error):
+                if TRACE.enabled:
+                  TRACE(EV_RECEIVE, ans)
+                if self._pipeline:
+                  # Commands sent ahead most probably depend on the failed one,
+                  # the firmware would still run them, but it drops them on STOP
+                  self._pipeline.clear()
+                  self._drain_command()
                 self._end_command(self.config.error_text(ans))
               else: # Some debug output from the board
-                if self._cmd_log_answer:
-                  log.debug(f"receive:{ans}")
+                if TRACE.enabled and self._cmd_log_answer:
+                  TRACE(EV_RECEIVE, ans)
             continue
 
+        if not next_cmd and not self._pipeline and self.config.reload_if_changed():
+          self._apply_config()
+          continue
+
+        if self._pipeline:
+          # The command has been sent already, it's just its turn to get answers
+          self._begin_command(*self._pipeline.popleft())
+          continue
+
         if next_cmd:
-          self._lock.acquire()
-          self._next_cmd = None
-          self._cancel_cmd = False
-          self._lock.release()
-
-          self._cmd = next_cmd
-          log.info(f"begin:{self._cmd}")
-          if self._cmd == CMD.connect:
-            self.on_command_beg.emit(self._cmd)
+          cmd, args = self._take_next_command()
+          if cmd == CMD.connect:
+            self._begin_command(cmd, args)
             self._connect()
             self._end_command(None)
-          elif self._cmd == CMD.disconnect:
-            self.on_command_beg.emit(self._cmd)
+          elif cmd == CMD.disconnect:
+            self._begin_command(cmd, args)
             self._disconnect()
             self._end_command(None)
           else:
-            cmd = self.config.cmd_spec(self._cmd.value)
-            if not cmd.serial_name:
-              raise Exception(f"Command serial name is empty")
-            cmd_args = self._prepare_command()
-            serial_cmd = f"{cmd.serial_name} {cmd_args}".strip()
-            self.on_command_beg.emit(self._cmd)
-            self._cmd_start = time.perf_counter()
-            self._cmd_timeout = cmd.timeout
-            self._cmd_log_answer = cmd.log_answer
-            log.debug(f"send:{serial_cmd}")
-            self._uart.write(serial_cmd.encode())
-            self._uart.flush()
+            self._send_command(cmd, args)
 
       except Exception as e:
         log.exception(f"error:{self._cmd}")
+        # Answers of pipelined commands can't be trusted after a failure
+        self._pipeline.clear()
         self._end_command(str(e))
 
+  def _apply_config(self):
+    """
+    Takes settings used by the loop from the current config snapshot.
+    """
+    self._answer_ok = self.config.value("commands/answer_ok")
+    self._answer_error = self.config.value("commands/answer_error")
+    self._checksum = self.config.value("commands/checksum", False)
+    self._pipeline_depth = self.config.value("commands/pipeline_depth", 1)
+    self.auto_window = self.config.value("operations/scan_auto_window", False)
+    tracer.configure(self.config)
+
+    if self.config.value("commands/adaptive_timeout", False):
+      if not self._latency:
+        self._latency = LatencyStats()
+      self._latency.percentile = self.config.value("commands/adaptive_timeout_percentile", LatencyStats.percentile)
+      self._latency.margin = self.config.value("commands/adaptive_timeout_margin", LatencyStats.margin)
+      self._latency.min_samples = self.config.value("commands/adaptive_timeout_samples", LatencyStats.min_samples)
+      self._latency.min_timeout = self.config.value("commands/adaptive_timeout_min", LatencyStats.min_timeout)
+    elif self._latency:
+      self._latency.save()
+      self._latency = None
+
+  def _has_pending(self) -> bool:
+    return super()._has_pending() or len(self._pipeline) > 0
+
+  def _can_pipeline(self, cmd: CMD, args: dict) -> bool:
+    """
+    Checks if a command can be sent while the current one is still running.
+    """
+    if len(self._pipeline) + 1 >= self._pipeline_depth:
+      return False
+    if not self._is_pipelined(self._cmd, self._cmd_args):
+      return False
+    return self._is_pipelined(cmd, args)
+
+  def _is_running(self) -> bool:
+    # Pipelined commands are sent already, even if it's not their turn to get answers
+    return self._cmd is not None or bool(self._pipeline)
+
+  def _is_pipelined(self, cmd: CMD, args: dict) -> bool:
+    if cmd in (CMD.connect, CMD.disconnect, CMD.stop, CMD.scan, CMD.scans):
+      return False
+    if cmd == CMD.param and not args.get("store"):
+      # Reading of parameters returns several answers
+      return False
+    return self.config.cmd_spec(cmd).pipelined
+
+  def _begin_command(self, cmd: CMD, args: dict, spec = None):
+    self._cmd = cmd
+    self._cmd_args = args
+    log.info(f"begin:{cmd}")
+    self.on_command_beg.emit(cmd)
+    if not spec:
+      return
+    self._cmd_start = time.perf_counter()
+    self._cmd_timeout = spec.timeout
+    # The first point of a scan comes after the stage has travelled to the start,
+    # it's not comparable with intervals between points and keeps the configured timeout
+    self._scan_travel = cmd == CMD.scan or cmd == CMD.scans
+    if self._latency and not self._scan_travel:
+      self._cmd_timeout = self._latency.timeout(spec.name, spec.timeout)
+    self._cmd_log_answer = spec.log_answer
+
+  def _send_command(self, cmd: CMD, args: dict, pipelined = False):
+    spec = self.config.cmd_spec(cmd)
+    if not spec.serial_name:
+      raise Exception(f"Command serial name is empty")
+    serial_cmd = f"{spec.serial_name} {self._prepare_command(cmd, args)}".strip()
+    if pipelined:
+      self._pipeline.append((cmd, args, spec))
+    else:
+      self._begin_command(cmd, args, spec)
+    self._write_command(serial_cmd)
+
+  def _write_command(self, serial_cmd: str):
+    if TRACE.enabled:
+      TRACE(EV_SEND, serial_cmd)
+    self._uart.write((serial_cmd + "\n").encode())
+    self._uart.flush()
+
   def _connect(self):
     if self._uart:
       self._disconnect()
-    port = self.port()
-    baudrate = self.config.value("connection/baudrate")
-    timeout = self.config.value("connection/timeout")
-    self._uart = serial.Serial(port, baudrate=baudrate, timeout=timeout)
-    # Arduino boards reset when a serial connection is opened
-    # Delay after connection allows it to complete its bootloader and initialization sequence
-    time.sleep(self.config.value("connection/reset_time", 2))
+    port = self.config.value("connection/port")
+    if port:
+      self._uart = self._open_port(port)
+    else:
+      self._uart = self._discover_port()
+    self._port = self._uart.port
     self._uart.reset_input_buffer()
     self._uart.reset_output_buffer()
-    log.info(f"Connected to {port} at {baudrate}")
+    self._answer_seq = None
+    log.info(f"Connected to {self._port} at {self._uart.baudrate}")
+
+  def _open_port(self, port: str, probe = False) -> serial.Serial:
+    """
+    Opens the port and waits until the board gets ready.
+    When probing, returns None if the board didn't report readiness.
+    """
+    baudrate = self.config.value("connection/baudrate")
+    timeout = self.config.value("connection/timeout")
+    uart = serial.Serial(baudrate=baudrate, timeout=timeout)
+    uart.port = port
+    reset = self.config.value("connection/reset_on_connect", True)
+    if not reset:
+      # Arduino boards reset when DTR goes active on opening the port
+      uart.dtr = False
+      uart.rts = False
+    uart.open()
+    if reset or probe:
+      if not self._wait_ready(uart):
+        if probe:
+          uart.close()
+          return None
+        log.warning(f"Board did not report readiness on {port}")
+    return uart
+
+  def _discover_port(self) -> serial.Serial:
+    """
+    Finds a port where the board is connected.
+    Returns the port already opened and ready for commands.
+    """
+    ports = serial.tools.list_ports.comports()
+    if not ports:
+      raise Exception("No serial ports found")
+
+    # Try the same device where the board was found last time
+    last = self._last_port()
+    for p in ports:
+      if p.vid is not None and p.vid == last.get("vid") and p.pid == last.get("pid") \
+        and p.serial_number == last.get("serial_number"):
+        log.info(f"port_last:{p.device}")
+        return self._open_port(p.device)
+
+    can_probe = self.config.value("connection/ready_answer", "") \
+      or self.config.value("connection/ready_probe", "")
+    if len(ports) == 1 or not can_probe:
+      # Nothing to choose from or no way to check, take the first one
+      return self._open_port(ports[0].device)
+
+    def probe(port):
+      try:
+        uart = self._open_port(port.device, probe=True)
+        if not uart:
+          log.debug(f"probe:{port.device}:no_answer")
+        return uart
+      except Exception as e:
+        log.debug(f"probe:{port.device}:{e}")
+        return None
+
+    # Opening a port resets the board, so all ports are probed concurrently
+    # to not wait for the reset of every candidate one by one
+    log.info(f"probe:{[p.device for p in ports]}")
+    pool = ThreadPoolExecutor(max_workers=len(ports), thread_name_prefix="probe")
+    futures = {pool.submit(probe, p): p for p in ports}
+    found = None
+    for future in as_completed(futures):
+      found = future.result()
+      if not found:
+        continue
+      port = futures[future]
+      log.info(f"port_found:{port.device}")
+      # Ports of other probes are closed when they complete,
+      # the callback runs at once for those that have completed already
+      for f in futures:
+        if f is not future:
+          f.add_done_callback(lambda f: f.result() and f.result().close())
+      self._saved_port = {
+        "device": port.device,
+        "vid": port.vid,
+        "pid": port.pid,
+        "serial_number": port.serial_number,
+      }
+      try:
+        save_state("port", self._saved_port)
+      except Exception:
+        log.exception("save_port")
+      break
+    pool.shutdown(wait=False)
+    if not found:
+      raise Exception(f"Board not found on any of ports: {', '.join(p.device for p in ports)}")
+    return found
+
+  def _wait_ready(self, uart: serial.Serial) -> bool:
+    """
+    Waits until the board completes its bootloader and initialization sequence.
+    Returns False if the board didn't answer within the reset time.
+    """
+    reset_time = self.config.value("connection/reset_time", 2)
+    ready_answer = self.config.value("connection/ready_answer", "")
+    probe = self.config.value("connection/ready_probe", "")
+    if not ready_answer and not probe:
+      # There is no way to know when the board is ready, so just wait
+      time.sleep(reset_time)
+      return True
+
+    answers = [ready_answer] if ready_answer else []
+    if probe:
+      answers.append(self.config.value("commands/answer_ok"))
+      answers.append(self.config.value("commands/answer_error"))
+    probe_interval = self.config.value("connection/ready_probe_interval", 0.5)
+    probe_time = 0
+    probes_sent = 0
+
+    timeout = uart.timeout
+    uart.timeout = 0.01
+    try:
+      start = time.perf_counter()
+      while time.perf_counter() - start < reset_time:
+        if probe and time.perf_counter() - probe_time >= probe_interval:
+          uart.write((probe + "\n").encode())
+          uart.flush()
+          probe_time = time.perf_counter()
+          probes_sent += 1
+        ans = uart.readline().decode('utf-8', errors='replace').strip()
+        if not ans or not any(ans.startswith(a) for a in answers):
+          continue
+        log.info(f"ready:{ans}({time.perf_counter() - start:.3f}s)")
+        if probes_sent > 1:
+          # Skip late answers to repeated probes
+          uart.timeout = probe_interval
+          while uart.readline():
+            pass
+        return True
+      return False
+    finally:
+      uart.timeout = timeout
 
   def _disconnect(self):
     if self._uart and self._uart.is_open:
       self._uart.close()
     self._uart = None
+    if self._latency:
+      self._latency.save()
     log.info(f"Disconnected {self.port()}")
 
-  def _prepare_command(self):
-    # Do some stuff before command start and return command arguments
-    if self._cmd == CMD.move:
-      return self._cmd_args.get("pos", 0)
+  def _record_latency(self):
+    # Time from the command start (or from the previous scan point) to the answer
+    if self._latency:
+      self._latency.record(self._cmd.value, time.perf_counter() - self._cmd_start)
+
+  def _parse_checksum(self, ans: str):
+    """
+    Splits an answer like `OK 10.5 200 ~17:3A` into the answer itself and its sequence number.
+    Returns (None, None) if the answer is corrupted.
+    """
+    idx = ans.rfind(" ~")
+    if idx < 0:
+      return (None, None)
+    try:
+      seq, checksum = ans[idx+2:].split(":")
+      seq = int(seq)
+      checksum = int(checksum, 16)
+    except ValueError:
+      return (None, None)
+    ans = ans[:idx]
+    actual = 0
+    for b in ans.encode():
+      actual ^= b
+    if actual != checksum:
+      return (None, None)
+    return (ans, seq)
 
-    if self._cmd == CMD.jog:
-      return self._cmd_args.get("offset", 0)
+  def _verify_answer(self, ans: str) -> str:
+    """
+    Checks integrity of an answer line and strips the sequence number and checksum from it.
+    Returns None when the line should be skipped.
+    """
+    if " ~" not in ans and not ans.startswith(self._answer_ok) and not ans.startswith(self._answer_error):
+      # Debug output from the board is not numbered
+      return ans
+    ans, seq = self._parse_checksum(ans)
+    if ans is None:
+      # The next good answer will set the new starting point of the sequence
+      self._answer_seq = None
+      self._answer_broken("corrupted")
+      return None
+    if ans.startswith(f"{self._answer_ok} SYNC"):
+      # Late answer of resynchronization, the stream is aligned already
+      self._answer_seq = (seq + 1) % 256
+      return None
+    expected = self._answer_seq
+    self._answer_seq = (seq + 1) % 256
+    if expected is not None and seq != expected:
+      log.warning(f"answer_lost:{self._cmd}:{(seq - expected) % 256}")
+      if self._cmd == CMD.scan or self._cmd == CMD.scans:
+        # Points or the end of sweep are lost, so the current profile can't be trusted.
+        # But scanning itself is fine, continue with the next sweep.
+        self._profile_broken = True
+    # The answer itself is intact, so it's taken even after a gap
+    return ans
 
+  def _answer_broken(self, reason: str):
+    log.warning(f"answer_broken:{self._cmd}:{reason}")
     if self._cmd == CMD.scan or self._cmd == CMD.scans:
-      self._profile_x = []
-      self._profile_y = []
+      # Points or the end of sweep can be lost, so the current profile can't be trusted.
+      # But scanning itself is fine, continue with the next sweep.
+      self._profile_broken = True
+      return
+    # A corrupted answer of other commands can't be recovered,
+    # but after resync the board can be used without reconnection
+    self._resync()
+    self._drain_command()
+    raise Exception("Board answer has been lost or corrupted")
 
-    if self._cmd == CMD.param:
-      if self._cmd_args.get("store"):
-        params = self._cmd_args["params"]
-        name = [*params][0]
-        value = params[name]
-        return f"{name} {value}"
+  def _drain_command(self):
+    """
+    Stops the command the board may still be running, e.g. when its answer has been corrupted,
+    and drops its answers, so a late one isn't taken as an answer to the next command.
+    The board answers OK when the command is stopped, or refuses to stop when it has finished.
+    """
+    stop = self.config.cmd_spec(CMD.stop)
+    self._uart.write((stop.serial_name + "\n").encode())
+    self._uart.flush()
+    start = time.perf_counter()
+    stopped = False
+    while time.perf_counter() - start < stop.timeout:
+      line = self._uart.readline().decode('utf-8', errors='replace').strip()
+      if not line:
+        if stopped:
+          # Nothing else is coming
+          break
+        continue
+      ans, seq = self._parse_checksum(line)
+      if ans is None:
+        continue
+      self._answer_seq = (seq + 1) % 256
+      if ans.startswith(self._answer_error):
+        log.info(f"drain_done:{self._cmd}:finished")
+        return
+      if ans.startswith(self._answer_ok):
+        res = ans.split(" ")
+        if len(res) == 2: # e.g. `OK 0.5` of a stopped or finished move
+          try:
+            self.position = float(res[-1])
+          except ValueError:
+            pass
+        # The final answer of the command can be followed by refusal to stop
+        stopped = True
+    log.info(f"drain_done:{self._cmd}:{'stopped' if stopped else 'timeout'}")
+
+  def _resync(self):
+    """
+    Drops everything in the communication channel
+    and waits until the board confirms it has done the same.
+    """
+    sync = self.config.cmd_spec(CMD.sync)
+    log.info("resync")
+    self._uart.reset_input_buffer()
+    self._uart.write((sync.serial_name + "\n").encode())
+    self._uart.flush()
+    start = time.perf_counter()
+    while time.perf_counter() - start < sync.timeout:
+      ans, seq = self._parse_checksum(self._uart.readline().decode('utf-8', errors='replace').strip())
+      if ans and ans.startswith(f"{self._answer_ok} SYNC"):
+        self._answer_seq = (seq + 1) % 256
+        log.info(f"resync_done:{time.perf_counter() - start:.3f}s")
+        return
+    raise TimeoutError("Failed to resynchronize communication, reconnect the board")
+
+  def _prepare_command(self, cmd: CMD, args: dict):
+    # Do some stuff before command start and return command arguments
+    if cmd == CMD.move:
+      return args.get("pos", 0)
+
+    if cmd == CMD.jog:
+      return args.get("offset", 0)
+
+    if cmd == CMD.scan or cmd == CMD.scans:
+      self._start_profile(cmd, self._scan_points(args))
+      if "start" in args:
+        return f"{args['start']} {args['stop']} {args['step']}"
+
+    if cmd == CMD.param:
+      if args.get("store"):
+        # e.g. `p1 32` or `p1 32 p2 50 p3 0.5` when stored in batch
+        return " ".join(f"{name} {value}" for name, value in args["params"].items())
+      version_query = self.config.value("commands/PARAM/version_query", "")
+      if version_query:
+        # Ask for the version first, maybe cached values are still actual
+        args["version"] = True
+        return version_query
 
     return ""
 
+  def _start_profile(self, cmd: CMD, capacity: int):
+    self._profile = self._new_profile(cmd, capacity)
+    self._profile_broken = False
+    self._points = []
+    # The answer prefix, position and channel values
+    self._point_fields = len(self._profile.channels) + 2
+
   def _command_done(self, ans: str):
+    if self._cmd == CMD.stop:
+      res = ans.split(" ")
+      cancelled = self._cmd_args.get("cancelled")
+      if (cancelled == CMD.scan or cancelled == CMD.scans) and len(res) == self._point_fields:
+        # Points of the cancelled scan can still arrive before the final answer
+        return False
+      if len(res) == 2: # e.g. `OK 0.5` when a move is stopped
+        self.position = float(res[-1])
+      return True
+
     if self._cmd == CMD.home or self._cmd == CMD.move or self._cmd == CMD.jog:
       res = ans.split(" ")
       if len(res) > 2:
@@ -152,16 +562,29 @@ class SerialBoard(Board):
     if self._cmd == CMD.scan or self._cmd == CMD.scans:
       res = ans.split(" ")
       if len(res) == 1:
-        self.on_data_received.emit(self._profile_x, self._profile_y)
-        self._profile_x = []
-        self._profile_y = []
+        points = self._points
+        if self._profile_broken:
+          log.warning(f"profile_dropped:{len(points) // self._point_fields}")
+        else:
+          # Drop answer prefixes, the rest are positions and channel values
+          del points[::self._point_fields]
+          self._profile.assign_points(np.array(points, dtype=float).reshape(-1, self._point_fields - 1))
+          self._publish_profile(self._profile)
+        # Sweeps of continuous scanning are usually of the same length
+        self._start_profile(self._cmd, len(self._profile))
         # Finish only if the single scan, continue otherwise
         return self._cmd == CMD.scan
-      if len(res) == 3: # e.g. `OK 0.70 911.82`
-        self.position = float(res[-2])
-        self._profile_x.append(self.position)
-        self._profile_y.append(float(res[-1]))
+      if len(res) == self._point_fields: # e.g. `OK 0.70 911.82`, or `OK 0.70 911.82 503.1` with two channels
+        self.position = float(res[1])
+        self._points.extend(res)
         self.on_stage_moved.emit()
+        # Timeout of scan commands is applied to each point separately
+        if self._scan_travel:
+          self._scan_travel = False
+          if self._latency:
+            self._cmd_timeout = self._latency.timeout(self._cmd.value, self.config.cmd_spec(self._cmd).timeout)
+        else:
+          self._record_latency()
         self._cmd_start = time.perf_counter()
         return False # Continue scanning
       raise Exception("Unexpected command result")
@@ -169,25 +592,52 @@ class SerialBoard(Board):
     if self._cmd == CMD.param:
       if self._cmd_args.get("store"):
         # Store params
-        params = self._cmd_args["params"]
-        name = [*params][0]
-        value = params[name]
-        log.info(f"param_stored:{name}={value}")
-        del params[name]
-        self.on_param_stored.emit(len(params) > 0)
+        for name, value in self._cmd_args["params"].items():
+          log.info(f"param_stored:{name}={value}")
+        self._params_stored(self._cmd_args["params"])
         return True
-      else:
-        # Receive params
-        res = ans.split(" ")
-        if len(res) == 1:
-          self.on_params_received.emit()
-          return True
-        if len(res) == 3:
-          self.params[res[1]] = res[2]
-          return False
-        raise Exception("Unexpected command result")
+      # Values can contain spaces
+      res = ans.split(" ", 2)
+      if self._cmd_args.get("version"):
+        return self._params_version_received(res)
+      # Receive params
+      if len(res) == 1:
+        self._cache_params(self._cmd_args.get("board_id"), self._cmd_args.get("board_version"))
+        self.on_params_received.emit()
+        return True
+      if len(res) == 3:
+        self.params[res[1]] = res[2]
+        return False
+      raise Exception("Unexpected command result")
     return True
 
+  def _params_version_received(self, res: list) -> bool:
+    """
+    Reads only parameters changed since the cached version, if any.
+    """
+    if len(res) != 3: # e.g. `OK EMU1 42`
+      raise Exception("Unexpected command result")
+    board_id, version = res[1], res[2]
+    self._cmd_args = {"board_id": board_id, "board_version": version}
+    params, cached_version = self.cached_params(board_id)
+    if params is not None and cached_version == version:
+      log.info(f"params_actual:{board_id}:{version}")
+      self.params = params
+      self._cache_params(board_id, version)
+      self.on_params_received.emit()
+      return True
+    query = ""
+    delta_query = self.config.value("commands/PARAM/delta_query", "")
+    if params is not None and cached_version and delta_query:
+      log.info(f"params_changed:{board_id}:{cached_version}->{version}")
+      # Changed values are applied over cached ones
+      self.params = params
+      query = f"{delta_query} {cached_version}"
+    spec = self.config.cmd_spec(CMD.param)
+    self._write_command(f"{spec.serial_name} {query}".strip())
+    self._cmd_start = time.perf_counter()
+    return False
+
   def debug_simulate_disconnection(self):
     if not self.connected:
       return
@@ -196,5 +646,6 @@ class SerialBoard(Board):
   def debug_simulate_command_error(self):
     if not self.connected:
       return
-    self._next_cmd = CMD.error
-    self._cancel_cmd = True
+    self._lock.acquire()
+    self._enqueue(CMD.error, cancel=True)
+    self._lock.release()
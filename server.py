@@ -0,0 +1,513 @@
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+from collections import deque
+
+import numpy as np
+
+from consts import CMD
+from fitting import FIT
+from pipeline import Pipeline
+from plot_view import HeadlessView, ProfileView
+from roi import FitRoi
+from scan_profile import ScanProfile
+
+log = logging.getLogger(__name__)
+
+server = None
+
+# Every frame starts with its kind and payload length
+FRAME_HEADER = struct.Struct("<BI")
+FRAME_JSON = 1
+FRAME_PROFILE = 2
+# Profile payload starts with its sequence number and point count,
+# followed by positions and then values as little-endian float64
+PROFILE_HEADER = struct.Struct("<II")
+
+def encode_json(msg: dict) -> bytes:
+  payload = json.dumps(msg, separators=(',', ':')).encode()
+  return FRAME_HEADER.pack(FRAME_JSON, len(payload)) + payload
+
+def encode_profile(seq: int, xs, ys) -> bytes:
+  xs = np.asarray(xs, dtype='<f8')
+  ys = np.asarray(ys, dtype='<f8')
+  n = len(xs)
+  return b"".join((
+    FRAME_HEADER.pack(FRAME_PROFILE, PROFILE_HEADER.size + n * 16),
+    PROFILE_HEADER.pack(seq, n), xs.tobytes(), ys.tobytes()))
+
+def decode_profile(payload: bytes):
+  """
+  Returns sequence number, positions and values of a profile frame.
+  """
+  seq, n = PROFILE_HEADER.unpack_from(payload)
+  data = np.frombuffer(payload, dtype='<f8', offset=PROFILE_HEADER.size)
+  return seq, data[:n], data[n:2 * n]
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+  buf = bytearray()
+  while len(buf) < size:
+    chunk = sock.recv(size - len(buf))
+    if not chunk:
+      return None
+    buf += chunk
+  return bytes(buf)
+
+def read_frame(sock: socket.socket):
+  """
+  Returns kind and payload of the next frame, or (None, None) when the connection is closed.
+  """
+  header = _recv_exact(sock, FRAME_HEADER.size)
+  if not header:
+    return None, None
+  kind, size = FRAME_HEADER.unpack(header)
+  payload = _recv_exact(sock, size) if size else b""
+  if payload is None:
+    return None, None
+  return kind, payload
+
+def parse_address(address: str):
+  """
+  Returns socket family and address for `unix:/path/to/socket` or `host:port` strings.
+  """
+  if address.startswith("unix:"):
+    return socket.AF_UNIX, address[5:]
+  host, _, port = address.rpartition(":")
+  return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+class RpcError(Exception):
+  pass
+
+class ClientConnection:
+  """
+  Frames for a client are queued and sent by its own thread,
+  so a slow client never delays acquisition or other clients.
+  When the client doesn't keep up, the oldest profiles waiting for it are dropped.
+  """
+  def __init__(self, server: 'AcquisitionServer', sock: socket.socket, name: str):
+    self.server = server
+    self.sock = sock
+    self.name = name
+    self.topics = {"profile", "fit", "status"}
+    self.dropped = 0
+    self._frames = deque()
+    self._size = 0
+    self._closed = False
+    self._cond = threading.Condition()
+
+  def start(self):
+    threading.Thread(target=self._write_loop, daemon=True).start()
+    threading.Thread(target=self._read_loop, daemon=True).start()
+
+  def post(self, kind: int, frame: bytes):
+    self._cond.acquire()
+    try:
+      if self._closed:
+        return
+      self._frames.append((kind, frame))
+      self._size += len(frame)
+      if self._size > self.server.client_buffer:
+        self._drop_profiles()
+      self._cond.notify()
+    finally:
+      self._cond.release()
+
+  def _drop_profiles(self):
+    # Should be called under the lock
+    kept = deque()
+    for kind, frame in self._frames:
+      if kind == FRAME_PROFILE and self._size > self.server.client_buffer and len(self._frames) > 1:
+        self._size -= len(frame)
+        self.dropped += 1
+        continue
+      kept.append((kind, frame))
+    self._frames = kept
+    if self._size > self.server.client_buffer:
+      log.warning(f"server:client_overflow {self.name}")
+      self._closed = True
+
+  def _write_loop(self):
+    try:
+      while True:
+        self._cond.acquire()
+        try:
+          while not self._frames and not self._closed:
+            self._cond.wait()
+          if self._closed:
+            return
+          _, frame = self._frames.popleft()
+          self._size -= len(frame)
+        finally:
+          self._cond.release()
+        self.sock.sendall(frame)
+    except OSError as e:
+      log.info(f"server:client_write {self.name}: {e}")
+    finally:
+      self.close()
+
+  def _read_loop(self):
+    try:
+      while True:
+        kind, payload = read_frame(self.sock)
+        if kind is None:
+          break
+        if kind != FRAME_JSON:
+          log.warning(f"server:unexpected_frame {self.name} {kind}")
+          continue
+        try:
+          request = json.loads(payload)
+        except ValueError as e:
+          self.post(FRAME_JSON, encode_json({"id": None, "error": f"Invalid request: {e}"}))
+          continue
+        self.post(FRAME_JSON, encode_json(self.server.handle(self, request)))
+    except OSError as e:
+      log.info(f"server:client_read {self.name}: {e}")
+    finally:
+      self.close()
+
+  def close(self):
+    self._cond.acquire()
+    try:
+      self._closed = True
+      self._cond.notify()
+    finally:
+      self._cond.release()
+    try:
+      self.sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+      pass
+    self.sock.close()
+    self.server._client_closed(self)
+
+class AcquisitionServer:
+  """
+  Lets other processes control the board and receive measured profiles.
+  Requests are JSON objects {"id", "method", "params"} answered with {"id", "result"} or {"id", "error"}.
+  Profiles are streamed in binary frames, fit results and board events in JSON frames.
+  """
+  def __init__(self, board, address: str = None, fit = True):
+    self.board = board
+    self.config = board.config
+    self.address = address or self.config.value("server/address", "127.0.0.1:5678")
+    self.client_buffer = int(self.config.value("server/client_buffer_mb", 8) * 1024 * 1024)
+    self._clients = []
+    self._lock = threading.Lock()
+    self._sock = None
+    self._seq = 0
+    self._client_count = 0
+
+    # Without the GUI, profiles are fitted here, otherwise the GUI reports its fits
+    self._view = None
+    if fit:
+      self._view = HeadlessView()
+      self._view.pipeline = Pipeline(self.config)
+      self._view.fit_roi = FitRoi(self.config)
+      self._view.fit_type = FIT[self.config.value("server/fit_type", "auto")]
+      self._fit_cond = threading.Condition()
+      self._fit_data = None
+
+  def start(self):
+    family, addr = parse_address(self.address)
+    if family == socket.AF_UNIX and os.path.exists(addr):
+      os.remove(addr)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+      if family == socket.AF_INET:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+      sock.bind(addr)
+      sock.listen()
+    except Exception:
+      sock.close()
+      raise
+    self._sock = sock
+    log.info(f"server:listening {self.address}")
+
+    # Only a listening server gets board events and fits from the GUI
+    if self._view:
+      threading.Thread(target=self._fit_loop, daemon=True).start()
+    board = self.board
+    board.on_command_beg.connect(self._command_beg)
+    board.on_command_end.connect(self._command_end)
+    board.on_data_received.connect(self._data_received)
+    board.on_params_received.connect(self._params_received)
+    board.on_stage_moved.connect(self._stage_moved)
+    global server
+    server = self
+
+    threading.Thread(target=self._accept_loop, daemon=True).start()
+
+  def stop(self):
+    if self._sock:
+      self._sock.close()
+      self._sock = None
+    for client in self.clients():
+      client.close()
+    family, addr = parse_address(self.address)
+    if family == socket.AF_UNIX and os.path.exists(addr):
+      os.remove(addr)
+
+  def clients(self) -> list:
+    self._lock.acquire()
+    try:
+      return list(self._clients)
+    finally:
+      self._lock.release()
+
+  def _accept_loop(self):
+    sock = self._sock
+    while True:
+      try:
+        conn, addr = sock.accept()
+      except OSError:
+        return
+      if conn.family != socket.AF_UNIX:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      self._client_count += 1
+      name = f"#{self._client_count} {addr or 'local'}"
+      log.info(f"server:client_connected {name}")
+      client = ClientConnection(self, conn, name)
+      self._lock.acquire()
+      try:
+        self._clients.append(client)
+      finally:
+        self._lock.release()
+      client.start()
+
+  def _client_closed(self, client: ClientConnection):
+    self._lock.acquire()
+    try:
+      if client not in self._clients:
+        return
+      self._clients.remove(client)
+    finally:
+      self._lock.release()
+    log.info(f"server:client_disconnected {client.name}, dropped profiles: {client.dropped}")
+
+  def publish(self, topic: str, kind: int, frame: bytes):
+    for client in self.clients():
+      if topic in client.topics:
+        client.post(kind, frame)
+
+  def publish_event(self, topic: str, event: dict):
+    self.publish(topic, FRAME_JSON, encode_json(event))
+
+  def publish_fit(self, view: ProfileView, seq: int = None):
+    """
+    Sends fit results of a view to subscribers.
+    """
+    event = {"event": "fit", "seq": self._seq if seq is None else seq, "text": view.fit_text()}
+    params = view.fit_params
+    if params:
+      peak = view.peak_position()
+      event.update({
+        "model": params["type"].name,
+        "amplitude": float(params["amplitude"]),
+        "center": float(params["center"]),
+        "width": float(params["width"]),
+        "aic": float(params["aic"]),
+        "peak": [float(v) for v in peak] if peak else None,
+        "delay": view.show_delay,
+      })
+    self.publish_event("fit", event)
+
+  def _command_beg(self, cmd: CMD):
+    self.publish_event("status", {"event": "command_beg", "cmd": cmd.value})
+
+  def _command_end(self, cmd: CMD, err: str):
+    self.publish_event("status", {"event": "command_end", "cmd": cmd.value, "error": err})
+
+  def _params_received(self):
+    self.publish_event("status", {"event": "params", "params": self.board.params})
+
+  def _stage_moved(self):
+    self.publish_event("status", {"event": "position", "position": self.board.position})
+
+  def _data_received(self, profile: ScanProfile):
+    self._seq = profile.seq
+    self.publish("profile", FRAME_PROFILE, encode_profile(profile.seq, profile.xs, profile.ys))
+    if self._view:
+      self._fit_cond.acquire()
+      try:
+        # Only the latest profile is worth fitting.
+        # The board doesn't reuse the profile while it's referenced here
+        self._fit_data = profile
+        self._fit_cond.notify()
+      finally:
+        self._fit_cond.release()
+
+  def _fit_loop(self):
+    while True:
+      self._fit_cond.acquire()
+      try:
+        while self._fit_data is None:
+          self._fit_cond.wait()
+        profile = self._fit_data
+        self._fit_data = None
+      finally:
+        self._fit_cond.release()
+      try:
+        xs = profile.xs
+        self._view.draw_graph(xs, profile.ys)
+        if self.board.auto_window and len(xs) > 0:
+          self.board.scan_window.profile_fitted(self._view.peak_position(), xs.min(), xs.max())
+        self.publish_fit(self._view, profile.seq)
+      except Exception:
+        log.exception("server:fit")
+
+  def status(self) -> dict:
+    b = self.board
+    return {
+      "connected": b.connected,
+      "homed": b.homed,
+      "position": b.position,
+      "can_connect": b.can_connect,
+      "can_home": b.can_home,
+      "can_move": b.can_move,
+      "can_jog": b.can_jog,
+      "can_stop": b.can_stop,
+      "auto_window": b.auto_window,
+    }
+
+  def handle(self, client: ClientConnection, request: dict) -> dict:
+    req_id = request.get("id")
+    method = request.get("method")
+    params = request.get("params") or {}
+    handler = getattr(self, f"_rpc_{method}", None) if isinstance(method, str) else None
+    if not handler:
+      return {"id": req_id, "error": f"Unknown method: {method}"}
+    try:
+      return {"id": req_id, "result": handler(client, **params)}
+    except RpcError as e:
+      return {"id": req_id, "error": str(e)}
+    except TypeError as e:
+      return {"id": req_id, "error": f"Invalid params: {e}"}
+    except Exception as e:
+      log.exception(f"server:{method}")
+      return {"id": req_id, "error": str(e)}
+
+  def _check(self, allowed: bool, cmd: CMD):
+    if not allowed:
+      raise RpcError(f"{cmd.value} is not possible now")
+
+  # Methods below are named after `CMD` values, plus a few service ones
+
+  def _rpc_status(self, client):
+    return self.status()
+
+  def _rpc_subscribe(self, client, topics: list):
+    client.topics = set(topics)
+    return sorted(client.topics)
+
+  def _rpc_connect(self, client):
+    self._check(self.board.can_connect and not self.board.connected, CMD.connect)
+    self.board.toggle_connection()
+    return True
+
+  def _rpc_disconnect(self, client):
+    self._check(self.board.can_connect and self.board.connected, CMD.disconnect)
+    self.board.toggle_connection()
+    return True
+
+  def _rpc_home(self, client):
+    self._check(self.board.can_home, CMD.home)
+    self.board.home()
+    return True
+
+  def _rpc_stop(self, client):
+    self._check(self.board.can_stop, CMD.stop)
+    self.board.stop()
+    return True
+
+  def _rpc_move(self, client, position: float):
+    self._check(self.board.can_move, CMD.move)
+    self.board.move(float(position))
+    return True
+
+  def _rpc_jog(self, client, direction: str, long: bool = False):
+    self._check(self.board.can_jog, CMD.jog)
+    if direction == "forth" and long:
+      self.board.jog_forth_long()
+    elif direction == "forth":
+      self.board.jog_forth()
+    elif direction == "back" and long:
+      self.board.jog_back_long()
+    elif direction == "back":
+      self.board.jog_back()
+    else:
+      raise RpcError(f"Invalid jog direction: {direction}")
+    return True
+
+  def _rpc_scan(self, client, start: float = None, stop: float = None, step: float = None):
+    self._check(self.board.can_move, CMD.scan)
+    self.board.scan(start, stop, step)
+    return True
+
+  def _rpc_scans(self, client, start: float = None, stop: float = None, step: float = None):
+    self._check(self.board.can_move, CMD.scans)
+    self.board.scans(start, stop, step)
+    return True
+
+  def _rpc_param(self, client):
+    self._check(self.board.can_home, CMD.param)
+    self.board.query_params()
+    return True
+
+  def _rpc_auto_window(self, client, enabled: bool):
+    self.board.auto_window = bool(enabled)
+    if not enabled:
+      self.board.scan_window.peak_lost()
+    return self.board.auto_window
+
+class ServerClient:
+  """
+  Minimal client for scripts, e.g.
+
+    client = ServerClient("127.0.0.1:5678")
+    client.call("scans")
+    while True:
+      kind, msg = client.read()
+  """
+  def __init__(self, address: str):
+    family, addr = parse_address(address)
+    self.sock = socket.socket(family, socket.SOCK_STREAM)
+    self.sock.connect(addr)
+    self._next_id = 0
+    # Messages received while waiting for a call result
+    self._pending = deque()
+
+  def close(self):
+    self.sock.close()
+
+  def call(self, method: str, **params):
+    self._next_id += 1
+    req_id = self._next_id
+    self.sock.sendall(encode_json({"id": req_id, "method": method, "params": params}))
+    while True:
+      kind, msg = self._read_frame()
+      if kind is None:
+        raise ConnectionError("Server closed the connection")
+      if kind == FRAME_JSON and msg.get("id") == req_id:
+        if "error" in msg:
+          raise RpcError(msg["error"])
+        return msg.get("result")
+      self._pending.append((kind, msg))
+
+  def read(self):
+    """
+    Returns the next message: (FRAME_JSON, dict) for events,
+    (FRAME_PROFILE, (seq, xs, ys)) for profiles, or (None, None) when disconnected.
+    """
+    if self._pending:
+      return self._pending.popleft()
+    return self._read_frame()
+
+  def _read_frame(self):
+    kind, payload = read_frame(self.sock)
+    if kind == FRAME_JSON:
+      return kind, json.loads(payload)
+    if kind == FRAME_PROFILE:
+      return kind, decode_profile(payload)
+    return kind, payload
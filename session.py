@@ -0,0 +1,157 @@
+import tempfile
+import threading
+import numpy as np
+
+from fitting import FIT
+from scan_profile import ScanProfile
+
+# A row per sweep, positions and values are in the spool file at `offset`
+INDEX_DTYPE = np.dtype([
+  ("seq", "i8"),
+  ("started", "f8"),
+  ("finished", "f8"),
+  ("direction", "i1"),
+  ("points", "i8"),
+  # Positions on a uniform grid are not stored, NaN step when they are
+  ("x_start", "f8"),
+  ("x_step", "f8"),
+  ("offset", "i8"),
+  # Value of FIT, -1 when the sweep is not fitted
+  ("fit", "i1"),
+  ("duration_fs", "f8"),
+  ("fwhm_fs", "f8"),
+  ("center_um", "f8"),
+])
+
+# Per-sweep columns as they are exported
+SWEEP_COLUMNS = tuple(name for name in INDEX_DTYPE.names if name != "offset")
+
+def fit_names(codes) -> list:
+  names = {fit_type.value: fit_type.name for fit_type in FIT}
+  return [names.get(int(code), "") for code in codes]
+
+def uniform_grid(xs):
+  """
+  Returns start and step of positions if they are on a uniform grid, otherwise None.
+  """
+  n = len(xs)
+  if n < 2:
+    return None
+  start = xs[0]
+  step = (xs[-1] - start) / (n - 1)
+  if step == 0:
+    return None
+  # Positions printed by the firmware with a few decimals are as close to the grid as floats allow
+  if np.abs(xs - (start + step * np.arange(n))).max() > abs(step) * 1e-6:
+    return None
+  return float(start), float(step)
+
+class Session:
+  """
+  Sweeps of the current run with their fit results.
+  Positions and values are appended to a temporary spool file as sweeps come,
+  only the index of sweeps is kept in memory, so a session can be longer than memory allows.
+  Sweeps can be added while an export reads the ones added before it started.
+  """
+  def __init__(self, spool_dir: str = None):
+    self._spool_dir = spool_dir or None
+    self._lock = threading.Lock()
+    self._file = None
+    self._index = np.empty(1024, dtype=INDEX_DTYPE)
+    self._count = 0
+    self._size = 0
+
+  def __len__(self):
+    return self._count
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      if self._file:
+        self._file.close()
+      self._file = None
+      self._index = np.empty(1024, dtype=INDEX_DTYPE)
+      self._count = 0
+      self._size = 0
+    finally:
+      self._lock.release()
+
+  def add(self, profile: ScanProfile, fit_type: FIT = None, values: dict = None):
+    """
+    Records a sweep and fit results of it, `values` are as returned by `ProfileView.fit_values`.
+    """
+    xs = profile.xs
+    grid = uniform_grid(xs)
+    data = profile.ys.tobytes() if grid else xs.tobytes() + profile.ys.tobytes()
+    self._lock.acquire()
+    try:
+      if not self._file:
+        self._file = tempfile.TemporaryFile(prefix="session-", dir=self._spool_dir)
+      if self._count == len(self._index):
+        # Readers keep the old index, rows they have taken never change
+        index = np.empty(2 * len(self._index), dtype=INDEX_DTYPE)
+        index[:self._count] = self._index[:self._count]
+        self._index = index
+      self._file.seek(self._size)
+      self._file.write(data)
+      row = self._index[self._count]
+      row["seq"] = profile.seq
+      row["started"] = profile.started
+      row["finished"] = profile.finished
+      row["direction"] = profile.direction
+      row["points"] = len(profile)
+      row["x_start"], row["x_step"] = grid if grid else (np.nan, np.nan)
+      row["offset"] = self._size
+      row["fit"] = fit_type.value if fit_type and values else -1
+      row["duration_fs"] = values["duration"] if values else np.nan
+      row["fwhm_fs"] = values["fwhm"] if values else np.nan
+      row["center_um"] = values["center"] if values else np.nan
+      self._size += len(data)
+      self._count += 1
+    finally:
+      self._lock.release()
+
+  def sweeps(self):
+    """
+    Returns the index of sweeps recorded so far, it's not changed by sweeps added later.
+    """
+    self._lock.acquire()
+    try:
+      return self._index[:self._count]
+    finally:
+      self._lock.release()
+
+  def chunks(self, sweeps, max_points: int = 1 << 20):
+    """
+    Reads sweeps of the index in chunks of about `max_points` points.
+    Yields index rows of a chunk and the list of their positions and values,
+    positions are None for sweeps on a uniform grid.
+    """
+    ends = np.cumsum(sweeps["points"])
+    i = 0
+    while i < len(sweeps):
+      before = ends[i - 1] if i else 0
+      j = max(i + 1, int(np.searchsorted(ends, before + max_points, side="right")))
+      rows = sweeps[i:j]
+      start = int(rows["offset"][0])
+      end = int(rows["offset"][-1]) + self._stored_size(rows[-1])
+      self._lock.acquire()
+      try:
+        self._file.seek(start)
+        data = np.frombuffer(self._file.read(end - start), dtype=float)
+      finally:
+        self._lock.release()
+      arrays = []
+      for row in rows:
+        n = int(row["points"])
+        pos = (int(row["offset"]) - start) // 8
+        if np.isnan(row["x_step"]):
+          arrays.append((data[pos:pos + n], data[pos + n:pos + 2 * n]))
+        else:
+          arrays.append((None, data[pos:pos + n]))
+      yield rows, arrays
+      i = j
+
+  def _stored_size(self, row) -> int:
+    n = int(row["points"]) * 8
+    return n if not np.isnan(row["x_step"]) else 2 * n
@@ -0,0 +1,338 @@
+"""
+Soak test of continuous scanning, it runs the main window with the virtual board
+sweeping much faster than a real one, for hours if needed.
+Memory, object counts, event backlog and sweep latencies are sampled periodically
+and written as a time series, the report flags what keeps growing.
+
+  python soak.py --hours 4 --sweep-interval 0.02
+"""
+import argparse
+import csv
+import gc
+import logging
+import math
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+from PySide6.QtCore import QObject, Qt, QTimer
+from PySide6.QtWidgets import QApplication
+
+from consts import APP_NAME, CMD
+
+log = logging.getLogger(__name__)
+
+COLUMNS = (
+  "time_s", "sweeps", "sweeps_per_s", "throttled_pct", "rss_mb", "traced_mb", "gc_objects", "qobjects", "artists",
+  "backlog", "loop_lag_ms", "latency_median_ms", "latency_p95_ms", "latency_max_ms", "draw_median_ms",
+)
+
+# Series checked for growth after the warm-up, and their titles
+GROWTH_CHECKS = (
+  ("rss_mb", "Resident memory"),
+  ("traced_mb", "Python allocations"),
+  ("gc_objects", "Python objects"),
+  ("qobjects", "Qt objects"),
+  ("artists", "Plot artists"),
+)
+
+# Series checked for creeping up, compared between the first and the last quarters after the warm-up
+CREEP_CHECKS = (
+  ("latency_median_ms", "Sweep-to-screen latency"),
+  ("draw_median_ms", "Draw time"),
+  ("loop_lag_ms", "Event loop lag"),
+)
+
+# Series checked for dropping, the same way
+DROP_CHECKS = (
+  ("sweeps_per_s", "Sweep rate"),
+)
+
+def rss_mb() -> float:
+  """
+  Returns resident memory of the process, only available on Linux.
+  """
+  try:
+    with open("/proc/self/statm", "r") as f:
+      return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+  except (OSError, ValueError, AttributeError):
+    return math.nan
+
+class SweepProbe:
+  """
+  Measures the path of each profile from its emission by the board
+  to the end of drawing it by the main window.
+  Slots around the window's one should be connected before and after creating the window.
+  The board waits while too many profiles are not drawn yet, so sweeps never go faster
+  than the window can draw them, and the event loop is not flooded.
+  """
+  def __init__(self, board, max_backlog: int):
+    self.emitted = 0
+    self.handled = 0
+    self.latencies = []
+    self.draw_times = []
+    # Time the board has been waiting for the window
+    self.throttled = 0.0
+    self._slots = threading.Semaphore(max_backlog)
+    self._emit_times = deque()
+    self._draw_start = 0
+    board.on_data_received.connect(self._stamp, Qt.DirectConnection)
+    board.on_data_received.connect(self._before)
+
+  def connect_after(self, board):
+    board.on_data_received.connect(self._after)
+
+  def _stamp(self, profile):
+    # Called in the board thread
+    t = time.perf_counter()
+    self._slots.acquire()
+    now = time.perf_counter()
+    self.throttled += now - t
+    self._emit_times.append(now)
+    self.emitted += 1
+
+  def _before(self, profile):
+    self._draw_start = time.perf_counter()
+
+  def _after(self, profile):
+    t = time.perf_counter()
+    self.handled += 1
+    self.latencies.append(t - self._emit_times.popleft())
+    self.draw_times.append(t - self._draw_start)
+    self._slots.release()
+
+  def take(self):
+    """
+    Returns latencies and draw times collected since the previous call.
+    """
+    latencies, self.latencies = self.latencies, []
+    draw_times, self.draw_times = self.draw_times, []
+    return latencies, draw_times
+
+class Soak:
+  def __init__(self, app: QApplication, window, board, probe: SweepProbe, args):
+    self.app = app
+    self.window = window
+    self.board = board
+    self.probe = probe
+    self.args = args
+    self.samples = []
+    self.snapshot_start = None
+    self.snapshot_end = None
+    self._start = 0
+    self._last_sample = 0
+    self._last_sweeps = 0
+    self._last_throttled = 0.0
+    self._timer = QTimer()
+    self._timer.timeout.connect(self.sample)
+
+  def start(self):
+    self._start = time.perf_counter()
+    self._last_sample = self._start
+    self._timer.start(int(self.args.interval * 1000))
+    QTimer.singleShot(int(self.args.warmup * 60 * 1000), self.take_start_snapshot)
+    QTimer.singleShot(int(self.args.hours * 3600 * 1000), self.app.quit)
+
+  def take_start_snapshot(self):
+    if tracemalloc.is_tracing():
+      self.snapshot_start = tracemalloc.take_snapshot()
+
+  def sample(self):
+    now = time.perf_counter()
+    # The timer fires late when the event loop is busy
+    elapsed = now - self._last_sample
+    lag = max(0.0, elapsed - self.args.interval)
+    sweeps = self.probe.handled - self._last_sweeps
+    throttled = self.probe.throttled - self._last_throttled
+    self._last_sample = now
+    self._last_sweeps = self.probe.handled
+    self._last_throttled = self.probe.throttled
+    latencies, draw_times = self.probe.take()
+    # Only what is still referenced counts, not garbage waiting for collection
+    gc.collect()
+    plot = self.window.plot
+    artists = len(plot.axes.get_children()) if hasattr(plot, "axes") else math.nan
+    row = {
+      "time_s": now - self._start,
+      "sweeps": self.probe.handled,
+      "sweeps_per_s": sweeps / elapsed,
+      "throttled_pct": throttled / elapsed * 100,
+      "rss_mb": rss_mb(),
+      "traced_mb": tracemalloc.get_traced_memory()[0] / 2**20 if tracemalloc.is_tracing() else math.nan,
+      "gc_objects": len(gc.get_objects()),
+      "qobjects": len(self.window.findChildren(QObject)),
+      "artists": artists,
+      "backlog": self.probe.emitted - self.probe.handled,
+      "loop_lag_ms": lag * 1000,
+      "latency_median_ms": np.median(latencies) * 1000 if latencies else math.nan,
+      "latency_p95_ms": np.percentile(latencies, 95) * 1000 if latencies else math.nan,
+      "latency_max_ms": max(latencies) * 1000 if latencies else math.nan,
+      "draw_median_ms": np.median(draw_times) * 1000 if draw_times else math.nan,
+    }
+    self.samples.append(row)
+    log.info(" ".join(f"{key}={row[key]:.4g}" for key in COLUMNS))
+
+  def finish(self):
+    self._timer.stop()
+    if tracemalloc.is_tracing():
+      self.snapshot_end = tracemalloc.take_snapshot()
+
+def write_samples(samples: list, file_name: str):
+  with open(file_name, "w", newline="") as f:
+    writer = csv.DictWriter(f, fieldnames=COLUMNS)
+    writer.writeheader()
+    for row in samples:
+      writer.writerow({key: f"{row[key]:.6g}" for key in COLUMNS})
+
+def growth(ts, vs):
+  """
+  Returns the growth of a linear fit over the series, relative to its start, and per hour.
+  """
+  ok = ~np.isnan(vs)
+  ts, vs = ts[ok], vs[ok]
+  if len(ts) < 3 or ts[-1] <= ts[0]:
+    return None
+  slope, intercept = np.polyfit(ts, vs, 1)
+  start = slope * ts[0] + intercept
+  total = slope * (ts[-1] - ts[0])
+  return (total / start if start > 0 else math.inf if total > 0 else 0.0), slope * 3600
+
+def make_report(soak: Soak, args) -> tuple:
+  """
+  Returns report lines and titles of flagged problems.
+  """
+  samples = [row for row in soak.samples if row["time_s"] >= args.warmup * 60]
+  lines = [
+    f"{APP_NAME} soak test",
+    f"Duration: {soak.samples[-1]['time_s'] / 3600 if soak.samples else 0:.2f} h, "
+      f"sweeps: {soak.probe.handled}, sweep interval: {args.sweep_interval} s, plot: {soak.window.plot_backend}",
+    f"Warm-up excluded: {args.warmup} min, samples analysed: {len(samples)}",
+    "",
+  ]
+  flags = []
+  if len(samples) < 4:
+    lines.append("Too few samples after the warm-up to analyse")
+    return lines, flags
+
+  ts = np.array([row["time_s"] for row in samples])
+  for key, title in GROWTH_CHECKS:
+    res = growth(ts, np.array([row[key] for row in samples], dtype=float))
+    if res is None:
+      continue
+    rel, per_hour = res
+    flagged = rel > args.growth
+    if flagged:
+      flags.append(title)
+    lines.append(f"{'LEAK? ' if flagged else '      '}{title:<24} {rel * 100:+7.1f}%  ({per_hour:+.4g} {key.split('_')[-1]}/h)")
+
+  quarter = max(1, len(samples) // 4)
+  for key, title in CREEP_CHECKS:
+    first = np.nanmedian([row[key] for row in samples[:quarter]])
+    last = np.nanmedian([row[key] for row in samples[-quarter:]])
+    if math.isnan(first) or math.isnan(last):
+      continue
+    # Small absolute changes are noise
+    flagged = last > first * (1 + args.creep) and last - first > 10.0
+    if flagged:
+      flags.append(title)
+    lines.append(f"{'CREEP ' if flagged else '      '}{title:<24} {first:8.2f} ms -> {last:8.2f} ms")
+
+  for key, title in DROP_CHECKS:
+    first = np.nanmedian([row[key] for row in samples[:quarter]])
+    last = np.nanmedian([row[key] for row in samples[-quarter:]])
+    flagged = last < first / (1 + args.creep)
+    if flagged:
+      flags.append(title)
+    lines.append(f"{'DROP  ' if flagged else '      '}{title:<24} {first:8.2f} /s -> {last:8.2f} /s")
+
+  throttled = np.mean([row["throttled_pct"] for row in samples])
+  lines.append(f"      {'Board waiting for draw':<24} {throttled:8.1f} % of time")
+
+  if soak.snapshot_start and soak.snapshot_end:
+    lines += ["", "Top allocation growth since the warm-up:"]
+    for stat in soak.snapshot_end.compare_to(soak.snapshot_start, "lineno")[:args.top]:
+      lines.append(f"  {stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocks  {stat.traceback}")
+
+  lines += ["", "Problems: " + (", ".join(flags) if flags else "none")]
+  return lines, flags
+
+def main():
+  parser = argparse.ArgumentParser(description=f"{APP_NAME} soak test")
+  parser.add_argument("--hours", type=float, default=1.0, help="Test duration (default: 1)")
+  parser.add_argument("--sweep-interval", type=float, default=0.02, help="Time of one virtual sweep in seconds (default: 0.02)")
+  parser.add_argument("--points", type=int, default=201, help="Points per sweep (default: 201)")
+  parser.add_argument("--max-backlog", type=int, default=2,
+    help="Profiles waiting to be drawn before the board waits for the window (default: 2)")
+  parser.add_argument("--plot", choices=("matplotlib", "fast"), help="Plot backend, the one last used by the app by default")
+  parser.add_argument("--interval", type=float, default=30, help="Sampling interval in seconds (default: 30)")
+  parser.add_argument("--warmup", type=float, default=5, help="Minutes excluded from the analysis (default: 5)")
+  parser.add_argument("--growth", type=float, default=0.1, help="Relative growth flagged as a leak (default: 0.1)")
+  parser.add_argument("--creep", type=float, default=0.25, help="Relative latency increase flagged as creep (default: 0.25)")
+  parser.add_argument("--trace-frames", type=int, default=1, help="Stack depth of tracked allocations, 0 to disable (default: 1)")
+  parser.add_argument("--top", type=int, default=15, help="Number of top allocators in the report (default: 15)")
+  parser.add_argument("--output", help="Directory for results (default: soak-<time>)")
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.INFO)
+  # Per-command messages of thousands of sweeps are of no interest
+  logging.getLogger("board").setLevel(logging.WARNING)
+  logging.getLogger("virtual_board").setLevel(logging.WARNING)
+
+  out_dir = args.output or time.strftime("soak-%Y%m%d-%H%M%S")
+  os.makedirs(out_dir, exist_ok=True)
+  if args.trace_frames > 0:
+    tracemalloc.start(args.trace_frames)
+
+  app = QApplication(sys.argv)
+  from virtual_board import VirtualBoard
+  board = VirtualBoard()
+  # The timeout of the virtual board is the sweep duration for 201 points
+  board.config.set_value(f"commands/{CMD.scans.value}/timeout", args.sweep_interval)
+  probe = SweepProbe(board, args.max_backlog)
+
+  # Import MainWindow after the board gets initialized
+  from main_window import MainWindow
+  window = MainWindow()
+  probe.connect_after(board)
+  if args.plot and args.plot != window.plot_backend:
+    # The choice is not saved, unlike choosing it in the menu
+    window.plot_backend = args.plot
+    threading.Thread(target=window.load_plot, args=(args.plot,), daemon=True).start()
+  window.show()
+
+  soak = Soak(app, window, board, probe, args)
+
+  def begin():
+    board.toggle_connection()
+    wait(lambda: board.can_home, board.home)
+    wait(lambda: board.can_move and window.plot, lambda: (board.scans(10, 10 + 0.1 * (args.points - 1), 0.1), soak.start()))
+
+  def wait(cond, then):
+    if cond():
+      then()
+    else:
+      QTimer.singleShot(50, lambda: wait(cond, then))
+
+  QTimer.singleShot(0, begin)
+  signal.signal(signal.SIGINT, lambda *_: app.quit())
+  log.info(f"Soak test for {args.hours} h, results in {out_dir}, press Ctrl+C to finish earlier")
+  app.exec()
+
+  soak.finish()
+  board.stop()
+  write_samples(soak.samples, os.path.join(out_dir, "samples.csv"))
+  lines, flags = make_report(soak, args)
+  with open(os.path.join(out_dir, "report.txt"), "w", encoding="utf-8") as f:
+    f.write("\n".join(lines) + "\n")
+  print("\n".join(lines))
+  return 1 if flags else 0
+
+if __name__ == "__main__":
+  sys.exit(main())
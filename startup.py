@@ -0,0 +1,99 @@
+import importlib.abc
+import logging
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+class _TimedLoader(importlib.abc.Loader):
+  """
+  Wraps a real loader for the time of module execution.
+  The real loader is put back into the module before it runs,
+  so nothing sees this wrapper after the module has been imported.
+  """
+  def __init__(self, profiler, loader):
+    self._profiler = profiler
+    self._loader = loader
+
+  def create_module(self, spec):
+    return self._loader.create_module(spec)
+
+  def exec_module(self, module):
+    module.__loader__ = self._loader
+    if module.__spec__:
+      module.__spec__.loader = self._loader
+    self._profiler._exec_module(self._loader, module)
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+  """
+  Measures how long each module takes to import.
+  Cumulative time includes nested imports, self time doesn't.
+  """
+  def __init__(self):
+    self._started = time.perf_counter()
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    # module -> [cumulative, self, thread name]
+    self._times = {}
+
+  def start(self):
+    sys.meta_path.insert(0, self)
+
+  def stop(self):
+    if self in sys.meta_path:
+      sys.meta_path.remove(self)
+
+  def find_spec(self, fullname, path, target=None):
+    if getattr(self._local, "finding", False):
+      return None
+    # Let other finders locate the module, only its loading is measured
+    self._local.finding = True
+    try:
+      for finder in sys.meta_path:
+        if finder is self or not hasattr(finder, "find_spec"):
+          continue
+        spec = finder.find_spec(fullname, path, target)
+        if spec is not None:
+          break
+      else:
+        return None
+    finally:
+      self._local.finding = False
+    if spec.loader is None or not hasattr(spec.loader, "exec_module"):
+      return spec
+    spec.loader = _TimedLoader(self, spec.loader)
+    return spec
+
+  def _exec_module(self, loader, module):
+    stack = getattr(self._local, "stack", None)
+    if stack is None:
+      stack = self._local.stack = []
+    # Time of nested imports is subtracted from the self time of this module
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+      loader.exec_module(module)
+    finally:
+      elapsed = time.perf_counter() - start
+      nested = stack.pop()
+      if stack:
+        stack[-1] += elapsed
+      with self._lock:
+        self._times[module.__name__] = [elapsed, elapsed - nested, threading.current_thread().name]
+
+  def mark(self, event: str):
+    """
+    Reports import times collected so far along with the time since start.
+    """
+    elapsed = time.perf_counter() - self._started
+    with self._lock:
+      times = sorted(self._times.items(), key=lambda t: t[1][0], reverse=True)
+    total = sum(t[1] for _, t in times)
+    lines = [
+      f"Startup: {event} in {elapsed:.3f}s, {len(times)} modules imported in {total:.3f}s",
+      f"{'cumulative':>10} {'self':>8}  module",
+    ]
+    for name, (cumulative, self_time, thread) in times[:40]:
+      lines.append(f"{cumulative:10.3f} {self_time:8.3f}  {name}" + (" (background)" if thread != "MainThread" else ""))
+    log.info("\n".join(lines))
@@ -0,0 +1,151 @@
+import itertools
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+_now = time.perf_counter_ns
+
+class TraceChannel:
+  """
+  Events of a subsystem, they are recorded only while the channel is enabled.
+  Recording just stores the event code and its arguments as they are,
+  events are formatted later in the writer thread. Callers check `enabled` first:
+
+    if SERIAL.enabled:
+      SERIAL(EV_SEND, cmd)
+  """
+  __slots__ = ("name", "enabled", "_tracer")
+
+  def __init__(self, tracer: 'Tracer', name: str):
+    self.name = name
+    self.enabled = False
+    self._tracer = tracer
+
+  def event(self, name: str, fmt: str) -> int:
+    """
+    Registers an event and returns its code.
+    The format gets event arguments as positional ones, e.g. "send:{0}".
+    """
+    return self._tracer._register(self.name, name, fmt)
+
+  def __call__(self, code: int, a = None, b = None):
+    t = self._tracer
+    seq = next(t._counter)
+    t._ring[seq & t._mask] = (seq, _now(), code, a, b)
+
+class Tracer:
+  """
+  Records events into a preallocated ring buffer, a background thread writes them out.
+  When the writer doesn't keep up, the oldest events are lost and their count is reported.
+  """
+  def __init__(self, size_pow2 = 16):
+    self._ring = [None] * (1 << size_pow2)
+    self._mask = (1 << size_pow2) - 1
+    self._counter = itertools.count()
+    self._events = []
+    self._channels = {}
+    self._lock = threading.Lock()
+    self._thread = None
+    self._file_name = None
+    self._max_size = 0
+    # Converts perf_counter_ns to the wall clock time
+    self._epoch = time.time() - _now() / 1e9
+    self.flush_interval = 0.2
+    self.lost = 0
+
+  def channel(self, name: str) -> TraceChannel:
+    self._lock.acquire()
+    try:
+      ch = self._channels.get(name)
+      if not ch:
+        ch = TraceChannel(self, name)
+        self._channels[name] = ch
+      return ch
+    finally:
+      self._lock.release()
+
+  def channels(self) -> list:
+    return list(self._channels.values())
+
+  def _register(self, channel: str, name: str, fmt: str) -> int:
+    self._lock.acquire()
+    try:
+      self._events.append((channel, name, fmt))
+      return len(self._events) - 1
+    finally:
+      self._lock.release()
+
+  def configure(self, config):
+    """
+    Enables channels listed in the "tracing" config section, it can be done at any time.
+    """
+    for ch in self.channels():
+      ch.enabled = bool(config.value(f"tracing/{ch.name}", False))
+    self._file_name = config.value("tracing/file", "") or None
+    self._max_size = int(config.value("tracing/max_file_mb", 50) * 1024 * 1024)
+    if any(ch.enabled for ch in self.channels()):
+      self.start()
+
+  def enable(self, name: str, enabled = True):
+    self.channel(name).enabled = enabled
+    if enabled:
+      self.start()
+
+  def start(self):
+    if not self._thread:
+      self._thread = threading.Thread(target=self._write_loop, daemon=True)
+      self._thread.start()
+
+  def _write_loop(self):
+    seq = 0
+    while True:
+      time.sleep(self.flush_interval)
+      lines = []
+      seq = self._collect(seq, lines)
+      if lines:
+        try:
+          self._write(lines)
+        except Exception:
+          log.exception("trace:write")
+
+  def _collect(self, seq: int, lines: list) -> int:
+    ring = self._ring
+    lost = 0
+    while True:
+      ev = ring[seq & self._mask]
+      if ev is not None and ev[0] > seq:
+        # Overwritten before written, the oldest event that can still be in the ring
+        # is a ring behind the one that took its place
+        lost += ev[0] - self._mask - seq
+        seq = ev[0] - self._mask
+        continue
+      if lost:
+        self.lost += lost
+        lines.append(f"trace: {lost} events lost")
+        lost = 0
+      if ev is None or ev[0] < seq:
+        return seq
+      _, t, code, a, b = ev
+      channel, name, fmt = self._events[code]
+      stamp = self._epoch + t / 1e9
+      try:
+        text = fmt.format(a, b)
+      except Exception as e:
+        text = f"{name} {a!r} {b!r} ({e})"
+      lines.append(f"{time.strftime('%H:%M:%S', time.localtime(stamp))}.{int(stamp * 1e6) % 1000000:06d} {channel} {text}")
+      seq += 1
+
+  def _write(self, lines: list):
+    if not self._file_name:
+      for line in lines:
+        log.debug(line)
+      return
+    if self._max_size and os.path.exists(self._file_name) and os.path.getsize(self._file_name) > self._max_size:
+      os.replace(self._file_name, self._file_name + ".1")
+    with open(self._file_name, "a", encoding="utf-8") as f:
+      f.write("\n".join(lines) + "\n")
+
+tracer = Tracer()
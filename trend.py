@@ -0,0 +1,125 @@
+import numpy as np
+
+class _Ring:
+  """
+  Fixed-size buffer of rows, the oldest rows are overwritten.
+  """
+  def __init__(self, capacity: int, width: int):
+    self.data = np.empty((capacity, width))
+    self.count = 0
+    self._next = 0
+
+  def append(self, row):
+    self.data[self._next] = row
+    self._next = (self._next + 1) % len(self.data)
+    self.count = min(self.count + 1, len(self.data))
+
+  def rows(self):
+    """
+    Returns rows from the oldest to the newest.
+    """
+    if self.count < len(self.data):
+      return self.data[:self.count]
+    return np.concatenate((self.data[self._next:], self.data[:self._next]))
+
+  def first_time(self) -> float:
+    if not self.count:
+      return None
+    return self.data[0 if self.count < len(self.data) else self._next, 0]
+
+class TrendHistory:
+  """
+  Fit results of sweeps over a long time.
+  Recent results are kept as is, older ones are only available
+  as min/mean/max of time buckets, the longer ago the coarser.
+  Memory used is fixed regardless of how long the measurement goes.
+  """
+  raw_capacity = 20000
+  # Bucket duration in seconds and the number of buckets kept for each level
+  levels = ((10, 8640), (60, 10080), (600, 4320), (3600, 8760))
+
+  def __init__(self, metrics: tuple):
+    self.metrics = metrics
+    m = len(metrics)
+    self._raw = _Ring(self.raw_capacity, 1 + m)
+    # Rows are time, then min, mean and max of each metric
+    self._rollups = [_Ring(capacity, 1 + 3 * m) for _, capacity in self.levels]
+    # Buckets being filled: start time, min, max, sum, count
+    self._open = [None] * len(self.levels)
+
+  def clear(self):
+    self.__init__(self.metrics)
+
+  def add(self, t: float, values):
+    values = np.asarray(values, dtype=float)
+    self._raw.append(np.concatenate(([t], values)))
+    for i, (size, _) in enumerate(self.levels):
+      bucket = self._open[i]
+      start = t - t % size
+      if bucket and bucket[0] != start:
+        self._close(i)
+        bucket = None
+      if not bucket:
+        self._open[i] = [start, values.copy(), values.copy(), values.copy(), 1]
+      else:
+        np.fmin(bucket[1], values, out=bucket[1])
+        np.fmax(bucket[2], values, out=bucket[2])
+        bucket[3] += values
+        bucket[4] += 1
+
+  def _bucket_row(self, level: int):
+    start, lo, hi, total, count = self._open[level]
+    row = np.empty(1 + 3 * len(self.metrics))
+    row[0] = start + self.levels[level][0] / 2.0
+    row[1::3] = lo
+    row[2::3] = total / count
+    row[3::3] = hi
+    return row
+
+  def _close(self, level: int):
+    self._rollups[level].append(self._bucket_row(level))
+    self._open[level] = None
+
+  def _level_rows(self, level: int):
+    # Closed buckets and the one being filled, so the latest results are shown at any zoom
+    rows = self._rollups[level].rows()
+    if self._open[level]:
+      rows = np.vstack((rows, self._bucket_row(level)))
+    return rows
+
+  def time_span(self):
+    """
+    Returns times of the first and the last results, or None if there are no results.
+    """
+    if not self._raw.count:
+      return None
+    first = self._raw.first_time()
+    for ring in self._rollups:
+      t = ring.first_time()
+      if t is not None:
+        first = min(first, t)
+    return first, self._raw.rows()[-1, 0]
+
+  def query(self, t0: float, t1: float, metric: str, max_points: int):
+    """
+    Returns times and min, mean, max values of a metric between `t0` and `t1`,
+    at the finest resolution which covers the range and gives no more than `max_points`.
+    """
+    k = self.metrics.index(metric)
+    raw = self._raw.rows()
+    if not len(raw):
+      empty = np.empty(0)
+      return empty, empty, empty, empty
+    i0, i1 = np.searchsorted(raw[:, 0], (t0, t1))
+    if raw[0, 0] <= t0 and i1 - i0 <= max_points:
+      ts = raw[i0:i1, 0]
+      vs = raw[i0:i1, 1 + k]
+      return ts, vs, vs, vs
+    for level, (size, _) in enumerate(self.levels):
+      rows = self._level_rows(level)
+      i0, i1 = np.searchsorted(rows[:, 0], (t0, t1))
+      # The coarsest level is used anyway, it keeps the longest history
+      if rows[0, 0] <= t0 + size and i1 - i0 <= max_points or level == len(self.levels) - 1:
+        break
+    rows = rows[i0:i1]
+    return rows[:, 0], rows[:, 1 + 3 * k], rows[:, 2 + 3 * k], rows[:, 3 + 3 * k]
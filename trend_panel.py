@@ -0,0 +1,201 @@
+import time
+import numpy as np
+from PySide6.QtCore import Qt, QPointF, QRectF
+from PySide6.QtGui import QColor, QPainter, QPen
+from PySide6.QtWidgets import QComboBox, QHBoxLayout, QPushButton, QVBoxLayout, QWidget
+
+from fast_plot import make_polygon, nice_ticks
+from trend import TrendHistory
+
+# Metrics tracked for each sweep and their titles
+TREND_METRICS = (
+  ("duration", "Pulse duration (fs)"),
+  ("fwhm", "Autocorrelation FWHM (fs)"),
+  ("center", "Peak position (µm)"),
+)
+
+# Preset view spans in seconds
+TREND_SPANS = (
+  ("1 min", 60),
+  ("10 min", 600),
+  ("1 h", 3600),
+  ("6 h", 6 * 3600),
+  ("1 day", 86400),
+  ("1 week", 7 * 86400),
+)
+
+# Candidate time tick steps in seconds
+_TIME_STEPS = (1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400, 172800)
+
+def make_trend_history() -> TrendHistory:
+  return TrendHistory(tuple(key for key, _ in TREND_METRICS))
+
+class TrendPlot(QWidget):
+  """
+  Shows a metric over time, as mean values and the band between min and max.
+  Mouse wheel zooms in time, dragging scrolls to earlier results.
+  While the view ends at the latest result, it follows new results.
+  """
+  margin_left = 70
+  margin_right = 20
+  margin_top = 10
+  margin_bottom = 30
+
+  def __init__(self, history: TrendHistory, parent=None):
+    super().__init__(parent)
+    self.history = history
+    self.metric_key = TREND_METRICS[0][0]
+    self.span = 600.0
+    # End of the view, None to follow the latest results
+    self.end = None
+    self._drag = None
+    self.setAttribute(Qt.WA_OpaquePaintEvent)
+    self.setMinimumHeight(120)
+    self._pen_mean = QPen(QColor(0, 0, 200), 0)
+    self._brush_band = QColor(0, 0, 200, 50)
+    self._pen_grid = QPen(QColor(0, 0, 0, 40), 1)
+    self._pen_axes = QPen(QColor(0, 0, 0), 1)
+
+  def plot_rect(self) -> QRectF:
+    return QRectF(self.margin_left, self.margin_top,
+      max(1, self.width() - self.margin_left - self.margin_right),
+      max(1, self.height() - self.margin_top - self.margin_bottom))
+
+  def view_range(self):
+    end = self.end
+    if end is None:
+      span = self.history.time_span()
+      end = span[1] if span else time.time()
+    return end - self.span, end
+
+  def set_span(self, span: float):
+    self.span = span
+    self.update()
+
+  def follow(self):
+    self.end = None
+    self.update()
+
+  def _set_end(self, end: float):
+    span = self.history.time_span()
+    self.end = None if not span or end >= span[1] else end
+    self.update()
+
+  def wheelEvent(self, event):
+    rect = self.plot_rect()
+    t0, t1 = self.view_range()
+    # Keep the time under the cursor in place
+    frac = min(1.0, max(0.0, (event.position().x() - rect.left()) / rect.width()))
+    t = t0 + frac * (t1 - t0)
+    factor = 0.8 ** (event.angleDelta().y() / 120)
+    self.span = min(max(self.span * factor, 5.0), 3e7)
+    self._set_end(t + (1 - frac) * self.span)
+
+  def mousePressEvent(self, event):
+    if event.button() == Qt.LeftButton:
+      self._drag = (event.position().x(), self.view_range()[1])
+
+  def mouseMoveEvent(self, event):
+    if self._drag:
+      x, end = self._drag
+      self._set_end(end - (event.position().x() - x) * self.span / self.plot_rect().width())
+
+  def mouseReleaseEvent(self, event):
+    self._drag = None
+
+  def paintEvent(self, event):
+    p = QPainter(self)
+    p.fillRect(self.rect(), Qt.white)
+    rect = self.plot_rect()
+    t0, t1 = self.view_range()
+    ts, lo, mean, hi = self.history.query(t0, t1, self.metric_key, int(rect.width()))
+    if len(ts):
+      y0, y1 = float(np.nanmin(lo)), float(np.nanmax(hi))
+    else:
+      y0, y1 = 0.0, 1.0
+    if y1 <= y0:
+      y0, y1 = y0 - 1, y1 + 1
+    dy = (y1 - y0) * 0.05
+    y0, y1 = y0 - dy, y1 + dy
+    sx = rect.width() / (t1 - t0)
+    sy = rect.height() / (y1 - y0)
+    to_x = lambda v: rect.left() + (v - t0) * sx
+    to_y = lambda v: rect.bottom() - (v - y0) * sy
+
+    self._draw_axes(p, rect, t0, t1, y0, y1, to_x, to_y)
+    if not len(ts):
+      return
+    p.setRenderHint(QPainter.Antialiasing)
+    p.setClipRect(rect)
+    if np.any(hi > lo):
+      p.setPen(Qt.NoPen)
+      p.setBrush(self._brush_band)
+      p.drawPolygon(make_polygon(to_x(np.concatenate((ts, ts[::-1]))), to_y(np.concatenate((hi, lo[::-1])))))
+      p.setBrush(Qt.NoBrush)
+    p.setPen(self._pen_mean)
+    p.drawPolyline(make_polygon(to_x(ts), to_y(mean)))
+
+  def _draw_axes(self, p: QPainter, rect: QRectF, t0, t1, y0, y1, to_x, to_y):
+    fm = p.fontMetrics()
+    for v in nice_ticks(y0, y1, max(2, int(rect.height() / 40))):
+      y = to_y(v)
+      p.setPen(self._pen_grid)
+      p.drawLine(QPointF(rect.left(), y), QPointF(rect.right(), y))
+      p.setPen(self._pen_axes)
+      text = f"{v:g}"
+      p.drawText(QPointF(rect.left() - 6 - fm.horizontalAdvance(text), y + fm.ascent() / 2 - 1), text)
+
+    # Time ticks are aligned to the local time
+    count = max(2, int(rect.width() / 110))
+    step = next((s for s in _TIME_STEPS if s >= (t1 - t0) / count), _TIME_STEPS[-1])
+    offset = time.localtime(t1).tm_gmtoff
+    first = np.ceil((t0 + offset) / step) * step - offset
+    fmt = "%H:%M:%S" if step < 60 else "%H:%M" if step < 86400 else "%m-%d"
+    if step >= 3600 and t1 - t0 > 86400:
+      fmt = "%m-%d %H:%M"
+    t = first
+    while t <= t1:
+      x = to_x(t)
+      p.setPen(self._pen_grid)
+      p.drawLine(QPointF(x, rect.top()), QPointF(x, rect.bottom()))
+      p.setPen(self._pen_axes)
+      text = time.strftime(fmt, time.localtime(t))
+      p.drawText(QPointF(x - fm.horizontalAdvance(text) / 2, rect.bottom() + 6 + fm.ascent()), text)
+      t += step
+    p.setPen(self._pen_axes)
+    p.drawRect(rect)
+
+class TrendPanel(QWidget):
+  def __init__(self, history: TrendHistory, parent=None):
+    super().__init__(parent)
+    self.plot = TrendPlot(history)
+
+    self.combo_metric = QComboBox()
+    for key, title in TREND_METRICS:
+      self.combo_metric.addItem(title, key)
+    self.combo_metric.currentIndexChanged.connect(self._metric_changed)
+
+    tools = QHBoxLayout()
+    tools.addWidget(self.combo_metric)
+    tools.addStretch()
+    for title, span in TREND_SPANS:
+      but = QPushButton(title)
+      but.clicked.connect(lambda _=False, span=span: self.plot.set_span(span))
+      tools.addWidget(but)
+    but = QPushButton("Latest")
+    but.setToolTip("Follow new results")
+    but.clicked.connect(self.plot.follow)
+    tools.addWidget(but)
+
+    layout = QVBoxLayout(self)
+    layout.setContentsMargins(4, 4, 4, 4)
+    layout.addLayout(tools)
+    layout.addWidget(self.plot)
+
+  def _metric_changed(self):
+    self.plot.metric_key = self.combo_metric.currentData()
+    self.plot.update()
+
+  def result_added(self):
+    if self.isVisible() and self.plot.end is None:
+      self.plot.update()
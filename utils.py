@@ -2,7 +2,6 @@ import json
 import os
 import pathlib
 import sys
-import numpy as np
 from PySide6.QtGui import QIcon
 from PySide6.QtCore import QObject, QEvent
 
@@ -37,15 +36,40 @@ def load_json(file_name) -> dict:
     except Exception as e:
       raise Exception(f"Failed to parse file {fn}: {e}")
 
-def make_sample_profile():
-  start_pos = 10
-  scan_range = 20
-  profile_center = start_pos + scan_range / 2.0
+def state_file(name) -> str:
+  """
+  Returns a path of a file for data that the app keeps between sessions
+  """
+  return os.path.join(app_dir(), 'state', name + '.json')
+
+def load_state(name) -> dict:
+  fn = state_file(name)
+  if not os.path.exists(fn):
+    return {}
+  with open(fn, 'r') as f:
+    try:
+      return json.load(f)
+    except Exception as e:
+      raise Exception(f"Failed to parse file {fn}: {e}")
+
+def save_state(name, data: dict):
+  fn = state_file(name)
+  os.makedirs(os.path.dirname(fn), exist_ok=True)
+  # Write to a temporary file first to not lose
+  # the previous state if the app crashes while writing
+  tmp = fn + '.tmp'
+  with open(tmp, 'w') as f:
+    json.dump(data, f)
+  os.replace(tmp, fn)
+
+def make_sample_profile(start_pos = 10, stop_pos = 30, step = 0.1):
+  import numpy as np
+  profile_center = 20
   y_max = 1000
-  profile_width = scan_range / 10.0
-  num_points = 201
+  profile_width = 2
+  num_points = int(round((stop_pos - start_pos) / step)) + 1
   noise_level = 0.05
-  x = np.linspace(start_pos, start_pos + scan_range, num_points)
+  x = np.linspace(start_pos, start_pos + step * (num_points - 1), num_points)
   profile = y_max * np.exp(-((profile_center-x)**2) / (2 * profile_width**2))
   noise = np.random.normal(0, y_max * noise_level, num_points)
   y = profile + noise
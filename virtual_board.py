@@ -1,15 +1,19 @@
 import logging
 import time
+import numpy as np
 
 from board import Board
 from consts import CMD
-from utils import make_sample_profile
+from scan_profile import ScanProfile
+from utils import load_state, make_sample_profile, save_state
 
 log = logging.getLogger(__name__)
 
 class VirtualBoard(Board):
   _cmd_error = None
   _params_received = 0
+  _params_to_send = []
+  _params_version = 1
   _stored_params = {
     "p1": "Hello World",
     "p2": "42",
@@ -17,20 +21,25 @@ class VirtualBoard(Board):
     "p4": "1",
     "p5": "32"
   }
+  # Version of the parameter set when each parameter was changed last time
+  _params_changed = {}
 
   def __init__(self):
     super().__init__(log, \
       {
         "commands": {
-          CMD.connect: { "timeout": 0.5 },
-          CMD.disconnect: { "timeout": 0.5 },
-          CMD.home: { "timeout": 2 },
-          CMD.stop: { "timeout": 0.5 },
-          CMD.move: { "timeout": 2 },
-          CMD.jog: { "timeout": 0.5 },
-          CMD.scan: { "timeout": 0.25 },
-          CMD.scans: { "timeout": 0.25 },
-          CMD.param: { "timeout": 0.10 },
+          CMD.connect.value: { "timeout": 0.5 },
+          CMD.disconnect.value: { "timeout": 0.5 },
+          CMD.home.value: { "timeout": 2 },
+          CMD.stop.value: { "timeout": 0.5 },
+          CMD.move.value: { "timeout": 2 },
+          CMD.jog.value: { "timeout": 0.5 },
+          CMD.scan.value: { "timeout": 0.25, "channels": "signal, reference", "reference": "reference" },
+          CMD.scans.value: { "timeout": 0.25, "channels": "signal, reference", "reference": "reference" },
+          CMD.param.value: { "timeout": 0.10, "batch_store": True },
+        },
+        "operations": {
+          "scan_full_range": "0 40 0.2",
         },
         "parameters": {
           "p1": {
@@ -59,6 +68,26 @@ class VirtualBoard(Board):
         }
       }
     )
+    # Stored parameters are kept between sessions as a real board does,
+    # otherwise the app's cache of them would be ahead of the board
+    try:
+      memory = load_state("virtual_board")
+    except Exception:
+      log.exception("load_virtual_board")
+      memory = {}
+    self._stored_params = {**self._stored_params, **memory.get("params", {})}
+    self._params_version = memory.get("version", self._params_version)
+    self._params_changed = dict(memory.get("changed", {}))
+
+  def _save_memory(self):
+    try:
+      save_state("virtual_board", {
+        "params": self._stored_params,
+        "version": self._params_version,
+        "changed": self._params_changed,
+      })
+    except Exception:
+      log.exception("save_virtual_board")
 
   def port(self):
     return "VIRTUAL"
@@ -66,9 +95,10 @@ class VirtualBoard(Board):
   def loop(self):
     while True:
       time.sleep(0.001)
+      self.profiler.poll()
 
       self._lock.acquire()
-      next_cmd = self._next_cmd
+      next_cmd = self._peek_command()
       cancel = self._cancel_cmd
       self._lock.release()
 
@@ -92,18 +122,16 @@ class VirtualBoard(Board):
           raise Exception(err)
 
         if next_cmd:
-          self._lock.acquire()
-          self._next_cmd = None
-          self._cancel_cmd = False
-          self._lock.release()
-
-          self._cmd = next_cmd
+          self._cmd, self._cmd_args = self._take_next_command()
           log.info(f"begin:{self._cmd}")
           cmd = self.config.cmd_spec(self._cmd)
           self._prepare_command()
           self.on_command_beg.emit(self._cmd)
           self._cmd_start = time.perf_counter()
           self._cmd_timeout = cmd.timeout
+          if (self._cmd == CMD.scan or self._cmd == CMD.scans) and "start" in self._cmd_args:
+            # Timeout is the duration of the default 201-point scan
+            self._cmd_timeout *= self._scan_points(self._cmd_args) / 201
 
       except Exception as e:
         log.exception(f"error:{self._cmd}")
@@ -111,8 +139,30 @@ class VirtualBoard(Board):
 
   def _prepare_command(self):
     # Do some stuff before command start
-    if self._cmd == CMD.param:
+    if self._cmd == CMD.param and not self._cmd_args.get("store"):
       self._params_received = 0
+      # Simulate reading of only changed parameters
+      params, version = self.cached_params(self.port())
+      if params is not None:
+        self.params = params
+        self._params_to_send = [name for name in self._stored_params
+          if self._params_changed.get(name, 0) > int(version)]
+      else:
+        self._params_to_send = [*self._stored_params]
+
+  def _scan_profile(self) -> ScanProfile:
+    args = self._cmd_args
+    if "start" in args:
+      xs, ys = make_sample_profile(args["start"], args["stop"], args["step"])
+    else:
+      xs, ys = make_sample_profile()
+    profile = self._new_profile(self._cmd, len(xs))
+    # The sweep has been going since the command start or the previous sweep
+    profile.started -= time.perf_counter() - self._cmd_start
+    # The laser power drifts during the sweep, the reference photodiode sees it too
+    power = 1 + 0.2 * np.sin(np.linspace(0, np.pi * np.random.uniform(1, 3), len(xs)))
+    profile.assign(xs, ys * power, 500 * power)
+    return profile
 
   def _command_done(self) -> bool:
     if self._cmd == CMD.home:
@@ -129,33 +179,35 @@ class VirtualBoard(Board):
       return True
 
     if self._cmd == CMD.scan:
-      self.on_data_received.emit(*make_sample_profile())
+      self._publish_profile(self._scan_profile())
       return True
 
     if self._cmd == CMD.scans:
-      self.on_data_received.emit(*make_sample_profile())
+      self._publish_profile(self._scan_profile())
       self._cmd_start = time.perf_counter()
       return False
 
     if self._cmd == CMD.param:
       if self._cmd_args.get("store"):
         # Store params
-        params = self._cmd_args["params"]
-        name = [*params][0]
-        value = params[name]
-        self._stored_params[name] = value
-        log.info(f"param_stored:{name}={value}")
-        del params[name]
-        self.on_param_stored.emit(len(params) > 0)
+        self._params_version += 1
+        for name, value in self._cmd_args["params"].items():
+          self._stored_params[name] = value
+          self._params_changed[name] = self._params_version
+          log.info(f"param_stored:{name}={value}")
+        self._save_memory()
+        self._params_stored(self._cmd_args["params"])
         return True
       else:
         # Receive params
-        names = [*self._stored_params]
-        name = names[self._params_received]
-        self.params[name] = self._stored_params[name]
-        self._params_received += 1
-        log.debug(f"param_received:{self._params_received}/{len(names)}:{name}={self.params[name]}")
+        names = self._params_to_send
+        if self._params_received < len(names):
+          name = names[self._params_received]
+          self.params[name] = self._stored_params[name]
+          self._params_received += 1
+          log.debug(f"param_received:{self._params_received}/{len(names)}:{name}={self.params[name]}")
         if self._params_received == len(names):
+          self._cache_params(self.port(), str(self._params_version))
           self.on_params_received.emit()
           return True
         self._cmd_start = time.perf_counter()